@@ -0,0 +1,88 @@
+# time of pages with many placements of the same form( map symbols ), with and without a FormCache
+#
+# builds a synthetic one page pdf with a symbol form( a few paths and a label ) drawn many times, and parses it
+#   - as pdfminer does, interpreting the form at every Do
+#   - with a FormCache, which interprets it once and replays it at the other placements
+# and checks that both give the same objects
+#
+# usage: python -m benchmarks.bench_form_cache [num_placements]
+import io
+import sys
+import time
+
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfinterp import PDFResourceManager
+
+from geospatial_pdf.geospatial import (PDFPageOptionalGenericTextAggregator,
+                                       PDFOptionalGenericTextInterpreter)
+from geospatial_pdf.layers.forms import FormCache
+from geospatial_pdf.layers.index import iter_layout_objs
+
+
+SYMBOL = (b'q 0.2 w 0 0 m 4 0 l 4 4 l 0 4 l h S 2 2 m 2 6 l S Q '
+          b'q 0.5 0 0 0.5 1 1 cm 0 0 2 2 re f Q '
+          b'BT /F1 3 Tf 5 0 Td (Well) Tj ET')
+
+
+def get_pdf(num_placements):
+    placements = []
+    for i in range(num_placements):
+        (x, y) = (10 + (i * 37) % 580, 10 + (i * 53) % 770)
+        placements.append(b'q 0.9 0.1 -0.1 0.9 %d %d cm /Sym Do Q' % (x, y))
+    content = b'\n'.join(placements)
+    objs = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R '
+        b'/Resources << /XObject << /Sym 5 0 R >> >> >>',
+        b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream',
+        b'<< /Type /XObject /Subtype /Form /BBox [0 0 20 8] /Resources << /Font << /F1 6 0 R >> >> '
+        b'/Length %d >>\nstream\n' % len(SYMBOL) + SYMBOL + b'\nendstream',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    out = bytearray(b'%PDF-1.5\n')
+    offsets = []
+    for i, obj in enumerate(objs):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % (i + 1) + obj + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objs) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objs) + 1, xref)
+    return bytes(out)
+
+
+def run(data, form_cache):
+    document = PDFDocument(PDFParser(io.BytesIO(data)))
+    rsrcmgr = PDFResourceManager(caching=True)
+    device = PDFPageOptionalGenericTextAggregator(rsrcmgr, compact=True)
+    interpreter = PDFOptionalGenericTextInterpreter(rsrcmgr, device)
+    if form_cache is not None:
+        interpreter.set_form_cache(form_cache)
+    device.set_active_combo_lists([])
+    start = time.perf_counter()
+    for page in PDFPage.create_pages(document):
+        interpreter.process_page(page)
+    taken = time.perf_counter() - start
+    return device.get_result()[0], taken
+
+
+def get_signature(layout):
+    return [ (type(obj).__name__, tuple(round(v, 6) for v in obj.bbox))
+             for obj in iter_layout_objs(layout) ]
+
+
+if __name__ == '__main__':
+    num_placements = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    data = get_pdf(num_placements)
+    (plain_page, plain_time) = run(data, None)
+    form_cache = FormCache()
+    (cached_page, cached_time) = run(data, form_cache)
+    assert get_signature(plain_page) == get_signature(cached_page)
+
+    print(f'placements: {num_placements}, objects: {len(get_signature(plain_page))}')
+    print(f'interpreted every time: {plain_time:6.2f}s')
+    print(f'form cache:             {cached_time:6.2f}s ( hits: {form_cache.hits}, misses: {form_cache.misses} )')
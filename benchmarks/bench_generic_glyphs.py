@@ -0,0 +1,82 @@
+# micro-benchmark for glyph construction in the generic text device
+#
+# builds rotated LTCharGenerics the way PDFGenericTextDevice.render_char_generic does, with
+#   - a replica of the old approach, which creates a shapely Polygon for every glyph to get its bounds
+#   - the current LTCharGeneric, which computes the bounds from the corners and builds the polygon lazily
+# and checks that both agree on the bounds
+#
+# usage: python -m benchmarks.bench_generic_glyphs [num_glyphs]
+import sys
+import math
+import time
+
+from pdfminer.psparser import LIT
+from pdfminer.pdfinterp import PDFResourceManager
+from pdfminer.utils import translate_matrix
+from shapely.geometry import Polygon
+
+from geospatial_pdf.generictext import LTCharGeneric, build_polygons
+
+
+class EagerLTCharGeneric(LTCharGeneric):
+    def set_bound_points(self, points):
+        self.pts = points
+        self._polygon = Polygon(points)
+        self.set_bbox(self._polygon.bounds)
+
+
+def get_font():
+    rsrcmgr = PDFResourceManager()
+    spec = { 'Type': LIT('Font'), 'Subtype': LIT('Type1'), 'BaseFont': LIT('Helvetica') }
+    return rsrcmgr.get_font(None, spec)
+
+
+def get_synthetic_glyphs(num_glyphs, text='Kanchipuram Road 12 ', fontsize=8):
+    # curved label like placement, every glyph at a slightly different angle
+    glyphs = []
+    for i in range(num_glyphs):
+        angle = (i % 360) * math.pi / 180
+        (c, s) = (math.cos(angle), math.sin(angle))
+        matrix = translate_matrix((c, s, -s, c, 100 + i % 500, 100 + i % 700), (i % 7, 0))
+        glyphs.append((matrix, ord(text[i % len(text)])))
+    return glyphs
+
+
+def make_chars(CharClass, font, glyphs, fontsize=8, scaling=1.0, rise=0):
+    chars = []
+    for (matrix, cid) in glyphs:
+        chars.append(CharClass(matrix, font, fontsize, scaling, rise,
+                               font.to_unichr(cid), font.char_width(cid), font.char_disp(cid),
+                               None, None))
+    return chars
+
+
+def bench(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        taken = time.perf_counter() - start
+        best = taken if best is None else min(best, taken)
+    return best
+
+
+if __name__ == '__main__':
+    num_glyphs = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    font = get_font()
+    glyphs = get_synthetic_glyphs(num_glyphs)
+
+    eager = make_chars(EagerLTCharGeneric, font, glyphs)
+    lazy = make_chars(LTCharGeneric, font, glyphs)
+    for (e, l) in zip(eager, lazy):
+        assert all(math.isclose(a, b, abs_tol=1e-9) for a, b in zip(e.bbox, l.bbox)), (e, l)
+
+    eager_time = bench(lambda: make_chars(EagerLTCharGeneric, font, glyphs))
+    lazy_time = bench(lambda: make_chars(LTCharGeneric, font, glyphs))
+    bulk_time = bench(lambda: build_polygons(make_chars(LTCharGeneric, font, glyphs)))
+    print(f'glyphs: {num_glyphs}')
+    print(f'eager polygon: {num_glyphs/eager_time:12.0f} glyphs/sec')
+    print(f'lazy polygon:  {num_glyphs/lazy_time:12.0f} glyphs/sec')
+    print(f'bulk polygons: {num_glyphs/bulk_time:12.0f} glyphs/sec')
+    print(f'speedup: {eager_time/lazy_time:.1f}x')
@@ -0,0 +1,80 @@
+# time of label assembly over many rotated glyphs, and a check that the labels don't depend on drawing order
+#
+# builds curved and straight synthetic labels of glyphs of mixed widths( see bench_generic_glyphs ),
+# assembles them in drawing order, reversed and shuffled, and checks that all give the same labels.
+# duplicates are kept, which one of two overlapping glyphs is dropped depends on the drawing order on purpose
+#
+# usage: python -m benchmarks.bench_labels [num_labels] [seed]
+import sys
+import math
+import time
+import random
+
+from geospatial_pdf.generictext import LTCharGeneric
+from geospatial_pdf.generictext.labels import LabelParams, assemble_labels
+
+try:
+    from benchmarks.bench_generic_glyphs import get_font, make_chars
+except ImportError:
+    # run as a script, python benchmarks/bench_labels.py
+    from bench_generic_glyphs import get_font, make_chars
+
+
+# wide and narrow glyphs next to each other
+WORDS = ['Wimi', 'MILL', 'iWi Wai', 'Mt Ilim', 'lWlW']
+
+
+def get_label_glyphs(rng, num_labels):
+    glyphs = []
+    for _ in range(num_labels):
+        text = rng.choice(WORDS)
+        (x, y) = (rng.uniform(0, 5000), rng.uniform(0, 5000))
+        angle = rng.uniform(0, 2 * math.pi)
+        turn = rng.choice([0, rng.uniform(-0.1, 0.1)])
+        for ch in text:
+            (c, s) = (math.cos(angle), math.sin(angle))
+            glyphs.append(((c, s, -s, c, x, y), ord(ch)))
+            # gaps around the char_margin, so that some pairs only just link
+            step = 10 * (0.6 if ch in 'il ' else 1.0) + rng.uniform(0, 9)
+            (x, y) = (x + step * c, y + step * s)
+            angle += turn
+    return glyphs
+
+
+def get_signature(labels):
+    return sorted(tuple(sorted((c.get_text(), round(c.x0, 6), round(c.y0, 6))
+                               for c in label if isinstance(c, LTCharGeneric)))
+                  for label in labels)
+
+
+def check_pair(font):
+    # a wide and a narrow glyph, close enough only for the reach of the wide one
+    chars = make_chars(LTCharGeneric, font, [((1, 0, 0, 1, 100, 100), ord('W')),
+                                             ((1, 0, 0, 1, 114, 100), ord('i'))], fontsize=12)
+    for order in (chars, chars[::-1]):
+        assert [ label.get_text() for label in assemble_labels(order) ] == ['W i']
+
+
+if __name__ == '__main__':
+    num_labels = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+    rng = random.Random(seed)
+    font = get_font()
+    check_pair(font)
+    chars = make_chars(LTCharGeneric, font, get_label_glyphs(rng, num_labels), fontsize=10)
+
+    labelparams = LabelParams(drop_duplicates=False)
+    start = time.perf_counter()
+    labels = assemble_labels(chars, labelparams)
+    taken = time.perf_counter() - start
+    signature = get_signature(labels)
+
+    shuffled = list(chars)
+    rng.shuffle(shuffled)
+    for label, order in (('reversed', chars[::-1]), ('shuffled', shuffled)):
+        mismatches = len(set(signature) ^ set(get_signature(assemble_labels(order, labelparams))))
+        print(f'{label}: {mismatches} labels differ from drawing order')
+        assert mismatches == 0
+
+    print(f'glyphs: {len(chars)}, labels: {len(labels)}, {len(chars)/taken:10.0f} glyphs/sec')
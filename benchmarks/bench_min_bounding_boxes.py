@@ -0,0 +1,77 @@
+# time of minimum area rotated rectangles of many point sets, against shapely's oriented_envelope
+#
+# makes random point sets and nearly collinear ones( points on a line, off it by anything from 1e-16 to 1e-3,
+# near and far from the origin ), and for each kind
+#   - times minimum_bounding_boxes_flat and shapely.oriented_envelope on all the sets
+#   - checks that the areas agree, and that the sides are the extents of the points along the unit vector
+#
+# usage: python -m benchmarks.bench_min_bounding_boxes [num_sets] [seed]
+import sys
+import time
+
+import numpy as np
+import shapely
+
+from geospatial_pdf.generictext.utils import minimum_bounding_boxes_flat
+
+
+def get_random_sets(rng, num_sets):
+    counts = rng.integers(1, 30, size=num_sets)
+    scales = np.repeat(rng.uniform(0.1, 100, size=num_sets), counts)
+    points = rng.normal(size=(counts.sum(), 2)) * scales[:, None]
+    return points, counts
+
+
+def get_collinear_sets(rng, num_sets, offset):
+    counts = rng.integers(2, 30, size=num_sets)
+    set_ids = np.repeat(np.arange(num_sets), counts)
+    angles = rng.uniform(0, 2 * np.pi, size=num_sets)
+    # axis aligned and diagonal lines too
+    snapped = rng.random(num_sets) < 0.3
+    angles[snapped] = rng.integers(0, 8, size=snapped.sum()) * np.pi / 4
+    d = np.column_stack([np.cos(angles), np.sin(angles)])[set_ids]
+    n = np.column_stack([-d[:, 1], d[:, 0]])
+    t = rng.uniform(-50, 50, size=len(set_ids))
+    off = rng.normal(size=len(set_ids)) * 10.0 ** rng.uniform(-16, -3, size=num_sets)[set_ids]
+    origins = rng.uniform(-offset, offset, size=(num_sets, 2))[set_ids]
+    return t[:, None] * d + off[:, None] * n + origins, counts
+
+
+def check(label, points, counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    set_ids = np.repeat(np.arange(len(counts)), counts)
+
+    start = time.perf_counter()
+    boxes = minimum_bounding_boxes_flat(points, offsets)
+    flat_time = time.perf_counter() - start
+    start = time.perf_counter()
+    envelopes = shapely.oriented_envelope(shapely.multipoints(points, indices=set_ids))
+    shapely_time = time.perf_counter() - start
+
+    # extents of the points along the chosen directions
+    u = boxes.unit_vector[set_ids]
+    pu = np.einsum('ij,ij->i', points, u)
+    pn = points[:, 1] * u[:, 0] - points[:, 0] * u[:, 1]
+    length_parallel = np.maximum.reduceat(pu, offsets[:-1]) - np.minimum.reduceat(pu, offsets[:-1])
+    length_orthogonal = np.maximum.reduceat(pn, offsets[:-1]) - np.minimum.reduceat(pn, offsets[:-1])
+
+    spans = np.maximum.reduceat(np.abs(points).max(axis=1), offsets[:-1]) + 1
+    tol = 1e-9 * spans
+    bad = (np.abs(boxes.length_parallel - length_parallel) > tol) | \
+          (np.abs(boxes.length_orthogonal - length_orthogonal) > tol) | \
+          (np.abs(boxes.area - shapely.area(envelopes)) > tol * spans)
+    print(f'{label:<24} sets: {len(counts)}, flat: {flat_time:6.3f}s, '
+          f'oriented_envelope: {shapely_time:6.3f}s, mismatches: {bad.sum()}')
+    return bad.sum()
+
+
+if __name__ == '__main__':
+    num_sets = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+    rng = np.random.default_rng(seed)
+    num_bad = check('random', *get_random_sets(rng, num_sets))
+    for offset in (0, 1e3, 1e6):
+        num_bad += check(f'nearly collinear @ {offset:g}', *get_collinear_sets(rng, num_sets, offset))
+    assert num_bad == 0
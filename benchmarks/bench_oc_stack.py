@@ -0,0 +1,113 @@
+# micro-benchmark for marked content operator throughput in PDFPageOptionalAggregator
+#
+# runs a synthetic BDC/EMC heavy content stream through
+#   - a replica of the old approach, which rescans the whole OC stack for every combo on every operator
+#   - the aggregator, which keeps a stack of precomputed combo bitmasks
+# and checks that both agree on the active layers at every step
+#
+# usage: python -m benchmarks.bench_oc_stack [num_combos] [num_ops]
+import sys
+import random
+import time
+
+from pdfminer.pdfinterp import PDFResourceManager
+
+from geospatial_pdf.layers import PDFPageOptionalAggregator
+
+
+class RescanOCState:
+    def __init__(self, combo_lists):
+        self.OC_stack = []
+        self.combo_lists = combo_lists
+        self.set_active_status()
+
+    def get_status(self, combo_list):
+        for OC_name in self.OC_stack:
+            if OC_name is None:
+                continue
+            if OC_name not in combo_list:
+                return False
+        return True
+
+    def set_active_status(self):
+        self.active_status = [ self.get_status(c) for c in self.combo_lists ]
+
+    def activate_OC(self, OC_name):
+        self.OC_stack.append(OC_name)
+        self.set_active_status()
+
+    def deactivate_last_OC(self):
+        self.OC_stack.pop()
+        self.set_active_status()
+
+
+def get_synthetic_combos(num_combos, depth=3):
+    # ESRI style layer tree, every combo is a path from the root group to a leaf
+    combos = []
+    for i in range(num_combos):
+        combos.append([ f'oc{d}_{i >> (2 * (depth - d))}' for d in range(depth) ])
+    return combos
+
+
+def get_synthetic_ops(combos, num_ops, seed=0):
+    rng = random.Random(seed)
+    ops = []
+    depth = 0
+    while len(ops) < num_ops:
+        if depth > 0 and (depth >= 6 or rng.random() < 0.45):
+            ops.append(None)
+            depth -= 1
+            continue
+        combo = rng.choice(combos)
+        # mostly nested layer sections, sometimes other marked content
+        ops.append(combo[min(depth, len(combo) - 1)] if rng.random() < 0.9 else '')
+        depth += 1
+    ops.extend([None] * depth)
+    return ops
+
+
+def run(state, ops):
+    for op in ops:
+        if op is None:
+            state.deactivate_last_OC()
+        else:
+            state.activate_OC(op if op != '' else None)
+
+
+def check(old, new, ops):
+    for op in ops:
+        run(old, [op])
+        run(new, [op])
+        assert old.active_status == new.active_status, op
+
+
+def bench(state, ops, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(state, ops)
+        taken = time.perf_counter() - start
+        best = taken if best is None else min(best, taken)
+    return best
+
+
+if __name__ == '__main__':
+    num_combos = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    num_ops = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    combos = get_synthetic_combos(num_combos)
+    ops = get_synthetic_ops(combos, num_ops)
+
+    def get_device():
+        device = PDFPageOptionalAggregator(PDFResourceManager())
+        device.set_active_combo_lists(combos)
+        return device
+
+    check(RescanOCState(combos), get_device(), ops)
+
+    old_time = bench(RescanOCState(combos), ops)
+    new_time = bench(get_device(), ops)
+    print(f'combos: {num_combos}, operators: {len(ops)}')
+    print(f'rescan:  {len(ops)/old_time:12.0f} ops/sec')
+    print(f'bitmask: {len(ops)/new_time:12.0f} ops/sec')
+    print(f'speedup: {old_time/new_time:.1f}x')
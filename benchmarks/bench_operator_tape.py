@@ -0,0 +1,72 @@
+# time of parsing the same page with several aggregator configurations, with and without operator tapes
+#
+# uses the synthetic symbol page of bench_form_cache, and parses it with a few configurations
+#   - as pdfminer does, tokenizing the content streams every time
+#   - from an OperatorTapeStore, which tokenizes them once
+# and checks that both give the same objects
+#
+# usage: python -m benchmarks.bench_operator_tape [num_placements]
+import io
+import sys
+import time
+
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfinterp import PDFResourceManager
+from pdfminer.layout import LAParams
+
+from geospatial_pdf.geospatial import (PDFPageOptionalGenericTextAggregator,
+                                       PDFOptionalGenericTextInterpreter)
+from geospatial_pdf.layers.tape import OperatorTapeStore
+
+try:
+    from benchmarks.bench_form_cache import get_pdf, get_signature
+except ImportError:
+    # run as a script, python benchmarks/bench_operator_tape.py
+    from bench_form_cache import get_pdf, get_signature
+
+
+CONFIGS = [
+    dict(compact=True),
+    dict(compact=False),
+    dict(compact=True, laparams=LAParams()),
+]
+
+
+def run(pages, tape_store):
+    rsrcmgr = PDFResourceManager(caching=True)
+    signatures = []
+    start = time.perf_counter()
+    for config in CONFIGS:
+        device = PDFPageOptionalGenericTextAggregator(rsrcmgr, **config)
+        interpreter = PDFOptionalGenericTextInterpreter(rsrcmgr, device)
+        if tape_store is not None:
+            interpreter.set_tape_store(tape_store)
+        device.set_active_combo_lists([])
+        for page in pages:
+            interpreter.process_page(page)
+            signatures.append(get_signature(device.get_result()[0]))
+    taken = time.perf_counter() - start
+    return signatures, taken
+
+
+if __name__ == '__main__':
+    num_placements = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    document = PDFDocument(PDFParser(io.BytesIO(get_pdf(num_placements))))
+    pages = list(PDFPage.create_pages(document))
+    (plain_signatures, plain_time) = run(pages, None)
+
+    start = time.perf_counter()
+    tape_store = OperatorTapeStore()
+    for page in pages:
+        tape_store.record_page(page)
+    record_time = time.perf_counter() - start
+    (tape_signatures, tape_time) = run(pages, tape_store)
+    assert plain_signatures == tape_signatures
+
+    print(f'placements: {num_placements}, configurations: {len(CONFIGS)}')
+    print(f'tokenized every time: {plain_time:6.2f}s')
+    print(f'recording the tapes:  {record_time:6.2f}s')
+    print(f'replaying the tapes:  {tape_time:6.2f}s')
@@ -0,0 +1,92 @@
+# memory and time of painted paths in PDFPageOptionalAggregator, with and without path store mode
+#
+# paints synthetic contour lines( many short line segments per path ) into a compact mode page,
+#   - as pdfminer layout objects, one LTCurve per path
+#   - into the path store, and then simplified with Douglas-Peucker
+# and checks that both give the same vertices
+#
+# usage: python -m benchmarks.bench_path_store [num_paths] [segments_per_path] [tolerance]
+import sys
+import math
+import time
+import random
+import tracemalloc
+
+import numpy as np
+
+from pdfminer.pdfinterp import PDFResourceManager, PDFGraphicState
+from pdfminer.layout import LTCurve
+
+from geospatial_pdf.layers import PDFPageOptionalAggregator
+from geospatial_pdf.layers.arrays import layout_to_arrays
+
+
+class FakePage:
+    mediabox = (0, 0, 2384, 3370)
+    rotate = 0
+
+
+def get_synthetic_contours(num_paths, num_segments, seed=0):
+    rng = random.Random(seed)
+    paths = []
+    for _ in range(num_paths):
+        (cx, cy) = (rng.uniform(0, 2384), rng.uniform(0, 3370))
+        r = rng.uniform(5, 200)
+        path = []
+        for k in range(num_segments + 1):
+            t = 2 * math.pi * k / num_segments
+            wobble = 1 + 0.05 * math.sin(7 * t)
+            pt = (cx + r * wobble * math.cos(t), cy + r * wobble * math.sin(t))
+            path.append(('m' if k == 0 else 'l',) + pt)
+        paths.append(path)
+    return paths
+
+
+def run(paths, path_store):
+    device = PDFPageOptionalAggregator(PDFResourceManager(), compact=True, path_store=path_store)
+    device.set_active_combo_lists([['contours']])
+    gstate = PDFGraphicState()
+    page = FakePage()
+    device.begin_page(page, (1, 0, 0, 1, 0, 0))
+    device.set_ctm((1, 0, 0, 1, 0, 0))
+    device.activate_OC('contours')
+    for path in paths:
+        device.paint_path(gstate, True, False, False, path)
+    device.deactivate_last_OC()
+    device.end_page(page)
+    return device.get_result()[0]
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    taken = time.perf_counter() - start
+    (current, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, taken, current
+
+
+if __name__ == '__main__':
+    num_paths = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_segments = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    tolerance = float(sys.argv[3]) if len(sys.argv) > 3 else 0.5
+
+    paths = get_synthetic_contours(num_paths, num_segments)
+
+    (objs_page, objs_time, objs_mem) = measure(lambda: run(paths, False))
+    assert sum(1 for obj in objs_page if isinstance(obj, LTCurve)) == num_paths
+    objs_vertices = layout_to_arrays(objs_page).paths.vertices
+    del objs_page
+
+    (store_page, store_time, store_mem) = measure(lambda: run(paths, True))
+    assert np.array_equal(store_page.paths.vertices, objs_vertices)
+
+    start = time.perf_counter()
+    simplified = store_page.paths.simplify(tolerance)
+    simplify_time = time.perf_counter() - start
+
+    print(f'paths: {num_paths}, vertices: {len(objs_vertices)}')
+    print(f'layout objects: {objs_time:6.2f}s {objs_mem / 1e6:8.1f}MB')
+    print(f'path store:     {store_time:6.2f}s {store_mem / 1e6:8.1f}MB')
+    print(f'simplified at {tolerance}: {len(simplified.vertices)} vertices in {simplify_time:.2f}s')
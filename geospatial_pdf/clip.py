@@ -0,0 +1,185 @@
+import logging
+
+import numpy as np
+import shapely
+
+from shapely.geometry.base import BaseGeometry
+from pdfminer.pdftypes import list_value
+from pdfminer.pdfinterp import LITERAL_FORM, LITERAL_IMAGE
+from pdfminer.utils import MATRIX_IDENTITY, mult_matrix, apply_matrix_pt, get_bound, INF
+
+logger = logging.getLogger(__name__)
+
+# N.B.
+# windowed extraction, objects whose bounds fall outside the clip region are dropped
+# as soon as they are made, before they go into any layer container or layout analysis
+#
+# the clip region is in the same space as the bboxes of the layout objects( page space after rotation )
+#   - curves, images, pdfminer chars and symbol instances are tested on their bbox( pop_clipped ),
+#     the generic text device tests its chars on their rotated outline instead( keeps_bbox/keeps_bboxes
+#     with outlines ), which only makes a difference when the region is not a plain rectangle
+#   - forms and images which are entirely outside are not interpreted at all,
+#     that is where most of the savings come from on sheets drawn as nested forms
+#   - with keep_partial off, only objects entirely inside the region are kept,
+#     forms still get interpreted if they overlap as their contents are tested one by one
+#   - the clip argument of the parsers can also be a function of the PDFPage, for regions
+#     which change from page to page( see geospatial.utils.NeatlineClip )
+
+
+def _is_rectangle(geom):
+    return shapely.box(*geom.bounds).equals(geom)
+
+
+class ClipRegion:
+    """
+    page space window to extract from, a ( x0, y0, x1, y1 ) bbox, a list of ( x, y ) points
+    or a shapely polygon
+    """
+    def __init__(self, clip, keep_partial=True):
+        self.keep_partial = keep_partial
+        if isinstance(clip, ClipRegion):
+            clip = clip.geometry if clip.geometry is not None else clip.bbox
+        if not isinstance(clip, BaseGeometry):
+            clip = list(clip)
+            if len(clip) == 4 and not hasattr(clip[0], '__len__'):
+                clip = shapely.box(*[ float(v) for v in clip ])
+            else:
+                clip = shapely.polygons(np.array(clip, dtype=np.float64))
+        if clip.is_empty:
+            # nothing is kept
+            self.bbox = (+INF, +INF, -INF, -INF)
+            self.geometry = None
+            return
+
+        self.bbox = tuple(clip.bounds)
+        # plain rectangles are handled with comparisons alone
+        if _is_rectangle(clip):
+            self.geometry = None
+        else:
+            self.geometry = clip
+            shapely.prepare(self.geometry)
+
+
+    def __repr__(self):
+        region = self.bbox if self.geometry is None else self.geometry.wkt
+        return f'<ClipRegion: {region} keep_partial={self.keep_partial}>'
+
+
+    def get_geometry(self):
+        if self.geometry is not None:
+            return self.geometry
+        if self.bbox[0] > self.bbox[2]:
+            return shapely.Polygon()
+        return shapely.box(*self.bbox)
+
+
+    def overlaps_bbox(self, bbox):
+        """
+        whether the bbox touches the region at all
+        """
+        (x0, y0, x1, y1) = bbox
+        (cx0, cy0, cx1, cy1) = self.bbox
+        if x0 > cx1 or x1 < cx0 or y0 > cy1 or y1 < cy0:
+            return False
+        if self.geometry is None:
+            return True
+        return self.geometry.intersects(shapely.box(x0, y0, x1, y1))
+
+
+    def keeps_bbox(self, bbox, outline=None):
+        """
+        whether an object with the given bbox( and rotated outline, if it has one ) stays
+        """
+        (x0, y0, x1, y1) = bbox
+        (cx0, cy0, cx1, cy1) = self.bbox
+        if x0 > cx1 or x1 < cx0 or y0 > cy1 or y1 < cy0:
+            return False
+        if not self.keep_partial and (x0 < cx0 or x1 > cx1 or y0 < cy0 or y1 > cy1):
+            return False
+        if self.geometry is None:
+            return True
+
+        if outline is not None and len(outline) >= 3:
+            geom = shapely.polygons(outline)
+        else:
+            geom = shapely.box(x0, y0, x1, y1)
+        if self.keep_partial:
+            return self.geometry.intersects(geom)
+        return self.geometry.covers(geom)
+
+
+    def keeps_bboxes(self, bboxes, outlines=None):
+        """
+        vectorized keeps_bbox, bboxes is ( N, 4 ) and outlines ( N, K, 2 ), returns a bool array
+        """
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        (cx0, cy0, cx1, cy1) = self.bbox
+        (x0, y0, x1, y1) = bboxes.T
+        keep = (x0 <= cx1) & (x1 >= cx0) & (y0 <= cy1) & (y1 >= cy0)
+        if not self.keep_partial:
+            keep &= (x0 >= cx0) & (x1 <= cx1) & (y0 >= cy0) & (y1 <= cy1)
+        if self.geometry is None or not keep.any():
+            return keep
+
+        idxs = np.flatnonzero(keep)
+        if outlines is not None:
+            geoms = shapely.polygons(np.asarray(outlines, dtype=np.float64)[idxs])
+        else:
+            geoms = shapely.box(x0[idxs], y0[idxs], x1[idxs], y1[idxs])
+        if self.keep_partial:
+            keep[idxs] = shapely.intersects(self.geometry, geoms)
+        else:
+            keep[idxs] = shapely.covers(self.geometry, geoms)
+        return keep
+
+
+def get_clip_region(clip, keep_partial=True):
+    """
+    ClipRegion for the clip argument of the parsers, None if there is no clipping
+    """
+    if clip is None:
+        return None
+    return ClipRegion(clip, keep_partial=keep_partial)
+
+
+def pop_clipped(clip, container):
+    """
+    drops the last object added to the container if it is outside the clip region,
+    returns whether it was dropped
+    """
+    #TODO: using [-1] to access last element is a hack
+    # it is not part of the pdfminer LTContainer interface
+    obj = container._objs[-1]
+    if clip.keeps_bbox(obj.bbox):
+        return False
+    container._objs.pop()
+    return True
+
+
+def _get_transformed_bbox(bbox, matrix):
+    (x0, y0, x1, y1) = bbox
+    return get_bound([ apply_matrix_pt(matrix, pt)
+                       for pt in ((x0, y0), (x1, y0), (x1, y1), (x0, y1)) ])
+
+
+def is_xobj_clipped(clip, xobj, ctm):
+    """
+    whether a Do of the xobject can be skipped altogether,
+    forms are skipped if their bbox is entirely outside, images if they would have been dropped anyway
+    """
+    if clip is None:
+        return False
+    subtype = xobj.get('Subtype')
+    if subtype is LITERAL_FORM and 'BBox' in xobj:
+        matrix = list_value(xobj.get('Matrix', MATRIX_IDENTITY))
+        bbox = _get_transformed_bbox(list_value(xobj['BBox']), mult_matrix(matrix, ctm))
+        return not clip.overlaps_bbox(bbox)
+    if subtype is LITERAL_IMAGE:
+        return not clip.keeps_bbox(_get_transformed_bbox((0, 0, 1, 1), ctm))
+    return False
+
+
+def is_inline_image_clipped(clip, ctm):
+    if clip is None:
+        return False
+    return not clip.keeps_bbox(_get_transformed_bbox((0, 0, 1, 1), ctm))
@@ -1,53 +1,164 @@
 import logging
 
-from pdfminer.pdffont import PDFUnicodeNotDefined
+import numpy as np
+
 from pdfminer.pdfdevice import PDFTextDevice
 from pdfminer.pdfinterp import PDFPageInterpreter
+from pdfminer.psparser import literal_name
+from pdfminer.pdftypes import stream_value
 from pdfminer.converter import PDFPageAggregator
 from pdfminer.utils import (bbox2str, mult_matrix,
                             translate_matrix,
-                            matrix2str, apply_matrix_pt)
+                            matrix2str, apply_matrix_pt,
+                            INF)
 from pdfminer.layout import (LTTextLine, LTContainer, LTAnno,
                              LTText, LTComponent)
+import shapely
 from shapely.geometry import Polygon
 
+from .fonts import get_default_font_metrics_cache
+from .utils import minimum_bounding_boxes, get_bounding_box
+from ..clip import (get_clip_region,
+                    pop_clipped,
+                    is_xobj_clipped,
+                    is_inline_image_clipped)
+
 logger = logging.getLogger(__name__)
 
 
 class LTComponentGeneric(LTComponent):
     """
-    has a bbox and a polygon bound
+    has a bbox and a polygon bound,
+    the polygon is only built when asked for, most glyphs never need it
     """
     def __init__(self, points):
         self.set_bound_points(points)
 
-    def set_bound_points(self, points):
+    def set_bound_points(self, points, bbox=None):
         self.pts = points
-        self.polygon = Polygon(points)
-        self.set_bbox(self.polygon.bounds)
+        self._polygon = None
+        if bbox is not None:
+            self.set_bbox(bbox)
+            return
+        if len(points) == 0:
+            self.set_bbox((+INF, +INF, -INF, -INF))
+            return
+        xs = [ p[0] for p in points ]
+        ys = [ p[1] for p in points ]
+        self.set_bbox((min(xs), min(ys), max(xs), max(ys)))
+
+    @property
+    def polygon(self):
+        if self._polygon is None:
+            self._polygon = Polygon(self.pts)
+        return self._polygon
+
+
+def build_polygons(objs):
+    """
+    builds the polygons of many LTComponentGenerics in one go,
+    using the vectorized constructors of shapely 2 when available
+    """
+    objs = [ obj for obj in objs
+             if isinstance(obj, LTComponentGeneric) and obj._polygon is None and len(obj.pts) ]
+    if len(objs) == 0:
+        return
+    if not hasattr(shapely, 'polygons'):
+        for obj in objs:
+            obj._polygon = Polygon(obj.pts)
+        return
+
+    by_size = {}
+    for obj in objs:
+        by_size.setdefault(len(obj.pts), []).append(obj)
+    for size, same_size_objs in by_size.items():
+        coords = np.array([ obj.pts for obj in same_size_objs ], dtype=np.float64)
+        polygons = shapely.polygons(coords)
+        for obj, polygon in zip(same_size_objs, polygons):
+            obj._polygon = polygon
 
 
 
 class LTExpandableContainerGeneric(LTContainer, LTComponentGeneric):
     """
-    with expandable bounds
+    with expandable bounds, the corners of everything added are collected,
+    the oriented bounds are only worked out when asked for
     """
 
     def __init__(self) -> None:
-        LTComponentGeneric.__init__(self, ())
+        LTContainer.__init__(self, (+INF, +INF, -INF, -INF))
+        self.reset_bounds()
         return
 
+    def reset_bounds(self):
+        self.set_bbox((+INF, +INF, -INF, -INF))
+        self.corners = []
+        self._polygon = None
+        self._oriented = None
+
     def add(self, obj):
         LTContainer.add(self, obj)
-        # TODO: fix this
-        self.set_points(
-            (
-                min(self.x0, obj.x0),
-                min(self.y0, obj.y0),
-                max(self.x1, obj.x1),
-                max(self.y1, obj.y1),
-            )
-        )
+        self.set_bbox((min(self.x0, obj.x0), min(self.y0, obj.y0),
+                       max(self.x1, obj.x1), max(self.y1, obj.y1)))
+        if isinstance(obj, LTExpandableContainerGeneric):
+            self.corners.extend(obj.corners)
+        elif isinstance(obj, LTComponentGeneric):
+            self.corners.extend(obj.pts)
+        else:
+            self.corners.extend(((obj.x0, obj.y0), (obj.x1, obj.y0),
+                                 (obj.x1, obj.y1), (obj.x0, obj.y1)))
+        self._polygon = None
+        self._oriented = None
+
+    def fill(self, objs, bbox, corners):
+        """
+        sets the contents in one go, for when the bounds were already worked out in bulk
+        """
+        self._objs = objs
+        self.set_bbox(bbox)
+        self.corners = corners
+        self._polygon = None
+        self._oriented = None
+
+    def set_oriented_bounds(self, boxes, i):
+        self._oriented = (get_bounding_box(boxes, i),
+                          tuple(map(tuple, boxes.corner_points[i].tolist())),
+                          float(boxes.orientation[i]))
+
+    def get_oriented_bounds(self):
+        if self._oriented is None:
+            self.set_oriented_bounds(minimum_bounding_boxes([self.corners]), 0)
+        return self._oriented
+
+    @property
+    def oriented_bbox(self):
+        """
+        minimum area rotated rectangle around the contents, as a utils.BoundingBox
+        """
+        return self.get_oriented_bounds()[0]
+
+    @property
+    def pts(self):
+        return self.get_oriented_bounds()[1]
+
+    @property
+    def orientation(self):
+        """
+        angle of the longer side of the oriented bbox, in [-pi/2, pi/2)
+        """
+        return self.get_oriented_bounds()[2]
+
+
+def set_oriented_bounds(containers):
+    """
+    works out the oriented bounds of many LTExpandableContainerGenerics in one go
+    """
+    containers = [ c for c in containers if c._oriented is None ]
+    if len(containers) == 0:
+        return
+    boxes = minimum_bounding_boxes([ c.corners for c in containers ])
+    for i, c in enumerate(containers):
+        c.set_oriented_bounds(boxes, i)
 
 
 class LTTextLineGeneric(LTTextLine, LTExpandableContainerGeneric):
@@ -58,8 +169,12 @@ class LTTextLineGeneric(LTTextLine, LTExpandableContainerGeneric):
     def __init__(self, word_margin):
         LTTextLine.__init__(self, word_margin)
         self.word_margin = word_margin
+        self.reset_bounds()
         return
 
+    def add(self, obj):
+        LTExpandableContainerGeneric.add(self, obj)
+
     def __repr__(self) -> str:
         return "<%s %s %r>" % (
             self.__class__.__name__,
@@ -67,6 +182,23 @@ class LTTextLineGeneric(LTTextLine, LTExpandableContainerGeneric):
             self.get_text(),
         )
 
+    @property
+    def baseline_angle(self):
+        """
+        mean writing direction of the chars, in radians, upside down text comes out as such,
+        falls back to the oriented bbox when there are no chars
+        """
+        dirs = [ obj.matrix[:2] for obj in self._objs if isinstance(obj, LTCharGeneric) ]
+        if len(dirs) == 0:
+            return self.orientation
+        dirs = np.array(dirs, dtype=np.float64)
+        norms = np.hypot(dirs[:, 0], dirs[:, 1])
+        dirs = dirs[norms > 0] / norms[norms > 0, None]
+        if len(dirs) == 0:
+            return self.orientation
+        (dx, dy) = dirs.sum(axis=0)
+        return float(np.arctan2(dy, dx))
+
     def analyze(self, laparams):
         #LTTextContainerGeneric.analyze(self, laparams)
         LTContainer.add(self, LTAnno("\n"))
@@ -128,6 +260,28 @@ class LTCharGeneric(LTComponentGeneric, LTText):
             self.size = self.height
         return
 
+    @classmethod
+    def from_geometry(cls, matrix, fontname, text, adv, upright, vertical,
+                      points, bbox, ncs, graphicstate):
+        """
+        for when the geometry was already worked out, in bulk, by the device
+        """
+        self = cls.__new__(cls)
+        LTText.__init__(self)
+        self._text = text
+        self.matrix = matrix
+        self.fontname = fontname
+        self.ncs = ncs
+        self.graphicstate = graphicstate
+        self.adv = adv
+        self.upright = upright
+        self.set_bound_points(points, bbox)
+        if vertical:
+            self.size = self.width
+        else:
+            self.size = self.height
+        return self
+
     def get_text(self):
         return self._text
 
@@ -143,9 +297,9 @@ class LTCharGeneric(LTComponentGeneric, LTText):
         )
 
 
-def forward_pos(point, delta, font, h_scaling):
+def forward_pos(point, delta, vertical, h_scaling):
     (x, y) = point
-    if font.is_vertical():
+    if vertical:
         # horizontal scaling doesn't apply to vertical font position moves
         # but delta was already scaled using h_scaling.. so undo the scaling
         y += (delta/h_scaling)
@@ -154,7 +308,39 @@ def forward_pos(point, delta, font, h_scaling):
     return (x, y)
 
 
+# strings with fewer glyphs than this are not worth the numpy overhead
+VECTORIZE_MIN_GLYPHS = 16
+
+
+def get_char_quads(matrix, xs, ys, lower_left, upper_right):
+    """
+    matrices and corners( lower left, lower right, upper right, upper left ) of glyphs placed at xs, ys
+    with the given glyph space bounds, all glyphs in one go.
+    does the same arithmetic as translate_matrix and apply_matrix_pt, so results match the scalar path
+    """
+    n = len(xs)
+    (a, b, c, d, e, f) = matrix
+    es = xs * a + ys * c + e
+    fs = xs * b + ys * d + f
+    (llx, lly) = [ np.broadcast_to(np.asarray(v, dtype=np.float64), (n,)) for v in lower_left ]
+    (urx, ury) = [ np.broadcast_to(np.asarray(v, dtype=np.float64), (n,)) for v in upper_right ]
+    px = np.stack([llx, urx, urx, llx], axis=1)
+    py = np.stack([lly, lly, ury, ury], axis=1)
+    quads = np.empty((n, 4, 2), dtype=np.float64)
+    quads[:, :, 0] = a * px + c * py + es[:, None]
+    quads[:, :, 1] = b * px + d * py + fs[:, None]
+    matrices = np.empty((n, 6), dtype=np.float64)
+    matrices[:, :4] = (a, b, c, d)
+    matrices[:, 4] = es
+    matrices[:, 5] = fs
+    return matrices, quads
+
+
 class PDFGenericTextDevice(PDFTextDevice):
+    # FontMetricsCache to use, the process wide one if not set
+    font_metrics_cache = None
+    # ClipRegion to drop objects outside of, see clip.py
+    clip = None
 
     def begin_textgroup(self):
         self._stack.append(self.cur_item)
@@ -166,21 +352,38 @@ class PDFGenericTextDevice(PDFTextDevice):
         tlg = self.cur_item
         assert isinstance(self.cur_item, LTTextLineGeneric), str(type(self.cur_item))
         self.cur_item = self._stack.pop()
+        if self.is_clipped_textgroup(tlg):
+            return
         self.cur_item.add(tlg)
 
 
+    def is_clipped_textgroup(self, tlg):
+        return self.clip is not None and len(tlg) == 0
+
+
+    def set_clip(self, clip, keep_partial=True):
+        self.clip = get_clip_region(clip, keep_partial=keep_partial)
+
+
+    def add_char_generic(self, item):
+        self.cur_item.add(item)
+
+
+    def get_font_metrics(self, font):
+        cache = self.font_metrics_cache
+        if cache is None:
+            cache = get_default_font_metrics_cache()
+        return cache.get_metrics(font)
+
+
     def render_char_generic(self, matrix,
                             font, fontsize,
                             scaling, rise,
                             cid, ncs,
                             graphicstate):
-        try:
-            text = font.to_unichr(cid)
-            assert isinstance(text, str), str(type(text))
-        except PDFUnicodeNotDefined:
+        (text, textwidth, textdisp) = self.get_font_metrics(font).get(font, cid)
+        if text is None:
             text = self.handle_undefined_char(font, cid)
-        textwidth = font.char_width(cid)
-        textdisp = font.char_disp(cid)
         item = LTCharGeneric(
             matrix,
             font,
@@ -193,10 +396,73 @@ class PDFGenericTextDevice(PDFTextDevice):
             ncs,
             graphicstate,
         )
-        self.cur_item.add(item)
+        if self.clip is None or self.clip.keeps_bbox(item.bbox, item.pts):
+            self.add_char_generic(item)
         return item.adv
 
 
+    def render_chars_generic(self, matrix,
+                             font, fontsize,
+                             scaling, rise,
+                             glyphs, ncs,
+                             graphicstate):
+        """
+        renders a whole string worth of glyphs, given as ( x, y, text, textwidth, textdisp, adv ) tuples
+        """
+        if len(glyphs) < VECTORIZE_MIN_GLYPHS:
+            for (x, y, text, textwidth, textdisp, _) in glyphs:
+                item = LTCharGeneric(translate_matrix(matrix, (x, y)),
+                                     font, fontsize, scaling, rise,
+                                     text, textwidth, textdisp,
+                                     ncs, graphicstate)
+                if self.clip is None or self.clip.keeps_bbox(item.bbox, item.pts):
+                    self.add_char_generic(item)
+            return
+
+        positions = np.array([ (g[0], g[1], g[5]) for g in glyphs ], dtype=np.float64)
+        (xs, ys, advs) = positions.T
+        vertical = font.is_vertical()
+        if vertical:
+            vxs = []
+            vys = []
+            for g in glyphs:
+                (vx, vy) = g[4]
+                if vx is None:
+                    vx = fontsize * 0.5
+                else:
+                    vx = vx * fontsize * 0.001
+                vxs.append(-vx)
+                vys.append((1000 - vy) * fontsize * 0.001)
+            vxs = np.array(vxs, dtype=np.float64)
+            vys = np.array(vys, dtype=np.float64)
+            lower_left = (vxs, vys + rise + advs)
+            upper_right = (vxs + fontsize, vys + rise)
+        else:
+            descent = font.get_descent() * fontsize
+            lower_left = (0, descent + rise)
+            upper_right = (advs, descent + rise + fontsize)
+        matrices, quads = get_char_quads(matrix, xs, ys, lower_left, upper_right)
+
+        (a, b, c, d, e, f) = matrix
+        upright = 0 < a * d * scaling and b * c <= 0
+        fontname = font.fontname
+        bboxes = np.concatenate([quads.min(axis=1), quads.max(axis=1)], axis=1)
+        if self.clip is not None:
+            # glyphs outside the window are never made into objects
+            keep = self.clip.keeps_bboxes(bboxes, quads)
+            if not keep.all():
+                glyphs = [ g for g, k in zip(glyphs, keep.tolist()) if k ]
+                (matrices, quads, bboxes) = (matrices[keep], quads[keep], bboxes[keep])
+        quads = quads.reshape(-1, 8).tolist()
+        for (g, char_matrix, q, bbox) in zip(glyphs, matrices.tolist(), quads, bboxes.tolist()):
+            item = LTCharGeneric.from_geometry(tuple(char_matrix), fontname,
+                                               g[2], g[5], upright, vertical,
+                                               ((q[0], q[1]), (q[2], q[3]), (q[4], q[5]), (q[6], q[7])),
+                                               tuple(bbox),
+                                               ncs, graphicstate)
+            self.add_char_generic(item)
+
+
     def render_string(self, textstate, seq, ncs, graphicstate):
         assert self.ctm is not None
         matrix = mult_matrix(textstate.matrix, self.ctm)
@@ -212,36 +478,58 @@ class PDFGenericTextDevice(PDFTextDevice):
             wordspace = 0
         dxscale = 0.001 * fontsize * scaling
         (x, y) = textstate.linematrix
+        metrics = self.get_font_metrics(font)
+        vertical = metrics.vertical
+        # lay out the whole string first, the glyph geometry is then done in bulk
+        glyphs = []
         needcharspace = False
         for obj in seq:
             if isinstance(obj, (int, float)):
-                x, y = forward_pos((x, y), -(obj * dxscale), font, scaling)
+                x, y = forward_pos((x, y), -(obj * dxscale), vertical, scaling)
                 needcharspace = True
             else:
                 for cid in font.decode(obj):
                     if needcharspace:
-                        x, y = forward_pos((x, y), charspace, font, scaling)
-                    adv = self.render_char_generic(
-                        translate_matrix(matrix, (x, y)),
-                        font,
-                        fontsize,
-                        scaling,
-                        rise,
-                        cid,
-                        ncs,
-                        graphicstate,
-                    )
-                    x, y = forward_pos((x, y), adv, font, scaling)
+                        x, y = forward_pos((x, y), charspace, vertical, scaling)
+                    (text, textwidth, textdisp) = metrics.get(font, cid)
+                    if text is None:
+                        text = self.handle_undefined_char(font, cid)
+                    adv = textwidth * fontsize * scaling
+                    glyphs.append((x, y, text, textwidth, textdisp, adv))
+                    x, y = forward_pos((x, y), adv, vertical, scaling)
                     if cid == 32 and wordspace:
-                        x, y = forward_pos((x, y), wordspace, font, scaling)
+                        x, y = forward_pos((x, y), wordspace, vertical, scaling)
                     needcharspace = True
         textstate.linematrix = (x, y)
+        if len(glyphs):
+            self.render_chars_generic(matrix, font, fontsize, scaling, rise,
+                                      glyphs, ncs, graphicstate)
 
 
 
 class PDFPageGenericTextAggregator(PDFPageAggregator,
                                    PDFGenericTextDevice):
-    pass
+    def __init__(self, rsrcmgr, pageno=1, laparams=None,
+                 clip=None, clip_partial=True):
+        PDFPageAggregator.__init__(self, rsrcmgr,
+                                   pageno=pageno,
+                                   laparams=laparams)
+        self.set_clip(clip, keep_partial=clip_partial)
+
+
+    def paint_path(self, gstate, stroke, fill, evenodd, path):
+        count_before = len(self.cur_item._objs)
+        PDFPageAggregator.paint_path(self, gstate, stroke, fill, evenodd, path)
+        # subpaths are clipped by the inner calls
+        if self.clip is not None and len(self.cur_item._objs) - count_before == 1 and \
+           ''.join(x[0] for x in path).count('m') <= 1:
+            pop_clipped(self.clip, self.cur_item)
+
+
+    def render_image(self, name, stream):
+        PDFPageAggregator.render_image(self, name, stream)
+        if self.clip is not None:
+            pop_clipped(self.clip, self.cur_item)
 
 
 
@@ -258,4 +546,17 @@ class PDFPageGenericTextInterpreter(PDFPageInterpreter):
         PDFPageInterpreter.do_ET(self)
         self.device.end_textgroup()
 
+    def do_Do(self, xobjid_arg):
+        xobjid = literal_name(xobjid_arg)
+        xobj = stream_value(self.xobjmap[xobjid]) if xobjid in self.xobjmap else None
+        if xobj is not None and is_xobj_clipped(self.device.clip, xobj, self.ctm):
+            logger.debug(f'skipping xobject {xobjid} outside the clip region')
+            return
+        return PDFPageInterpreter.do_Do(self, xobjid_arg)
+
+    def do_EI(self, obj):
+        if is_inline_image_clipped(self.device.clip, self.ctm):
+            return
+        return PDFPageInterpreter.do_EI(self, obj)
+
 
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import weakref
+
+from collections import OrderedDict
+
+from pdfminer.pdffont import PDFUnicodeNotDefined
+from pdfminer.pdftypes import resolve1, PDFStream
+
+logger = logging.getLogger(__name__)
+
+# N.B.
+# glyph metrics( text, width, displacement ) only depend on the font and the cid,
+# and map labels reuse a tiny set of glyphs over and over, so they are looked up once and remembered.
+# fonts are first looked up by identity, a PDFFont lives as long as the resource manager that loaded it,
+# then by a fingerprint of what determines the metrics, so that pages and documents which carry
+# the same embedded font share the tables
+
+DEFAULT_MAX_FONTS = 1024
+
+# marks an unfilled slot in the single byte tables
+_MISSING = object()
+
+
+class FontMetrics:
+    """
+    memoized to_unichr/char_width/char_disp of a font,
+    text is None for cids without a unicode mapping
+    """
+    def __init__(self, font, cache):
+        self.cache = cache
+        self.vertical = font.is_vertical()
+        self.multibyte = font.is_multibyte()
+        self.descent = font.get_descent()
+        if self.multibyte:
+            self.table = {}
+        else:
+            self.table = [_MISSING] * 256
+
+
+    def get(self, font, cid):
+        """
+        ( text, width, disp ) of the cid, font is only used on a miss
+        """
+        table = self.table
+        if self.multibyte:
+            entry = table.get(cid, _MISSING)
+        else:
+            entry = table[cid]
+        if entry is not _MISSING:
+            self.cache.hits += 1
+            return entry
+
+        self.cache.misses += 1
+        try:
+            text = font.to_unichr(cid)
+            assert isinstance(text, str), str(type(text))
+        except PDFUnicodeNotDefined:
+            text = None
+        entry = (text, font.char_width(cid), font.char_disp(cid))
+        table[cid] = entry
+        return entry
+
+
+def _update_with_stream(h, obj):
+    obj = resolve1(obj)
+    if isinstance(obj, PDFStream):
+        h.update(obj.get_data())
+
+
+def get_font_fingerprint(font):
+    """
+    digest of everything that goes into the glyph metrics of the font, None if it can not be worked out
+    """
+    h = hashlib.sha1()
+    try:
+        h.update(repr((type(font).__name__, font.fontname,
+                       font.widths, font.default_width, font.hscale,
+                       font.is_vertical(), font.get_descent())).encode('utf8'))
+        for key in ('FontFile', 'FontFile2', 'FontFile3'):
+            _update_with_stream(h, font.descriptor.get(key, None))
+        cid2unicode = getattr(font, 'cid2unicode', None)
+        if cid2unicode is not None:
+            h.update(repr(cid2unicode).encode('utf8'))
+        unicode_map = getattr(font, 'unicode_map', None)
+        if unicode_map is not None:
+            h.update(repr(getattr(unicode_map, 'cid2unichr', unicode_map)).encode('utf8'))
+        if font.is_vertical():
+            h.update(repr((font.disps, font.default_disp)).encode('utf8'))
+        if hasattr(font, 'cidcoding'):
+            h.update(repr(font.cidcoding).encode('utf8'))
+    except Exception as ex:
+        logger.debug(f'unable to fingerprint font {font}: {ex}')
+        return None
+    return h.hexdigest()
+
+
+class FontMetricsCache:
+    """
+    FontMetrics for fonts seen so far, shared across pages and documents.
+    hits and misses count cid lookups
+    """
+    def __init__(self, max_fonts=DEFAULT_MAX_FONTS):
+        self.max_fonts = max_fonts
+        self.by_font = weakref.WeakKeyDictionary()
+        self.by_fingerprint = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get_metrics(self, font):
+        metrics = self.by_font.get(font, None)
+        if metrics is not None:
+            return metrics
+
+        fingerprint = get_font_fingerprint(font)
+        if fingerprint is not None and fingerprint in self.by_fingerprint:
+            self.by_fingerprint.move_to_end(fingerprint)
+            metrics = self.by_fingerprint[fingerprint]
+        else:
+            metrics = FontMetrics(font, self)
+            if fingerprint is not None:
+                self.by_fingerprint[fingerprint] = metrics
+                if len(self.by_fingerprint) > self.max_fonts:
+                    self.by_fingerprint.popitem(last=False)
+        self.by_font[font] = metrics
+        return metrics
+
+
+    def get_stats(self):
+        return { 'fonts': len(self.by_fingerprint), 'hits': self.hits, 'misses': self.misses }
+
+
+_default_cache = None
+
+def get_default_font_metrics_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = FontMetricsCache()
+    return _default_cache
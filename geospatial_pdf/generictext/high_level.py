@@ -7,7 +7,12 @@ from . import (PDFPageGenericTextAggregator,
                PDFPageGenericTextInterpreter)
 
 
-def parse_generic_text_pdf_file(filename):
+def parse_generic_text_pdf_file(filename, clip=None, clip_partial=True):
+    """
+    clip: ( x0, y0, x1, y1 ) bbox or polygon in page space, objects outside of it are dropped
+          while the page is being interpreted, see clip.py
+    clip_partial: keep objects which are only partly inside the clip region
+    """
     with open(filename, "rb") as f:
         parser = PDFParser(f)
         document = PDFDocument(parser)
@@ -17,7 +22,7 @@ def parse_generic_text_pdf_file(filename):
             )
  
         rsrcmgr = PDFResourceManager(caching=True)
-        device = PDFPageGenericTextAggregator(rsrcmgr)
+        device = PDFPageGenericTextAggregator(rsrcmgr, clip=clip, clip_partial=clip_partial)
         interpreter = PDFPageGenericTextInterpreter(rsrcmgr, device)
         pno = 0
         pinfo = []
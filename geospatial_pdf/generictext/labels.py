@@ -0,0 +1,223 @@
+import logging
+
+from math import cos, radians
+
+import numpy as np
+import shapely
+
+from pdfminer.layout import LTAnno
+
+from . import LTCharGeneric, LTTextLineGeneric
+
+logger = logging.getLogger(__name__)
+
+# N.B.
+# map labels are often written one glyph per BT/ET block( curved labels ) or in pieces,
+# so the text lines coming out of the interpreter are not the labels a reader sees.
+# this stage regroups LTCharGenerics into labels using where the glyphs are, not how they were written:
+#   - neighbour candidates come from a bulk STRtree query over the glyph centers
+#   - a pair is linked if the glyphs run in roughly the same direction, have similar sizes,
+#     sit on the same baseline and are close enough along it
+#   - labels are the connected components of the links, chars are ordered along the label direction
+# all of it is done with array operations, so it stays near linear in the number of glyphs.
+# needs shapely 2
+
+
+class LabelParams:
+    """
+    parameters for label assembly, distances are relative to the smaller font size of a glyph pair
+
+    :param char_margin: glyphs closer than this along the baseline are part of the same label
+    :param line_overlap: glyphs further apart than this across the baseline are on different lines
+    :param word_margin: gaps wider than this get a space inserted
+    :param max_angle: maximum difference in writing direction of neighbouring glyphs, in degrees,
+        curved labels turn a little with every glyph
+    :param size_tolerance: maximum relative difference in font size of neighbouring glyphs
+    :param drop_duplicates: drop glyphs drawn again at the same place with the same text,
+        halos are usually drawn that way, the last drawn one is kept
+    """
+    def __init__(self,
+                 char_margin=1.0,
+                 line_overlap=0.5,
+                 word_margin=0.2,
+                 max_angle=30,
+                 size_tolerance=0.25,
+                 drop_duplicates=True):
+        self.char_margin = char_margin
+        self.line_overlap = line_overlap
+        self.word_margin = word_margin
+        self.max_angle = max_angle
+        self.size_tolerance = size_tolerance
+        self.drop_duplicates = drop_duplicates
+
+    def __repr__(self):
+        return '<LabelParams: char_margin={:.1f}, line_overlap={:.1f}, ' \
+               'word_margin={:.1f} max_angle={:.1f}, size_tolerance={:.2f}, ' \
+               'drop_duplicates={}>'.format(self.char_margin, self.line_overlap,
+                                            self.word_margin, self.max_angle,
+                                            self.size_tolerance, self.drop_duplicates)
+
+
+def get_layout_chars(layout):
+    """
+    all the LTCharGenerics in the layout, in drawing order
+    """
+    chars = []
+    stack = [layout]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, LTCharGeneric):
+            chars.append(obj)
+            continue
+        objs = getattr(obj, '_objs', None)
+        if objs:
+            stack.extend(reversed(objs))
+    return chars
+
+
+def _connected_components(n, a, b):
+    # min label propagation with pointer jumping
+    labels = np.arange(n)
+    while True:
+        la = labels[a]
+        lb = labels[b]
+        m = np.minimum(la, lb)
+        new = labels.copy()
+        np.minimum.at(new, la, m)
+        np.minimum.at(new, lb, m)
+        while True:
+            jumped = new[new]
+            if np.array_equal(jumped, new):
+                break
+            new = jumped
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def _get_char_geometry(chars):
+    pts = np.array([ c.pts for c in chars ], dtype=np.float64).reshape(-1, 4, 2)
+    centers = pts.mean(axis=1)
+    dirs = np.array([ c.matrix[:2] for c in chars ], dtype=np.float64).reshape(-1, 2)
+    norms = np.hypot(dirs[:, 0], dirs[:, 1])
+    norms[norms == 0] = 1
+    dirs = dirs / norms[:, None]
+    # along and across the baseline, the size of a LTCharGeneric is from its axis aligned bbox
+    widths = np.hypot(*(pts[:, 1] - pts[:, 0]).T)
+    sizes = np.hypot(*(pts[:, 3] - pts[:, 0]).T)
+    return centers, dirs, widths, sizes
+
+
+def _get_links(centers, dirs, widths, sizes, labelparams):
+    # farthest a linked glyph can be is( char_margin + line_overlap ) * smaller size + mean width,
+    # which is within the reach of the wider/bigger glyph of the pair, but not always of the other one.
+    # so pairs are queried from both ends and deduplicated, links don't depend on the drawing order
+    reach = sizes * (labelparams.char_margin + labelparams.line_overlap) + widths
+    boxes = shapely.box(centers[:, 0] - reach, centers[:, 1] - reach,
+                        centers[:, 0] + reach, centers[:, 1] + reach)
+    tree = shapely.STRtree(shapely.points(centers))
+    (a, b) = tree.query(boxes)
+    keep = a != b
+    pairs = np.unique(np.column_stack([np.minimum(a[keep], b[keep]),
+                                       np.maximum(a[keep], b[keep])]), axis=0)
+    (a, b) = (pairs[:, 0], pairs[:, 1])
+
+    same_dir = np.einsum('ij,ij->i', dirs[a], dirs[b]) >= cos(radians(labelparams.max_angle))
+    s_min = np.minimum(sizes[a], sizes[b])
+    s_max = np.maximum(sizes[a], sizes[b])
+    same_size = s_max <= s_min * (1 + labelparams.size_tolerance)
+
+    u = dirs[a] + dirs[b]
+    unorm = np.hypot(u[:, 0], u[:, 1])
+    unorm[unorm == 0] = 1
+    u = u / unorm[:, None]
+    d = centers[b] - centers[a]
+    along = np.abs(d[:, 0] * u[:, 0] + d[:, 1] * u[:, 1])
+    across = np.abs(d[:, 1] * u[:, 0] - d[:, 0] * u[:, 1])
+    gap = along - (widths[a] + widths[b]) / 2
+    close = (across <= labelparams.line_overlap * s_min) & (gap <= labelparams.char_margin * s_min)
+
+    linked = same_dir & same_size & close
+    return a[linked], b[linked]
+
+
+def assemble_labels(chars, labelparams=None):
+    """
+    groups LTCharGenerics into labels, returns LTTextLineGenerics ordered by their first drawn char
+    """
+    if labelparams is None:
+        labelparams = LabelParams()
+    n = len(chars)
+    if n == 0:
+        return []
+
+    (centers, dirs, widths, sizes) = _get_char_geometry(chars)
+    (a, b) = _get_links(centers, dirs, widths, sizes, labelparams)
+    labels = _connected_components(n, a, b)
+
+    # order along the mean direction of each label
+    label_dirs = np.zeros((n, 2), dtype=np.float64)
+    np.add.at(label_dirs, labels, dirs)
+    proj = np.einsum('ij,ij->i', centers, label_dirs[labels])
+    idxs = np.arange(n)
+    order = np.lexsort((idxs, proj, labels))
+
+    same_label = labels[order][1:] == labels[order][:-1]
+    texts = [ chars[i].get_text() for i in order ]
+    s_min = np.minimum(sizes[order][1:], sizes[order][:-1])
+    step = np.hypot(*(centers[order][1:] - centers[order][:-1]).T)
+    gaps = step - (widths[order][1:] + widths[order][:-1]) / 2
+
+    drop = np.zeros(n, dtype=bool)
+    if labelparams.drop_duplicates:
+        same_text = np.array([ texts[k] == texts[k + 1] for k in range(n - 1) ], dtype=bool)
+        dup = same_label & same_text & (step <= 0.1 * s_min)
+        later = order[1:] > order[:-1]
+        drop[:-1] |= dup & later
+        drop[1:] |= dup & ~later
+    spaced = same_label & (gaps > labelparams.word_margin * s_min)
+
+    # bounds of every label in bulk
+    kept = order[~drop]
+    kept_labels = labels[kept]
+    starts = np.flatnonzero(np.r_[True, kept_labels[1:] != kept_labels[:-1]])
+    bboxes = np.array([ chars[i].bbox for i in kept ], dtype=np.float64).reshape(-1, 4)
+    label_bboxes = np.column_stack([np.minimum.reduceat(bboxes[:, 0], starts),
+                                    np.minimum.reduceat(bboxes[:, 1], starts),
+                                    np.maximum.reduceat(bboxes[:, 2], starts),
+                                    np.maximum.reduceat(bboxes[:, 3], starts)]).tolist()
+    first_idxs = np.minimum.reduceat(order, np.flatnonzero(np.r_[True, ~same_label]))
+
+    result = []
+    objs = None
+    corners = None
+    prev_text = None
+    for k, i in enumerate(order):
+        if k == 0 or not same_label[k - 1]:
+            objs = []
+            corners = []
+            result.append((objs, corners))
+            prev_text = None
+        if drop[k]:
+            continue
+        if prev_text is not None and spaced[k - 1] and prev_text != ' ' and texts[k] != ' ':
+            # no bounds, same as the LTAnnos pdfminer adds
+            objs.append(LTAnno(' '))
+        objs.append(chars[i])
+        corners.extend(chars[i].pts)
+        prev_text = texts[k]
+
+    lines = []
+    # every label keeps at least one char, so the bboxes line up
+    for (objs, corners), bbox in zip(result, label_bboxes):
+        line = LTTextLineGeneric(labelparams.word_margin)
+        line.fill(objs, tuple(bbox), corners)
+        lines.append(line)
+    return [ lines[j] for j in np.argsort(first_idxs, kind='stable') ]
+
+
+def assemble_layout_labels(layout, labelparams=None):
+    """
+    labels made from all the LTCharGenerics of a layout, the layout itself is left as it is
+    """
+    return assemble_labels(get_layout_chars(layout), labelparams)
@@ -1,10 +1,105 @@
 from math import sqrt
 import numpy as np
-from math import atan2, cos, sin, pi
+from math import pi
 from collections import namedtuple
 
 
-#https://github.com/jinxuan/convexhull/blob/6ea156b5c861f95ebdcedfcbcf01a28c06271bec/convexhull/convexhull2d.py
+# N.B.
+# hulls and minimum bounding boxes are computed for many point sets at once,
+# point sets are given flat, set i is points[offsets[i]:offsets[i+1]]
+#
+# hulls: Andrew's monotone chain, but instead of a stack walk per set, every point that makes
+#        a non left turn with its current neighbours is dropped, in all the sets at once,
+#        until nothing changes. dropped points are never hull vertices, so the result is the same
+# boxes: rotating calipers, the extreme vertex of a convex polygon in a direction is found
+#        by a binary search on the edge angles, done for all the edges of all the sets with one searchsorted
+
+# keeps the edge angles of different sets apart, angles are in [0, 2pi)
+_SET_ANGLE_STRIDE = 8.0
+# hulls thinner than this( area / perimeter^2 ) are nearly collinear, their edge angles are mostly
+# rounding noise and can't be binary searched, the extremes are found by projecting all the vertices instead
+_FLAT_HULL_RATIO = 1e-8
+
+
+def _cross(o, a, b):
+    return (a[:, 0] - o[:, 0]) * (b[:, 1] - o[:, 1]) - (a[:, 1] - o[:, 1]) * (b[:, 0] - o[:, 0])
+
+
+def _get_chain(points, set_ids, lower):
+    keep = np.arange(len(points))
+    while len(keep) > 2:
+        p = points[keep]
+        s = set_ids[keep]
+        interior = np.zeros(len(keep), dtype=bool)
+        interior[1:-1] = (s[:-2] == s[1:-1]) & (s[2:] == s[1:-1])
+        cross = np.zeros(len(keep), dtype=np.float64)
+        cross[1:-1] = _cross(p[:-2], p[1:-1], p[2:])
+        if lower:
+            drop = interior & (cross <= 0)
+        else:
+            drop = interior & (cross >= 0)
+        if not drop.any():
+            break
+        keep = keep[~drop]
+    return keep
+
+
+def _to_flat(point_sets):
+    counts = np.array([ len(ps) for ps in point_sets ], dtype=np.int64)
+    offsets = np.zeros(len(point_sets) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    if offsets[-1] == 0:
+        return np.zeros((0, 2), dtype=np.float64), offsets
+    points = np.concatenate([ np.asarray(ps, dtype=np.float64).reshape(-1, 2)
+                              for ps in point_sets if len(ps) ])
+    return points, offsets
+
+
+def convex_hulls(points, offsets):
+    """
+    convex hulls of many point sets, returns the hull vertices in counter clockwise order,
+    starting from the leftmost( then lowest ) point, as flat ( vertices, offsets ) arrays
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    num_sets = len(offsets) - 1
+    set_ids = np.repeat(np.arange(num_sets), np.diff(offsets))
+
+    order = np.lexsort((points[:, 1], points[:, 0], set_ids))
+    points = points[order]
+    set_ids = set_ids[order]
+    # duplicates would make zero length edges
+    if len(points):
+        dup = np.zeros(len(points), dtype=bool)
+        dup[1:] = (set_ids[1:] == set_ids[:-1]) & np.all(points[1:] == points[:-1], axis=1)
+        points = points[~dup]
+        set_ids = set_ids[~dup]
+    counts = np.bincount(set_ids, minlength=num_sets)
+
+    lower = _get_chain(points, set_ids, True)
+    upper = _get_chain(points, set_ids, False)
+
+    # lower chain without its last point, then the upper chain backwards without its last point,
+    # single point sets only keep the one from the lower chain
+    lower_sids = set_ids[lower]
+    is_last = np.ones(len(lower), dtype=bool)
+    is_last[:-1] = lower_sids[1:] != lower_sids[:-1]
+    lower = lower[~is_last | (counts[lower_sids] == 1)]
+    upper_sids = set_ids[upper]
+    is_first = np.ones(len(upper), dtype=bool)
+    is_first[1:] = upper_sids[1:] != upper_sids[:-1]
+    upper = upper[~is_first]
+
+    idxs = np.concatenate([lower, upper])
+    part = np.concatenate([np.zeros(len(lower), dtype=np.int64), np.ones(len(upper), dtype=np.int64)])
+    pos = np.concatenate([lower, -upper])
+    hull_order = np.lexsort((pos, part, set_ids[idxs]))
+    idxs = idxs[hull_order]
+
+    hull_offsets = np.zeros(num_sets + 1, dtype=np.int64)
+    np.cumsum(np.bincount(set_ids[idxs], minlength=num_sets), out=hull_offsets[1:])
+    return points[idxs], hull_offsets
+
 
 class ConvexHull2D():
     def __init__(self, points=[]):
@@ -13,31 +108,148 @@ class ConvexHull2D():
 
     def get_convexhull(self):
         """
-        Use Graham Scan Algorithm to return the Convex Hull
-        :return:
+        hull vertices in counter clockwise order
         """
-        num_points = len(self.points)
-        if num_points <= 3:
-            return self.points
-
-        # point with lowest y then lowest x, this is begin of the convex hull;
-        lb = min(self.points, key=lambda p: (p[1], p[0]))
-
-        check_clock_wise = lambda p1, p2, p3: (p2[0] - p1[0]) * (p3[1] - p1[1]) - (p2[1] - p1[1]) * (p3[0] - p1[0])
-        distance_square = lambda p1, p2: (p1[0] - p2[0]) ** 2 + (p1[1] - p2[1]) ** 2
-        cmp = lambda p, q: check_clock_wise(lb, q, p) or distance_square(p, lb) - distance_square(q, lb)
-        self.points.sort(cmp)
-
-        cur = num_points - 1
-        while cur and check_clock_wise(lb, self.points[cur], self.points[cur - 1]) == 0:
-            cur -= 1
-        points = self.points[:cur] + self.points[cur:][::-1]
-        stack = [points[0], points[1]]
-        for cur in range(2, num_points):
-            while len(stack) > 1 and check_clock_wise(stack[-2], stack[-1], points[cur]) < 0:
-                stack.pop()
-            stack.append(points[cur])
-        return stack
+        if len(self.points) == 0:
+            return []
+        vertices, _ = convex_hulls(self.points, [0, len(self.points)])
+        return [ tuple(v) for v in vertices.tolist() ]
+
+
+BoundingBoxes = namedtuple('BoundingBoxes', ('area',
+                                             'length_parallel',
+                                             'length_orthogonal',
+                                             'rectangle_center',
+                                             'unit_vector',
+                                             'unit_vector_angle',
+                                             'corner_points',
+                                             'orientation'))
+
+
+def _get_extreme_vertices(keys, targets, set_ids, hull_offsets, hull_counts):
+    targets = np.mod(targets, 2 * pi) + set_ids * _SET_ANGLE_STRIDE
+    c = np.searchsorted(keys, targets, side='right') - hull_offsets[set_ids]
+    return hull_offsets[set_ids] + np.mod(c, hull_counts[set_ids])
+
+
+def _get_projection_extents(hull, u, n, edge_idxs, set_ids, hull_offsets, hull_counts):
+    """
+    ( min_u, max_u, min_n, max_n ) of the given edges, from the projections of all the vertices of their hull
+    """
+    counts = hull_counts[set_ids[edge_idxs]]
+    starts = np.zeros(len(edge_idxs), dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    edges = np.repeat(edge_idxs, counts)
+    vertices = np.repeat(hull_offsets[set_ids[edge_idxs]] - starts, counts) + np.arange(counts.sum())
+    pu = np.einsum('ij,ij->i', hull[vertices], u[edges])
+    pn = np.einsum('ij,ij->i', hull[vertices], n[edges])
+    return (np.minimum.reduceat(pu, starts), np.maximum.reduceat(pu, starts),
+            np.minimum.reduceat(pn, starts), np.maximum.reduceat(pn, starts))
+
+
+def minimum_bounding_boxes_flat(points, offsets):
+    """
+    minimum area rotated rectangles of many point sets, given flat, see minimum_bounding_boxes
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    num_sets = len(offsets) - 1
+    hull, hull_offsets = convex_hulls(points, offsets)
+    hull_counts = np.diff(hull_offsets)
+    set_ids = np.repeat(np.arange(num_sets), hull_counts)
+
+    idxs = np.arange(len(hull))
+    nxt = idxs + 1
+    is_last = nxt == hull_offsets[set_ids + 1]
+    nxt[is_last] = hull_offsets[set_ids[is_last]]
+
+    edges = hull[nxt] - hull
+    lengths = np.hypot(edges[:, 0], edges[:, 1])
+    u = np.empty_like(edges)
+    u[:, 0] = 1
+    u[:, 1] = 0
+    nonzero = lengths > 0
+    u[nonzero] = edges[nonzero] / lengths[nonzero, None]
+    n = np.column_stack([-u[:, 1], u[:, 0]])
+
+    angles = np.arctan2(u[:, 1], u[:, 0])
+    rel = np.mod(angles - angles[hull_offsets[set_ids]], 2 * pi)
+    rel[hull_offsets[:-1][hull_counts > 0]] = 0
+    # the angles go up along a convex hull, rounding can make them step back a little
+    keys = np.maximum.accumulate(rel + set_ids * _SET_ANGLE_STRIDE)
+
+    # extreme vertices along u, -u and n, the edge itself is the extreme along -n
+    max_u = _get_extreme_vertices(keys, rel + pi / 2, set_ids, hull_offsets, hull_counts)
+    max_n = _get_extreme_vertices(keys, rel + pi, set_ids, hull_offsets, hull_counts)
+    min_u = _get_extreme_vertices(keys, rel + 3 * pi / 2, set_ids, hull_offsets, hull_counts)
+
+    max_u = np.einsum('ij,ij->i', hull[max_u], u)
+    min_u = np.einsum('ij,ij->i', hull[min_u], u)
+    max_n = np.einsum('ij,ij->i', hull[max_n], n)
+    min_n = np.einsum('ij,ij->i', hull, n)
+
+    if len(hull):
+        # relative to the first vertex, hulls far from the origin would lose their area to rounding
+        local = hull - hull[hull_offsets[set_ids]]
+        cross = local[:, 0] * local[nxt, 1] - local[:, 1] * local[nxt, 0]
+        starts = hull_offsets[:-1][hull_counts > 0]
+        hull_areas = np.add.reduceat(cross, starts) / 2
+        perimeters = np.add.reduceat(lengths, starts)
+        flat = np.zeros(num_sets, dtype=bool)
+        flat[hull_counts > 0] = hull_areas <= _FLAT_HULL_RATIO * perimeters * perimeters
+        flat_edges = np.flatnonzero(flat[set_ids])
+        if len(flat_edges):
+            (min_u[flat_edges], max_u[flat_edges], min_n[flat_edges], max_n[flat_edges]) = \
+                _get_projection_extents(hull, u, n, flat_edges, set_ids, hull_offsets, hull_counts)
+    areas = (max_u - min_u) * (max_n - min_n)
+
+    # first edge with the smallest area in every set
+    best = np.lexsort((idxs, areas, set_ids))
+    first = np.ones(len(best), dtype=bool)
+    first[1:] = set_ids[best][1:] != set_ids[best][:-1]
+    best = best[first]
+    has_hull = hull_counts > 0
+
+    def per_set(values):
+        out = np.full((num_sets,) + values.shape[1:], np.nan, dtype=np.float64)
+        out[has_hull] = values[best]
+        return out
+
+    area = per_set(areas)
+    bu = per_set(u)
+    bn = per_set(n)
+    (min_u, max_u, min_n, max_n) = [ per_set(v) for v in (min_u, max_u, min_n, max_n) ]
+    length_parallel = max_u - min_u
+    length_orthogonal = max_n - min_n
+    center = ((min_u + max_u) / 2)[:, None] * bu + ((min_n + max_n) / 2)[:, None] * bn
+    corners = np.stack([min_u[:, None] * bu + min_n[:, None] * bn,
+                        max_u[:, None] * bu + min_n[:, None] * bn,
+                        max_u[:, None] * bu + max_n[:, None] * bn,
+                        min_u[:, None] * bu + max_n[:, None] * bn], axis=1)
+    unit_vector_angle = np.arctan2(bu[:, 1], bu[:, 0])
+    # direction of the longer side, folded into [-pi/2, pi/2)
+    orientation = np.where(length_orthogonal > length_parallel,
+                           unit_vector_angle + pi / 2,
+                           unit_vector_angle)
+    orientation = np.mod(orientation + pi / 2, pi) - pi / 2
+
+    return BoundingBoxes(area=area,
+                         length_parallel=length_parallel,
+                         length_orthogonal=length_orthogonal,
+                         rectangle_center=center,
+                         unit_vector=bu,
+                         unit_vector_angle=unit_vector_angle,
+                         corner_points=corners,
+                         orientation=orientation)
+
+
+def minimum_bounding_boxes(point_sets):
+    """
+    minimum area rotated rectangles of a list of point sets, as a BoundingBoxes of arrays,
+    one row per set( NaN for empty sets ), corner_points are (N, 4, 2) in counter clockwise order.
+    orientation is the angle of the longer side in [-pi/2, pi/2), the direction of a text line
+    """
+    points, offsets = _to_flat(point_sets)
+    return minimum_bounding_boxes_flat(points, offsets)
 
 
 #https://bitbucket.org/william_rusnack/minimumboundingbox/src/master/MinimumBoundingBox.py
@@ -45,7 +257,7 @@ class ConvexHull2D():
 def unit_vector(pt0, pt1):
     # returns an unit vector that points in the direction of pt0 to pt1
     dis_0_to_1 = sqrt((pt0[0] - pt1[0])**2 + (pt0[1] - pt1[1])**2)
-    return ((pt1[0] - pt0[0]) / dis_0_to_1, 
+    return ((pt1[0] - pt0[0]) / dis_0_to_1,
             (pt1[1] - pt0[1]) / dis_0_to_1)
 
 
@@ -55,16 +267,19 @@ def orthogonal_vector(vector):
 
 
 def bounding_area(index, hull):
+    # rectangle around the hull with a side along the edge from hull[index] to hull[index+1],
+    # rectangle_center is in ( parallel, orthogonal ) coordinates, see to_xy_coordinates
     unit_vector_p = unit_vector(hull[index], hull[index+1])
     unit_vector_o = orthogonal_vector(unit_vector_p)
 
-    dis_p = tuple(np.dot(unit_vector_p, pt) for pt in hull)
-    dis_o = tuple(np.dot(unit_vector_o, pt) for pt in hull)
+    pts = np.asarray(hull, dtype=np.float64).reshape(-1, 2)
+    dis_p = pts @ np.array(unit_vector_p)
+    dis_o = pts @ np.array(unit_vector_o)
 
-    min_p = min(dis_p)
-    min_o = min(dis_o)
-    len_p = max(dis_p) - min_p
-    len_o = max(dis_o) - min_o
+    min_p = float(dis_p.min())
+    min_o = float(dis_o.min())
+    len_p = float(dis_p.max()) - min_p
+    len_o = float(dis_o.max()) - min_o
 
     return {'area': len_p * len_o,
             'length_parallel': len_p,
@@ -77,8 +292,8 @@ def bounding_area(index, hull):
 def to_xy_coordinates(unit_vector_angle, point):
     # returns converted unit vector coordinates in x, y coordinates
     angle_orthogonal = unit_vector_angle + pi / 2
-    return point[0] * cos(unit_vector_angle) + point[1] * cos(angle_orthogonal), \
-           point[0] * sin(unit_vector_angle) + point[1] * sin(angle_orthogonal)
+    return point[0] * np.cos(unit_vector_angle) + point[1] * np.cos(angle_orthogonal), \
+           point[0] * np.sin(unit_vector_angle) + point[1] * np.sin(angle_orthogonal)
 
 
 def rotate_points(center_of_rotation, angle, points):
@@ -86,28 +301,21 @@ def rotate_points(center_of_rotation, angle, points):
     #           angle to be in radians
     #           points to be a list or tuple of points. ex: ((1.56, -23.4), (1.56, -23.4))
     # Effects: rotates a point cloud around the center_of_rotation point by angle
-    rot_points = []
-    ang = []
-    for pt in points:
-        diff = tuple([pt[d] - center_of_rotation[d] for d in range(2)])
-        diff_angle = atan2(diff[1], diff[0]) + angle
-        ang.append(diff_angle)
-        diff_length = sqrt(sum([d**2 for d in diff]))
-        rot_points.append((center_of_rotation[0] + diff_length * cos(diff_angle),
-                           center_of_rotation[1] + diff_length * sin(diff_angle)))
-
-    return rot_points
+    center = np.asarray(center_of_rotation, dtype=np.float64)
+    diff = np.asarray(points, dtype=np.float64).reshape(-1, 2) - center
+    (c, s) = (np.cos(angle), np.sin(angle))
+    rot = np.column_stack([diff[:, 0] * c - diff[:, 1] * s,
+                           diff[:, 0] * s + diff[:, 1] * c]) + center
+    return [ tuple(p) for p in rot.tolist() ]
 
 
 def rectangle_corners(rectangle):
-    # Requires: the output of mon_bounding_rectangle
+    # Requires: a bounding_area dict with unit_vector_angle set and rectangle_center in x, y coordinates
     # Effects: returns the corner locations of the bounding rectangle
-    corner_points = []
-    for i1 in (.5, -.5):
-        for i2 in (i1, -1 * i1):
-            corner_points.append((rectangle['rectangle_center'][0] + i1 * rectangle['length_parallel'],
-                            rectangle['rectangle_center'][1] + i2 * rectangle['length_orthogonal']))
-
+    (cx, cy) = rectangle['rectangle_center']
+    (half_p, half_o) = (rectangle['length_parallel'] / 2, rectangle['length_orthogonal'] / 2)
+    corner_points = [ (cx + half_p, cy + half_o), (cx + half_p, cy - half_o),
+                      (cx - half_p, cy - half_o), (cx - half_p, cy + half_o) ]
     return rotate_points(rectangle['rectangle_center'], rectangle['unit_vector_angle'], corner_points)
 
 
@@ -129,36 +337,28 @@ def MinimumBoundingBox(points):
     #               length_parallel: length of the side that is parallel to unit_vector
     #               length_orthogonal: length of the side that is orthogonal to unit_vector
     #               rectangle_center: coordinates of the rectangle center
-    #                   (use rectangle_corners to get the corner points of the rectangle)
     #               unit_vector: direction of the length_parallel side. RADIANS
     #                   (it's orthogonal vector can be found with the orthogonal_vector function
     #               unit_vector_angle: angle of the unit vector
     #               corner_points: set that contains the corners of the rectangle
+    # for many point sets use minimum_bounding_boxes
 
     if len(points) <= 2:
         raise ValueError('More than two points required.')
 
-    hull_ordered = [points[index] for index in ConvexHull2D(points).vertices]
-    hull_ordered.append(hull_ordered[0])
-    hull_ordered = tuple(hull_ordered)
+    return get_bounding_box(minimum_bounding_boxes([points]), 0)
 
-    min_rectangle = bounding_area(0, hull_ordered)
-    for i in range(1, len(hull_ordered)-1):
-        rectangle = bounding_area(i, hull_ordered)
-        if rectangle['area'] < min_rectangle['area']:
-            min_rectangle = rectangle
 
-    min_rectangle['unit_vector_angle'] = atan2(min_rectangle['unit_vector'][1], min_rectangle['unit_vector'][0])
-    min_rectangle['rectangle_center'] = to_xy_coordinates(min_rectangle['unit_vector_angle'], min_rectangle['rectangle_center'])
-
-    # this is ugly but a quick hack and is being changed in the speedup branch
+def get_bounding_box(boxes, i):
+    """
+    i'th row of a BoundingBoxes as a BoundingBox
+    """
     return BoundingBox(
-        area = min_rectangle['area'],
-        length_parallel = min_rectangle['length_parallel'],
-        length_orthogonal = min_rectangle['length_orthogonal'],
-        rectangle_center = min_rectangle['rectangle_center'],
-        unit_vector = min_rectangle['unit_vector'],
-        unit_vector_angle = min_rectangle['unit_vector_angle'],
-        corner_points = set(rectangle_corners(min_rectangle))
+        area = float(boxes.area[i]),
+        length_parallel = float(boxes.length_parallel[i]),
+        length_orthogonal = float(boxes.length_orthogonal[i]),
+        rectangle_center = tuple(boxes.rectangle_center[i].tolist()),
+        unit_vector = tuple(boxes.unit_vector[i].tolist()),
+        unit_vector_angle = float(boxes.unit_vector_angle[i]),
+        corner_points = set(tuple(p) for p in boxes.corner_points[i].tolist())
     )
-
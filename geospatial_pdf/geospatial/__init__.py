@@ -9,22 +9,49 @@ class PDFPageOptionalGenericTextAggregator(PDFPageOptionalAggregator,
 
     def begin_textgroup(self):
         PDFGenericTextDevice.begin_textgroup(self)
-        for i, active in enumerate(self.active_status):
-            if not active:
-                return
+        if self.compact:
+            self.begin_table_container()
+            return
+
+        for i in self.iter_active_layers():
             logger.info(f'executing begin textgroup for layer {self.active_combo_lists[i]}')
             with self.layer_context(i):
                 PDFGenericTextDevice.begin_textgroup(self)
 
     def end_textgroup(self):
+        tlg = self.cur_item
         PDFGenericTextDevice.end_textgroup(self)
-        for i, active in enumerate(self.active_status):
-            if not active:
-                return
+        if self.compact:
+            idx = self.end_table_container()
+            # everything in the group was clipped away, so it didn't make it to the page either
+            if idx != -1 and self.layer_table.objs[idx] is tlg and self.is_clipped_textgroup(tlg):
+                self.layer_table.remove_last()
+            return
+
+        for i in self.iter_active_layers():
             logger.info(f'executing end textgroup for layer {self.active_combo_lists[i]}')
             with self.layer_context(i):
                 PDFGenericTextDevice.end_textgroup(self)
 
+    def add_char_generic(self, item):
+        PDFGenericTextDevice.add_char_generic(self, item)
+        self.add_last_to_layers()
+
+    def render_chars_generic(self, matrix,
+                             font, fontsize,
+                             scaling, rise,
+                             glyphs, ncs,
+                             graphicstate):
+        # every string goes through here( see PDFGenericTextDevice.render_string ),
+        # the string was already laid out, so the text position moves on regardless
+        if self.skipping:
+            return
+        PDFGenericTextDevice.render_chars_generic(self, matrix,
+                                                  font, fontsize,
+                                                  scaling, rise,
+                                                  glyphs, ncs,
+                                                  graphicstate)
+
 
 class PDFOptionalGenericTextInterpreter(PDFPageOptionalInterpreter,
                                         PDFPageGenericTextInterpreter):
@@ -1,12 +1,116 @@
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdfpage import PDFPage
+
 from . import (PDFPageOptionalGenericTextAggregator,
                PDFOptionalGenericTextInterpreter)
 
-from ..layers.high_level import parse_layered_pdf_file
+from ..layers.high_level import (parse_layered_pdf_file,
+                                 iter_layered_pdf_pages)
+from ..layers.cache import DEFAULT_MAX_BYTES
+from .utils import (get_page_viewports,
+                    get_page_neatline,
+                    NeatlineClip)
+
+
+def iter_geospatial_pdf_pages(filename,
+                              laparams=None,
+                              compact=False,
+                              workers=None,
+                              layers=None,
+                              layers_only=False,
+                              clip=None,
+                              clip_partial=True,
+                              crop_to_neatline=False,
+                              path_store=False,
+                              path_tolerance=None,
+                              cache_forms=False,
+                              symbol_max_size=None,
+                              cache_dir=None,
+                              cache_max_bytes=DEFAULT_MAX_BYTES):
+    """
+    crop_to_neatline: drop everything outside the neatline of each page( legends, title blocks, scale bars.. )
+                      while parsing, see get_geospatial_pdf_neatlines
+    the rest of the arguments are as in iter_layered_pdf_pages
+    """
+    if crop_to_neatline:
+        clip = NeatlineClip(clip)
+
+    return iter_layered_pdf_pages(filename,
+                                  AggregatorClass=PDFPageOptionalGenericTextAggregator,
+                                  InterpreterClass=PDFOptionalGenericTextInterpreter,
+                                  laparams=laparams,
+                                  compact=compact,
+                                  workers=workers,
+                                  layers=layers,
+                                  layers_only=layers_only,
+                                  clip=clip,
+                                  clip_partial=clip_partial,
+                                  path_store=path_store,
+                                  path_tolerance=path_tolerance,
+                                  cache_forms=cache_forms,
+                                  symbol_max_size=symbol_max_size,
+                                  cache_dir=cache_dir,
+                                  cache_max_bytes=cache_max_bytes)
+
 
 def parse_geospatial_pdf_file(filename,
-                              laparams=None):
+                              laparams=None,
+                              compact=False,
+                              workers=None,
+                              layers=None,
+                              layers_only=False,
+                              clip=None,
+                              clip_partial=True,
+                              crop_to_neatline=False,
+                              path_store=False,
+                              path_tolerance=None,
+                              cache_forms=False,
+                              symbol_max_size=None,
+                              cache_dir=None,
+                              cache_max_bytes=DEFAULT_MAX_BYTES):
+    """
+    see iter_geospatial_pdf_pages
+    """
+    if crop_to_neatline:
+        clip = NeatlineClip(clip)
 
     return parse_layered_pdf_file(filename,
                                   AggregatorClass=PDFPageOptionalGenericTextAggregator,
                                   InterpreterClass=PDFOptionalGenericTextInterpreter,
-                                  laparams=laparams)
+                                  laparams=laparams,
+                                  compact=compact,
+                                  workers=workers,
+                                  layers=layers,
+                                  layers_only=layers_only,
+                                  clip=clip,
+                                  clip_partial=clip_partial,
+                                  path_store=path_store,
+                                  path_tolerance=path_tolerance,
+                                  cache_forms=cache_forms,
+                                  symbol_max_size=symbol_max_size,
+                                  cache_dir=cache_dir,
+                                  cache_max_bytes=cache_max_bytes)
+
+
+def get_geospatial_pdf_neatlines(filename):
+    """
+    returns {pno: shapely geometry} with the neatlines of the georeferenced pages of the file, in layout space
+    """
+    return { pno: get_page_neatline(viewports)
+             for pno, viewports in get_geospatial_pdf_viewports(filename).items() }
+
+
+def get_geospatial_pdf_viewports(filename):
+    """
+    returns {pno: [Viewport, ..]} for the georeferenced pages of the file
+    """
+    viewports_info = {}
+    with open(filename, 'rb') as f:
+        parser = PDFParser(f)
+        document = PDFDocument(parser)
+        for pno, page in enumerate(PDFPage.create_pages(document)):
+            viewports = get_page_viewports(page)
+            if len(viewports):
+                viewports_info[pno] = viewports
+    return viewports_info
@@ -0,0 +1,395 @@
+import logging
+
+import numpy as np
+import shapely
+
+from pdfminer.pdftypes import resolve1, resolve_all
+from pdfminer.psparser import PSLiteral
+
+from ..layers.utils import decode_text_special
+from ..clip import ClipRegion
+
+logger = logging.getLogger(__name__)
+
+# N.B.
+# Geospatial reference information, see reference/sample.java for the flavors
+#
+# Handled:
+#   (1) Page-based ISO 32000-2 viewports, /VP on the page with a /Measure of Subtype /GEO
+#   (4) Page-based TerraGo information, /LGIDict on the page
+# Not handled:
+#   (2) Image-based and (3) XObject-based ISO viewports
+#     - the measure is relative to where the image/form is drawn, which is only known while interpreting
+#
+# Transforms are 3x3 affine matrices in row vector form, [x y 1] @ M = [X Y 1],
+# and map layout( device ) space, as used by pdfminer layouts, to world coordinates.
+# ISO viewports map to geographic (lon, lat) as GPTS are always geographic,
+# TerraGo viewports map to the coordinates of the projection given by the LGIDict
+#
+# Neatlines( the outline of the map frame, what ogrinfo reports as NEATLINE ) are kept in layout space,
+#   - ISO: the /Bounds of the measure spread over the viewport /BBox, or the /BBox itself
+#   - TerraGo: the /Neatline of the LGIDict, or the page mediabox
+# everything outside them is margin furniture, legends, title blocks, scale bars and the like
+
+
+def matrix_to_affine(matrix):
+    (a, b, c, d, e, f) = matrix
+    return np.array([[a, b, 0],
+                     [c, d, 0],
+                     [e, f, 1]], dtype=np.float64)
+
+
+def get_page_ctm(page):
+    # same as what PDFPageInterpreter.process_page sets up
+    (x0, y0, x1, y1) = page.mediabox
+    if page.rotate == 90:
+        ctm = (0, -1, 1, 0, -y0, x1)
+    elif page.rotate == 180:
+        ctm = (-1, 0, 0, -1, x1, y1)
+    elif page.rotate == 270:
+        ctm = (0, 1, -1, 0, y1, -x0)
+    else:
+        ctm = (1, 0, 0, 1, -x0, -y0)
+    return ctm
+
+
+def fit_affine(src, dst):
+    """
+    least squares affine transform taking the src points to the dst points
+    """
+    src = np.asarray(src, dtype=np.float64).reshape(-1, 2)
+    dst = np.asarray(dst, dtype=np.float64).reshape(-1, 2)
+    if len(src) < 2 or len(src) != len(dst):
+        raise ValueError('need at least two matching point pairs to fit a transform')
+
+    if len(src) == 2:
+        # no way to know about rotation/shear, assume axis aligned scaling
+        scale = (dst[1] - dst[0]) / (src[1] - src[0])
+        offset = dst[0] - src[0] * scale
+        return np.array([[scale[0], 0, 0],
+                         [0, scale[1], 0],
+                         [offset[0], offset[1], 1]], dtype=np.float64)
+
+    A = np.hstack([src, np.ones((len(src), 1))])
+    coeffs, _, rank, _ = np.linalg.lstsq(A, dst, rcond=None)
+    if rank < 3:
+        raise ValueError('points are collinear, can not fit a transform')
+    M = np.zeros((3, 3), dtype=np.float64)
+    M[:, :2] = coeffs
+    M[2, 2] = 1
+    return M
+
+
+def apply_affine(M, coords):
+    """
+    transforms an (N, 2) array of points in one go
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    shape = coords.shape
+    coords = coords.reshape(-1, 2)
+    out = coords @ M[:2, :2] + M[2, :2]
+    return out.reshape(shape)
+
+
+def _to_float(v):
+    v = resolve1(v)
+    if isinstance(v, bytes):
+        v = v.decode('latin-1')
+    return float(v)
+
+
+def _to_str(v):
+    v = resolve1(v)
+    if isinstance(v, bytes):
+        return decode_text_special(v)
+    if isinstance(v, PSLiteral):
+        return v.name
+    return v
+
+
+def _to_points(arr):
+    vals = [ _to_float(v) for v in resolve1(arr) ]
+    return np.array(vals, dtype=np.float64).reshape(-1, 2)
+
+
+class Viewport:
+    """
+    a georeferenced area of a page
+    """
+    def __init__(self, kind, name, bbox, transform, wkt=None, epsg=None, info=None, neatline=None):
+        self.kind = kind
+        self.name = name
+        # in layout space
+        self.bbox = bbox
+        # (N, 2) polygon in layout space, the bbox corners if not given
+        if neatline is None:
+            (x0, y0, x1, y1) = bbox
+            neatline = np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=np.float64)
+        self.neatline = neatline
+        self.transform = transform
+        self.wkt = wkt
+        self.epsg = epsg
+        self.info = info if info is not None else {}
+
+
+    def __repr__(self):
+        return f'<Viewport {self.kind} {self.name!r} bbox={self.bbox} epsg={self.epsg}>'
+
+
+    def contains(self, coords):
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        (x0, y0, x1, y1) = self.bbox
+        return (coords[:, 0] >= x0) & (coords[:, 0] <= x1) & \
+               (coords[:, 1] >= y0) & (coords[:, 1] <= y1)
+
+
+    def to_world(self, coords):
+        return apply_affine(self.transform, coords)
+
+
+    def get_neatline_polygon(self):
+        polygon = shapely.polygons(self.neatline)
+        if not polygon.is_valid:
+            polygon = shapely.make_valid(polygon)
+        return polygon
+
+
+def _get_layout_bbox(user_bbox, device_from_user):
+    (x0, y0, x1, y1) = [ _to_float(v) for v in user_bbox ]
+    corners = np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=np.float64)
+    corners = apply_affine(device_from_user, corners)
+    return tuple(corners.min(axis=0).tolist() + corners.max(axis=0).tolist())
+
+
+def _get_layout_neatline(user_pts, device_from_user):
+    if len(user_pts) < 3:
+        return None
+    return apply_affine(device_from_user, user_pts)
+
+
+def _get_iso_viewport(vp, device_from_user, user_from_device):
+    measure = resolve1(vp.get('Measure', None))
+    if measure is None:
+        return None
+    subtype = resolve1(measure.get('Subtype', None))
+    if not isinstance(subtype, PSLiteral) or subtype.name != 'GEO':
+        return None
+
+    (x0, y0, x1, y1) = [ _to_float(v) for v in resolve1(vp['BBox']) ]
+    gpts = _to_points(measure['GPTS'])
+    bounds = _to_points(measure.get('Bounds', [0, 0, 0, 1, 1, 1, 1, 0]))
+    lpts = measure.get('LPTS', None)
+    lpts = bounds if lpts is None else _to_points(lpts)
+
+    # LPTS are in a unit square spread over the viewport bbox
+    user_pts = np.column_stack([x0 + lpts[:, 0] * (x1 - x0),
+                                y0 + lpts[:, 1] * (y1 - y0)])
+    # GPTS are lat, lon pairs
+    world_pts = gpts[:, ::-1]
+    world_from_user = fit_affine(user_pts, world_pts)
+
+    wkt = None
+    epsg = None
+    gcs = resolve1(measure.get('GCS', None))
+    if gcs is not None:
+        gcs = resolve1(gcs)
+        if 'WKT' in gcs:
+            wkt = _to_str(gcs['WKT'])
+        if 'EPSG' in gcs:
+            epsg = int(resolve1(gcs['EPSG']))
+
+    name = _to_str(vp['Name']) if 'Name' in vp else None
+    neatline = np.column_stack([x0 + bounds[:, 0] * (x1 - x0),
+                                y0 + bounds[:, 1] * (y1 - y0)])
+    return Viewport('iso', name,
+                    _get_layout_bbox((x0, y0, x1, y1), device_from_user),
+                    user_from_device @ world_from_user,
+                    wkt=wkt, epsg=epsg,
+                    neatline=_get_layout_neatline(neatline, device_from_user))
+
+
+def _get_terrago_viewport(lgi, page, device_from_user, user_from_device):
+    if 'CTM' in lgi:
+        world_from_user = matrix_to_affine([ _to_float(v) for v in resolve1(lgi['CTM']) ])
+    elif 'Registration' in lgi:
+        pts = np.array([ [ _to_float(v) for v in resolve1(r) ] for r in resolve1(lgi['Registration']) ],
+                       dtype=np.float64)
+        world_from_user = fit_affine(pts[:, :2], pts[:, 2:4])
+    else:
+        return None
+
+    neatline = None
+    if 'Neatline' in lgi:
+        neatline = _to_points(lgi['Neatline'])
+        bbox = tuple(neatline.min(axis=0).tolist() + neatline.max(axis=0).tolist())
+        neatline = _get_layout_neatline(neatline, device_from_user)
+    else:
+        bbox = page.mediabox
+
+    info = {}
+    for key in ('Description', 'Projection', 'Display'):
+        if key in lgi:
+            value = resolve_all(lgi[key])
+            if isinstance(value, dict):
+                value = { k: _to_str(v) for k, v in value.items() }
+            else:
+                value = _to_str(value)
+            info[key] = value
+
+    return Viewport('terrago', info.get('Description', None),
+                    _get_layout_bbox(bbox, device_from_user),
+                    user_from_device @ world_from_user,
+                    info=info,
+                    neatline=neatline)
+
+
+def get_page_viewports(page):
+    """
+    all georeferenced viewports of the page, with transforms from layout space to world coordinates
+    """
+    device_from_user = matrix_to_affine(get_page_ctm(page))
+    user_from_device = np.linalg.inv(device_from_user)
+
+    # TerraGo information covers the whole map, so the ISO viewports go on top of it
+    viewports = []
+    lgis = resolve1(page.attrs.get('LGIDict', []))
+    if isinstance(lgis, dict):
+        lgis = [lgis]
+    for lgi in lgis:
+        lgi = resolve1(lgi)
+        try:
+            viewport = _get_terrago_viewport(lgi, page, device_from_user, user_from_device)
+        except (KeyError, ValueError) as ex:
+            logger.warning(f'unable to read LGIDict {lgi}: {ex}')
+            continue
+        if viewport is not None:
+            viewports.append(viewport)
+    for vp in resolve1(page.attrs.get('VP', [])):
+        vp = resolve1(vp)
+        try:
+            viewport = _get_iso_viewport(vp, device_from_user, user_from_device)
+        except (KeyError, ValueError) as ex:
+            logger.warning(f'unable to read viewport {vp}: {ex}')
+            continue
+        if viewport is not None:
+            viewports.append(viewport)
+
+    return viewports
+
+
+def get_page_neatline(viewports):
+    """
+    union of the neatlines of the viewports as a shapely geometry in layout space, None if there are no viewports
+    """
+    if len(viewports) == 0:
+        return None
+    return shapely.union_all([ viewport.get_neatline_polygon() for viewport in viewports ])
+
+
+class NeatlineClip:
+    """
+    clip argument for the layered parsers( see clip.py ) which crops every page to its neatline,
+    and to clip as well if it is given. pages without viewports are only clipped to clip
+    """
+    def __init__(self, clip=None):
+        self.clip = clip
+
+
+    def __call__(self, page):
+        neatline = get_page_neatline(get_page_viewports(page))
+        if neatline is None:
+            logger.warning(f'no neatline found on page {page.pageid}, not cropping')
+            return self.clip
+        if self.clip is None:
+            return neatline
+        return neatline.intersection(ClipRegion(self.clip).get_geometry())
+
+
+def get_viewport_idxs(viewports, coords):
+    """
+    index of the last viewport containing each point of an (N, 2) array( later viewports are drawn on top ),
+    -1 for points outside all the viewports
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    idxs = np.full(len(coords), -1, dtype=np.int64)
+    for i in reversed(range(len(viewports))):
+        mask = (idxs == -1) & viewports[i].contains(coords)
+        idxs[mask] = i
+    return idxs
+
+
+def page_to_world(viewports, coords):
+    """
+    transforms an (N, 2) array of layout space points to world coordinates,
+    using the last viewport containing each point( later viewports are drawn on top ),
+    points outside all the viewports come out as NaN
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    shape = coords.shape
+    coords = coords.reshape(-1, 2)
+    out = np.full(coords.shape, np.nan, dtype=np.float64)
+    idxs = get_viewport_idxs(viewports, coords)
+    for i, viewport in enumerate(viewports):
+        mask = idxs == i
+        if mask.any():
+            out[mask] = viewport.to_world(coords[mask])
+    return out.reshape(shape)
+
+
+def matrices_to_world(viewports, matrices):
+    """
+    (N, 6) pdfminer matrices( glyph or form space to layout space ) to ones mapping to world coordinates,
+    with the viewport containing the origin of each, NaN where no viewport contains it
+    """
+    matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 6)
+    out = np.full(matrices.shape, np.nan, dtype=np.float64)
+    idxs = get_viewport_idxs(viewports, matrices[:, 4:])
+    for i, viewport in enumerate(viewports):
+        mask = idxs == i
+        if not mask.any():
+            continue
+        M = viewport.transform
+        (a, b, c, d, e, f) = matrices[mask].T
+        # [x y 1] @ matrix_to_affine(m) @ M, for every row
+        out[mask] = np.column_stack([a * M[0, 0] + b * M[1, 0], a * M[0, 1] + b * M[1, 1],
+                                     c * M[0, 0] + d * M[1, 0], c * M[0, 1] + d * M[1, 1],
+                                     e * M[0, 0] + f * M[1, 0] + M[2, 0],
+                                     e * M[0, 1] + f * M[1, 1] + M[2, 1]])
+    return out
+
+
+def _bboxes_to_corners(bboxes):
+    (x0, y0, x1, y1) = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4).T
+    return np.stack([np.column_stack([x0, y0]), np.column_stack([x1, y0]),
+                     np.column_stack([x1, y1]), np.column_stack([x0, y1])], axis=1)
+
+
+def _corners_to_bboxes(corners):
+    # NaN if any corner is outside the viewports
+    return np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1).reshape(-1, 4)
+
+
+def georeference_arrays(layer_arrays, viewports):
+    """
+    world coordinate version of a LayerArrays( see layers.arrays ), all the geometry columns are transformed:
+    path vertices, text corners, text and symbol matrices, and the bboxes, which are
+    the bounds of the transformed corners( NaN if a corner is outside all the viewports ).
+    the rest of the columns are kept as they are
+    """
+    paths = layer_arrays.paths._replace(
+        vertices=page_to_world(viewports, layer_arrays.paths.vertices)
+    )
+    corners = page_to_world(viewports, layer_arrays.text.corners)
+    text = layer_arrays.text._replace(
+        corners=corners,
+        bboxes=_corners_to_bboxes(corners),
+        matrices=matrices_to_world(viewports, layer_arrays.text.matrices),
+    )
+    images = layer_arrays.images._replace(
+        bboxes=_corners_to_bboxes(page_to_world(viewports, _bboxes_to_corners(layer_arrays.images.bboxes)))
+    )
+    symbols = layer_arrays.symbols._replace(
+        bboxes=_corners_to_bboxes(page_to_world(viewports, _bboxes_to_corners(layer_arrays.symbols.bboxes))),
+        matrices=matrices_to_world(viewports, layer_arrays.symbols.matrices),
+    )
+    return layer_arrays._replace(paths=paths, text=text, images=images, symbols=symbols)
@@ -1,9 +1,24 @@
+import copy
 import logging
 
-from pdfminer.psparser import LIT
+from array import array
+from collections.abc import Mapping
+
+from pdfminer.psparser import LIT, literal_name
+from pdfminer.pdftypes import stream_value, dict_value
 from pdfminer.pdfinterp import PDFPageInterpreter
 from pdfminer.converter import PDFPageAggregator
-from pdfminer.layout import LTPage
+from pdfminer.layout import (LTPage, LTContainer,
+                             LTExpandableContainer)
+from pdfminer.utils import INF
+
+from .utils import get_ref_OC_name
+from .paths import PathStore
+from .forms import LTSymbolInstance, FormRecorder, get_form_placement
+from ..clip import (get_clip_region,
+                    pop_clipped,
+                    is_xobj_clipped,
+                    is_inline_image_clipped)
 
 
 logger = logging.getLogger(__name__)
@@ -11,11 +26,12 @@ logger = logging.getLogger(__name__)
 # N.B.
 # only implements a minor part of the Optional Content specs..
 #
-# OCG to OCMD mapping is not handled
-#   - should be easy enough to add.. might need to move from name based system to an id based system?
-#   - Need a sample file to work with
-# OC specifications in XObject and Annotations are not handled
-#   - should also be easy to add.. I don't have sample file which uses this
+# OCMDs are evaluated against the OCGs of each combo( /VE expressions and /OCGs + /P policies ),
+# and then used like any other OC name through a precomputed bitmask, see utils.OCInfoCache.get_OCMD_masks
+# OC entries of Form and Image XObjects go on the OC stack for the duration of the Do
+#   - in layers_only mode, xobjects which are in none of the active combos are not even interpreted
+# OC specifications in Annotations are not handled
+#   - pdfminer doesn't render annotation appearances at all
 # Intent and Usage Application Dictionaries I didn't even touch..
 #   - though this feels more like a display related problem
 # Some other complicated stuff I am ignoring
@@ -31,18 +47,164 @@ logger = logging.getLogger(__name__)
 LITERAL_OC = LIT('OC')
 
 
+class LayerMembershipTable:
+    """
+    records every page object once, along with a bitmask of the layers it belongs to
+    """
+    def __init__(self, num_layers):
+        self.num_layers = num_layers
+        self.num_words = max(1, (num_layers + 63) // 64)
+        self.objs = []
+        # index of the enclosing container entry, -1 for the page itself
+        self.parents = array('l')
+        # num_words 64 bit words per object
+        self.masks = array('Q')
+
+
+    def __len__(self):
+        return len(self.objs)
+
+
+    def add(self, obj, mask, parent):
+        idx = len(self.objs)
+        self.objs.append(obj)
+        self.parents.append(parent)
+        for _ in range(self.num_words):
+            self.masks.append(mask & 0xFFFFFFFFFFFFFFFF)
+            mask >>= 64
+        return idx
+
+
+    def remove_last(self):
+        """
+        takes back the last added object, for containers which ended up empty
+        """
+        self.objs.pop()
+        self.parents.pop()
+        for _ in range(self.num_words):
+            self.masks.pop()
+
+
+    def has_layer(self, idx, i):
+        word = self.masks[idx * self.num_words + (i >> 6)]
+        return ((word >> (i & 63)) & 1) == 1
+
+
+    def get_mask(self, idx):
+        mask = 0
+        start = idx * self.num_words
+        for w in range(self.num_words):
+            mask |= self.masks[start + w] << (64 * w)
+        return mask
+
+
+    def build_layer_page(self, i, ltpage):
+        layer_page = LTPage(ltpage.pageid, ltpage.bbox, rotate=ltpage.rotate)
+        views = {-1: layer_page}
+        children = {-1: []}
+        for idx, obj in enumerate(self.objs):
+            if not self.has_layer(idx, i):
+                continue
+            # attach to the closest enclosing container which is part of the layer
+            parent = self.parents[idx]
+            while parent != -1 and not self.has_layer(parent, i):
+                parent = self.parents[parent]
+            if isinstance(obj, LTContainer):
+                view = copy.copy(obj)
+                view._objs = []
+                if hasattr(view, 'reset_bounds'):
+                    # keeps more than just the bbox, see generictext
+                    view.reset_bounds()
+                elif isinstance(view, LTExpandableContainer):
+                    view.set_bbox((+INF, +INF, -INF, -INF))
+                views[idx] = view
+                children[idx] = []
+            else:
+                view = obj
+            children[parent].append(view)
+
+        # containers always come before their children in the table,
+        # so filling them up in reverse order completes the inner ones first
+        for idx in sorted(children.keys(), reverse=True):
+            views[idx].extend(children[idx])
+        return layer_page
+
+
+class LazyLayerLayouts(Mapping):
+    """
+    maps layer names to layouts, per layer LTPages are only built when asked for
+    """
+    def __init__(self, full_page_layout, layer_names, table,
+                 laparams=None, include_full_page=True, paths=None):
+        self.full_page_layout = full_page_layout
+        self.include_full_page = include_full_page
+        self.layer_names = layer_names
+        self.layer_idxs = { name: i for i, name in enumerate(layer_names) }
+        self.table = table
+        self.laparams = laparams
+        self.paths = paths
+        self.built = {}
+
+
+    def __getitem__(self, layer_name):
+        if layer_name == '' and self.include_full_page:
+            return self.full_page_layout
+        if layer_name in self.built:
+            return self.built[layer_name]
+        i = self.layer_idxs[layer_name]
+        layout = self.table.build_layer_page(i, self.full_page_layout)
+        if self.laparams is not None:
+            layout.analyze(self.laparams)
+        if self.paths is not None:
+            layout.paths = self.paths.get_layer(i)
+        self.built[layer_name] = layout
+        return layout
+
+
+    def __iter__(self):
+        yield from self.layer_names
+        if self.include_full_page:
+            yield ''
+
+
+    def __len__(self):
+        return len(self.layer_names) + (1 if self.include_full_page else 0)
+
+
 # According to the PDF Spec, all painting operations and their graphic side effects
 # need to be there even if the layer is switched off.. 
 # so we let PDFPageAggregator go through the motions of curve drawing and text writing
 # and then remove the added LTChars/LTImages and other elements from the final list
 # depending on whether we are active or not
+#
+# In compact mode, the objects are only kept in the full page layout and a
+# LayerMembershipTable records which layers each of them belongs to,
+# instead of adding every object to a separate LTPage per layer
+#
+# In layers_only mode, content which doesn't belong to any of the combos
+# is not turned into layout objects at all and the full page layout is not produced.
+# Graphics and text state changes still go through the interpreter as usual,
+# text is only measured to move the text position forward
+#
+# With a clip region, objects outside of it are dropped right after they are made,
+# before they get added to any of the layers, see clip.py
+#
+# In path store mode, painted paths don't become layout objects, they are recorded once
+# with their layer bitmask in a PathStore( see paths.py ) and every page layout gets a .paths
+# with the PagePaths of its layer
 class PDFPageOptionalAggregator(PDFPageAggregator):
 
     def __init__(self,
                  rsrcmgr,
                  pageno=1,
                  laparams=None,
-                 handle_textgroup=False):
+                 handle_textgroup=False,
+                 compact=False,
+                 layers_only=False,
+                 clip=None,
+                 clip_partial=True,
+                 path_store=False,
+                 path_tolerance=None):
         if handle_textgroup:
             if laparams is not None:
                 logger.warning('handle_textgroup is set to True' + \
@@ -55,6 +217,23 @@ class PDFPageOptionalAggregator(PDFPageAggregator):
         self.OC_stack = []
         self.set_active_combo_lists([])
         self.handle_textgroup = handle_textgroup
+        self.compact = compact
+        self.layers_only = layers_only
+        self.layer_table = None
+        self.OC_ref_names = {}
+        self.set_clip(clip, keep_partial=clip_partial)
+        self.use_path_store = path_store
+        # Douglas-Peucker tolerance for the stored paths, not simplified if None
+        self.path_tolerance = path_tolerance
+        self.path_store = None
+        self.page_paths = None
+
+
+    def set_clip(self, clip, keep_partial=True):
+        """
+        region to drop objects outside of, applies from the next page on
+        """
+        self.clip = get_clip_region(clip, keep_partial=keep_partial)
 
 
     def layer_context(self, i):
@@ -82,38 +261,102 @@ class PDFPageOptionalAggregator(PDFPageAggregator):
         return Ctx(i)
         
 
-    def get_status(self, combo_list):
-        if combo_list is None:
-            return True
-
-        active = True
-        for OC_name in self.OC_stack:
-            if OC_name is None:
+    def compile_combos(self, combo_lists, OC_masks=None):
+        """
+        converts the combo lists to a map of OC name to the bitmask of combos containing it,
+        OC_masks has precomputed bitmasks for OC names which are not in the lists( OCMDs, see get_OCMD_masks )
+        """
+        num_combos = len(combo_lists)
+        self.all_mask = (1 << num_combos) - 1
+        # combos without a list are active irrespective of the OC stack
+        self.always_mask = 0
+        self.OC_masks = {}
+        for i, combo_list in enumerate(combo_lists):
+            if combo_list is None:
+                self.always_mask |= (1 << i)
                 continue
-            if OC_name not in combo_list:
-                active = False
-                break
-        return active
+            for OC_name in combo_list:
+                self.OC_masks[OC_name] = self.OC_masks.get(OC_name, 0) | (1 << i)
+        if OC_masks is not None:
+            for OC_name, mask in OC_masks.items():
+                self.OC_masks[OC_name] = self.OC_masks.get(OC_name, 0) | (mask & self.all_mask)
+        for OC_name in self.OC_masks.keys():
+            self.OC_masks[OC_name] |= self.always_mask
+
+
+    def get_OC_mask(self, OC_name):
+        if OC_name is None:
+            return self.all_mask
+        return self.OC_masks.get(OC_name, self.always_mask)
+
+
+    @property
+    def active_mask(self):
+        return self.active_mask_stack[-1]
+
+
+    @property
+    def skipping(self):
+        return self.layers_only and self.active_mask_stack[-1] == 0
+
+
+    def set_OC_ref_names(self, OC_ref_names):
+        """
+        see get_page_OC_ref_map, for OC entries which refer to the OCG/OCMD dictionaries directly
+        """
+        self.OC_ref_names = OC_ref_names
+
+
+    def get_ref_OC_name(self, OC_ref):
+        return get_ref_OC_name(self.OC_ref_names, OC_ref)
+
+
+    @property
+    def active_status(self):
+        mask = self.active_mask
+        return [ ((mask >> i) & 1) == 1 for i in range(len(self.active_combo_lists)) ]
+
+
+    def iter_active_layers(self):
+        mask = self.active_mask
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
 
 
-    def set_active_status(self):
-        self.active_status = [ self.get_status(combo_list) for combo_list in self.active_combo_lists ] 
+    def begin_table_container(self):
+        mask = self.active_mask
+        if mask:
+            idx = self.layer_table.add(self.cur_item, mask, self.table_stack[-1])
+        else:
+            idx = self.table_stack[-1]
+        self.table_stack.append(idx)
 
 
-    def set_active_combo_lists(self, combo_lists):
+    def end_table_container(self):
+        idx = self.table_stack.pop()
+        return idx
+
+
+    def set_active_combo_lists(self, combo_lists, OC_masks=None):
         self.active_combo_lists = combo_lists
-        self.set_active_status()
+        self.compile_combos(combo_lists, OC_masks=OC_masks)
+        # rebuild the activity stack for whatever is still open
+        self.active_mask_stack = [self.all_mask]
+        for OC_name in self.OC_stack:
+            self.active_mask_stack.append(self.active_mask_stack[-1] & self.get_OC_mask(OC_name))
 
 
     def activate_OC(self, OC_name):
         self.OC_stack.append(OC_name)
-        self.set_active_status()
+        self.active_mask_stack.append(self.active_mask_stack[-1] & self.get_OC_mask(OC_name))
         logger.debug(f'current stack: {self.OC_stack}')
 
 
     def deactivate_last_OC(self):
         self.OC_stack.pop()
-        self.set_active_status()
+        self.active_mask_stack.pop()
         logger.debug(f'current stack: {self.OC_stack}')
 
 
@@ -121,9 +364,13 @@ class PDFPageOptionalAggregator(PDFPageAggregator):
         #TODO: using [-1] to access last element is a hack
         # it is not part of the pdfminer LTContainer interface
         ltobj = self.cur_item._objs[-1]
-        for i, active in enumerate(self.active_status):
-            if not active:
-                continue
+        if self.compact:
+            mask = self.active_mask
+            if mask:
+                self.layer_table.add(ltobj, mask, self.table_stack[-1])
+            return
+
+        for i in self.iter_active_layers():
             self.layers[i].add(ltobj)
 
 
@@ -135,6 +382,16 @@ class PDFPageOptionalAggregator(PDFPageAggregator):
         PDFPageAggregator.begin_page(self, page, ctm)
         ltpage = self.cur_item
         num_combos = len(self.active_combo_lists)
+        self.result = []
+        if self.use_path_store:
+            self.path_store = PathStore(num_combos)
+        if self.compact:
+            self.layer_table = LayerMembershipTable(num_combos)
+            self.table_stack = [-1]
+            self.layers = []
+            self.layer_stacks = []
+            return
+
         self.layers = [
             LTPage(ltpage.pageid, ltpage.bbox, rotate=ltpage.rotate)
             for _ in range(num_combos)
@@ -143,11 +400,37 @@ class PDFPageOptionalAggregator(PDFPageAggregator):
             []
             for _ in range(num_combos)
         ]
-        self.result = []
 
 
-    def end_page(self, page):
+    def end_full_page(self, page):
+        # nobody looks at the full page in layers_only mode, so don't bother analyzing it
+        laparams = self.laparams
+        if self.layers_only:
+            self.laparams = None
         PDFPageAggregator.end_page(self, page)
+        self.laparams = laparams
+
+
+    def finish_paths(self):
+        page_paths = self.path_store.finish()
+        if self.path_tolerance is not None:
+            page_paths = page_paths.simplify(self.path_tolerance)
+        self.path_store = None
+        self.page_paths = page_paths
+        self.result[0].paths = page_paths
+        if not self.compact:
+            for i, layout in enumerate(self.result[1:]):
+                layout.paths = page_paths.get_layer(i)
+
+
+    def end_page(self, page):
+        if self.compact:
+            self.end_full_page(page)
+            if self.path_store is not None:
+                self.finish_paths()
+            return
+
+        self.end_full_page(page)
         self.pageno -= 1
         num_layers = len(self.layers)
         for i in range(num_layers):
@@ -155,13 +438,28 @@ class PDFPageOptionalAggregator(PDFPageAggregator):
                 PDFPageAggregator.end_page(self, page)
             self.pageno -= 1
         self.pageno += 1
+        if self.path_store is not None:
+            self.finish_paths()
+
+
+    def get_layer_layouts(self, layer_names):
+        """
+        layer name to layout mapping for the last processed page in compact mode
+        """
+        assert self.compact
+        return LazyLayerLayouts(self.result[0], layer_names,
+                                self.layer_table, laparams=self.laparams,
+                                include_full_page=not self.layers_only,
+                                paths=self.page_paths if self.use_path_store else None)
 
 
     def begin_figure(self, name, bbox, matrix):
         PDFPageAggregator.begin_figure(self, name, bbox, matrix)
-        for i, active in enumerate(self.active_status):
-            if not active:
-                return
+        if self.compact:
+            self.begin_table_container()
+            return
+
+        for i in self.iter_active_layers():
             logger.debug(f'executing begin figure for layer {self.active_combo_lists[i]}')
             with self.layer_context(i):
                 PDFPageAggregator.begin_figure(self, name, bbox, matrix)
@@ -169,35 +467,74 @@ class PDFPageOptionalAggregator(PDFPageAggregator):
 
     def end_figure(self, _):
         PDFPageAggregator.end_figure(self, _)
-        for i, active in enumerate(self.active_status):
-            if not active:
-                return
+        if self.compact:
+            self.end_table_container()
+            return
+
+        for i in self.iter_active_layers():
             logger.debug(f'executing end figure for layer {self.active_combo_lists[i]}')
             with self.layer_context(i):
                 PDFPageAggregator.end_figure(self, _)
 
 
     def render_image(self, name, stream):
+        if self.skipping:
+            return
         PDFPageAggregator.render_image(self, name, stream)
+        if self.clip is not None and pop_clipped(self.clip, self.cur_item):
+            return
         self.add_last_to_layers()
 
 
+    def store_path(self, gstate, stroke, fill, evenodd, path):
+        # the whole path is recorded once, however many subpaths it has
+        parts = PathStore.get_parts(path)
+        if self.clip is not None:
+            bbox = self.path_store.get_bbox(parts, self.ctm)
+            if bbox is None or not self.clip.keeps_bbox(bbox):
+                return
+        self.path_store.add(parts, self.ctm, gstate, stroke, fill, evenodd, self.active_mask)
+
+
     def paint_path(self, gstate, stroke, fill, evenodd, path):
+        if self.skipping:
+            return
+        if self.path_store is not None:
+            self.store_path(gstate, stroke, fill, evenodd, path)
+            return
         count_before = len(self.cur_item._objs)
         PDFPageAggregator.paint_path(self, gstate, stroke, fill, evenodd, path)
         count_after = len(self.cur_item._objs)
 
-        # deal with the fact that paint_path can be called recursively
-        if count_after - count_before == 1:
-            self.add_last_to_layers()
+        # deal with the fact that paint_path can be called recursively,
+        # subpaths are added and clipped by the inner calls
+        if count_after - count_before != 1 or \
+           ''.join(x[0] for x in path).count('m') > 1:
+            return
+        if self.clip is not None and pop_clipped(self.clip, self.cur_item):
+            return
+        self.add_last_to_layers()
+
+
+    def render_symbol(self, name, objid, bbox, matrix):
+        if self.skipping:
+            return
+        self.cur_item.add(LTSymbolInstance(name, objid, bbox, matrix))
+        if self.clip is not None and pop_clipped(self.clip, self.cur_item):
+            return
+        self.add_last_to_layers()
 
 
     def render_char(self, matrix, font,
                     fontsize, scaling, rise,
                     cid, ncs, graphicstate):
+        if self.skipping:
+            return font.char_width(cid) * fontsize * scaling
         adv = PDFPageAggregator.render_char(self, matrix, font,
                                             fontsize, scaling, rise,
                                             cid, ncs, graphicstate)
+        if self.clip is not None and pop_clipped(self.clip, self.cur_item):
+            return adv
         self.add_last_to_layers()
         return adv
 
@@ -207,17 +544,121 @@ class PDFPageOptionalInterpreter(PDFPageInterpreter):
     def __init__(self, rsrcmgr, device):
         assert isinstance(device, PDFPageOptionalAggregator), str(type(device))
         PDFPageInterpreter.__init__(self, rsrcmgr, device)
+        # FormCache shared by all the pages of the document, forms are interpreted every time if not set
+        self.form_cache = None
+        # set while a form is being recorded, see forms.py
+        self.form_recorder = None
+        # OperatorTapeStore with the already tokenized content streams of the document, see tape.py
+        self.tape_store = None
+
+
+    def set_form_cache(self, form_cache):
+        self.form_cache = form_cache
+
+
+    def set_tape_store(self, tape_store):
+        self.tape_store = tape_store
+
+
+    def dup(self):
+        interpreter = PDFPageInterpreter.dup(self)
+        interpreter.form_cache = self.form_cache
+        interpreter.tape_store = self.tape_store
+        return interpreter
+
+
+    def execute(self, streams):
+        tape = None
+        if self.tape_store is not None:
+            tape = self.tape_store.get_tape(streams)
+        if tape is None:
+            return PDFPageInterpreter.execute(self, streams)
+        self.tape_store.replay(self, tape)
+
+
+    def render_form(self, xobjid, xobj):
+        """
+        Do of a form through the form cache, the form is only interpreted at its first placement
+        """
+        (bbox, matrix, ctm) = get_form_placement(xobj, self.ctm)
+        if self.form_cache.is_symbol(bbox, ctm):
+            self.device.render_symbol(xobjid, xobj.objid, bbox, ctm)
+            return
+        self.device.begin_figure(xobjid, bbox, matrix)
+        ops = self.form_cache.get(xobj)
+        if ops is not None:
+            self.form_cache.replay(self, ops, ctm)
+        else:
+            recorder = FormRecorder(self, ctm)
+            interpreter = self.dup()
+            interpreter.device = recorder
+            interpreter.form_recorder = recorder
+            interpreter.render_contents(dict_value(xobj['Resources']), [xobj])
+            self.form_cache.add(xobj, recorder.ops)
+        self.device.end_figure(xobjid)
 
 
     def do_BDC(self, tag, props):
         OC_name = props.name if tag == LITERAL_OC else None
-        logger.info(f'activating OC {OC_name}')
+        logger.debug(f'activating OC {OC_name}')
         self.device.activate_OC(OC_name)
         return PDFPageInterpreter.do_BDC(self, tag, props)
 
 
+    def do_Do(self, xobjid_arg):
+        if self.form_recorder is not None:
+            self.form_recorder.record_xobject(self, xobjid_arg)
+            return
+        # forms can't leave any state changes behind, so skipping them is safe
+        if self.device.skipping:
+            return
+        xobjid = literal_name(xobjid_arg)
+        xobj = stream_value(self.xobjmap[xobjid]) if xobjid in self.xobjmap else None
+        if xobj is not None and is_xobj_clipped(self.device.clip, xobj, self.ctm):
+            logger.debug(f'skipping xobject {xobjid} outside the clip region')
+            return
+        OC_name = self.get_xobj_OC_name(xobj) if xobj is not None else None
+        if OC_name is None:
+            return self.render_xobject(xobjid_arg, xobjid, xobj)
+
+        # everything the xobject draws is in its OC, same as a BDC/EMC around the Do.
+        # when nothing is being kept, it is not interpreted or made into an image at all
+        self.device.activate_OC(OC_name)
+        if self.device.skipping:
+            logger.debug(f'skipping xobject {xobjid} with OC {OC_name}')
+        else:
+            self.render_xobject(xobjid_arg, xobjid, xobj)
+        self.device.deactivate_last_OC()
+
+
+    def get_xobj_OC_name(self, xobj):
+        if 'OC' not in xobj:
+            return None
+        OC_name = self.device.get_ref_OC_name(xobj.get('OC'))
+        if OC_name is None:
+            logger.debug(f'OC {xobj.get("OC")} of xobject is not in the page properties, ignoring it')
+        return OC_name
+
+
+    def render_xobject(self, xobjid_arg, xobjid, xobj):
+        if self.form_cache is not None and xobj is not None and self.form_cache.can_cache(xobj):
+            return self.render_form(xobjid, xobj)
+        return PDFPageInterpreter.do_Do(self, xobjid_arg)
+
+
+    def do_EI(self, obj):
+        if self.form_recorder is not None:
+            self.form_recorder.record_inline_image(self, obj)
+            return
+        if self.device.skipping:
+            return
+        if is_inline_image_clipped(self.device.clip, self.ctm):
+            return
+        return PDFPageInterpreter.do_EI(self, obj)
+
+
     def do_EMC(self):
-        logger.info('deactivating last OC')
+        logger.debug('deactivating last OC')
         self.device.deactivate_last_OC()
         return PDFPageInterpreter.do_EMC(self)
 
@@ -0,0 +1,249 @@
+import logging
+
+from collections import namedtuple
+
+import numpy as np
+
+from pdfminer.layout import (LTCurve, LTLine, LTRect,
+                             LTChar, LTImage, LTAnno)
+
+from .forms import LTSymbolInstance
+
+logger = logging.getLogger(__name__)
+
+# N.B.
+# columnar export of layouts, so that geometry can be worked on with vectorized code
+# instead of walking pdfminer object trees
+#
+# paths: vertices of all paths in one flat (N, 2) float64 buffer,
+#        vertices of path i are vertices[offsets[i]:offsets[i+1]]
+# colors: padded to 4 components with NaN, num components tells how many are real,
+#         0 for patterns or missing colors
+# text: one row per char, text[i] is text_buffer[text_offsets[i]:text_offsets[i+1]]
+#       as pdfminer chars can hold more than one codepoint( ligatures, undefined cids )
+#       codepoints is -1 for those
+# symbols: one row per LTSymbolInstance( form placements which were not expanded, see forms.py ),
+#          objids is -1 for forms without an object id
+
+PATH_KIND_CURVE = 0
+PATH_KIND_LINE = 1
+PATH_KIND_RECT = 2
+
+PathArrays = namedtuple('PathArrays', ('vertices',
+                                       'offsets',
+                                       'kinds',
+                                       'stroke',
+                                       'fill',
+                                       'evenodd',
+                                       'linewidths',
+                                       'stroking_colors',
+                                       'stroking_color_sizes',
+                                       'non_stroking_colors',
+                                       'non_stroking_color_sizes'))
+
+TextArrays = namedtuple('TextArrays', ('codepoints',
+                                       'text_buffer',
+                                       'text_offsets',
+                                       'bboxes',
+                                       'corners',
+                                       'matrices',
+                                       'sizes',
+                                       'advs',
+                                       'fontname_ids',
+                                       'fontnames'))
+
+ImageArrays = namedtuple('ImageArrays', ('bboxes',
+                                         'names',
+                                         'srcsizes'))
+
+SymbolArrays = namedtuple('SymbolArrays', ('objids',
+                                           'names',
+                                           'matrices',
+                                           'bboxes'))
+
+LayerArrays = namedtuple('LayerArrays', ('paths',
+                                         'text',
+                                         'images',
+                                         'symbols'))
+
+
+def _color_to_row(color):
+    if isinstance(color, (int, float)):
+        comps = [color]
+    elif isinstance(color, (list, tuple)) and \
+         all(isinstance(c, (int, float)) for c in color):
+        comps = list(color)[:4]
+    else:
+        comps = []
+    return comps + [np.nan] * (4 - len(comps)), len(comps)
+
+
+class _ArraysBuilder:
+    def __init__(self):
+        self.vertices = []
+        self.offsets = [0]
+        self.kinds = []
+        self.stroke = []
+        self.fill = []
+        self.evenodd = []
+        self.linewidths = []
+        self.scolors = []
+        self.scolor_sizes = []
+        self.ncolors = []
+        self.ncolor_sizes = []
+
+        self.codepoints = []
+        self.texts = []
+        self.text_offsets = [0]
+        self.char_bboxes = []
+        self.corners = []
+        self.matrices = []
+        self.sizes = []
+        self.advs = []
+        self.fontname_ids = []
+        self.fontnames = {}
+
+        self.image_bboxes = []
+        self.image_names = []
+        self.image_srcsizes = []
+
+        self.symbol_objids = []
+        self.symbol_names = []
+        self.symbol_matrices = []
+        self.symbol_bboxes = []
+
+
+    def add_curve(self, obj):
+        if isinstance(obj, LTRect):
+            kind = PATH_KIND_RECT
+        elif isinstance(obj, LTLine):
+            kind = PATH_KIND_LINE
+        else:
+            kind = PATH_KIND_CURVE
+        self.vertices.extend(obj.pts)
+        self.offsets.append(len(self.vertices))
+        self.kinds.append(kind)
+        self.stroke.append(bool(obj.stroke))
+        self.fill.append(bool(obj.fill))
+        self.evenodd.append(bool(obj.evenodd))
+        self.linewidths.append(obj.linewidth)
+        row, size = _color_to_row(obj.stroking_color)
+        self.scolors.append(row)
+        self.scolor_sizes.append(size)
+        row, size = _color_to_row(obj.non_stroking_color)
+        self.ncolors.append(row)
+        self.ncolor_sizes.append(size)
+
+
+    def add_char(self, obj):
+        text = obj.get_text()
+        self.codepoints.append(ord(text) if len(text) == 1 else -1)
+        self.texts.append(text)
+        self.text_offsets.append(self.text_offsets[-1] + len(text))
+        self.char_bboxes.append(obj.bbox)
+        # generic chars know their rotated corners, others only have the bbox
+        pts = getattr(obj, 'pts', None)
+        if pts is None:
+            (x0, y0, x1, y1) = obj.bbox
+            pts = ((x0, y0), (x1, y0), (x1, y1), (x0, y1))
+        self.corners.append(pts)
+        self.matrices.append(obj.matrix)
+        self.sizes.append(obj.size)
+        self.advs.append(obj.adv)
+        fontname_id = self.fontnames.setdefault(obj.fontname, len(self.fontnames))
+        self.fontname_ids.append(fontname_id)
+
+
+    def add_image(self, obj):
+        self.image_bboxes.append(obj.bbox)
+        self.image_names.append(obj.name)
+        self.image_srcsizes.append([ s if isinstance(s, (int, float)) else -1 for s in obj.srcsize ])
+
+
+    def add_symbol(self, obj):
+        self.symbol_objids.append(obj.objid if obj.objid is not None else -1)
+        self.symbol_names.append(obj.name)
+        self.symbol_matrices.append(obj.matrix)
+        self.symbol_bboxes.append(obj.bbox)
+
+
+    def add(self, layout):
+        if isinstance(layout, LTCurve):
+            self.add_curve(layout)
+        elif isinstance(layout, LTAnno):
+            pass
+        # LTCharGeneric is not an LTChar, but looks like one
+        elif isinstance(layout, LTChar) or \
+             (hasattr(layout, 'get_text') and hasattr(layout, 'adv')):
+            self.add_char(layout)
+        elif isinstance(layout, LTImage):
+            self.add_image(layout)
+        elif isinstance(layout, LTSymbolInstance):
+            self.add_symbol(layout)
+        for obj in getattr(layout, '_objs', []):
+            self.add(obj)
+
+
+    def get_arrays(self):
+        paths = PathArrays(
+            vertices=np.array(self.vertices, dtype=np.float64).reshape(-1, 2),
+            offsets=np.array(self.offsets, dtype=np.int64),
+            kinds=np.array(self.kinds, dtype=np.uint8),
+            stroke=np.array(self.stroke, dtype=bool),
+            fill=np.array(self.fill, dtype=bool),
+            evenodd=np.array(self.evenodd, dtype=bool),
+            linewidths=np.array(self.linewidths, dtype=np.float64),
+            stroking_colors=np.array(self.scolors, dtype=np.float64).reshape(-1, 4),
+            stroking_color_sizes=np.array(self.scolor_sizes, dtype=np.int8),
+            non_stroking_colors=np.array(self.ncolors, dtype=np.float64).reshape(-1, 4),
+            non_stroking_color_sizes=np.array(self.ncolor_sizes, dtype=np.int8),
+        )
+        text = TextArrays(
+            codepoints=np.array(self.codepoints, dtype=np.int32),
+            text_buffer=''.join(self.texts),
+            text_offsets=np.array(self.text_offsets, dtype=np.int64),
+            bboxes=np.array(self.char_bboxes, dtype=np.float64).reshape(-1, 4),
+            corners=np.array(self.corners, dtype=np.float64).reshape(-1, 4, 2),
+            matrices=np.array(self.matrices, dtype=np.float64).reshape(-1, 6),
+            sizes=np.array(self.sizes, dtype=np.float64),
+            advs=np.array(self.advs, dtype=np.float64),
+            fontname_ids=np.array(self.fontname_ids, dtype=np.int32),
+            fontnames=list(self.fontnames.keys()),
+        )
+        images = ImageArrays(
+            bboxes=np.array(self.image_bboxes, dtype=np.float64).reshape(-1, 4),
+            names=self.image_names,
+            srcsizes=np.array(self.image_srcsizes, dtype=np.int64).reshape(-1, 2),
+        )
+        symbols = SymbolArrays(
+            objids=np.array(self.symbol_objids, dtype=np.int64),
+            names=self.symbol_names,
+            matrices=np.array(self.symbol_matrices, dtype=np.float64).reshape(-1, 6),
+            bboxes=np.array(self.symbol_bboxes, dtype=np.float64).reshape(-1, 4),
+        )
+        return LayerArrays(paths=paths, text=text, images=images, symbols=symbols)
+
+
+def layout_to_arrays(layout):
+    builder = _ArraysBuilder()
+    builder.add(layout)
+    arrays = builder.get_arrays()
+    # parsed in path store mode, the paths are already in arrays
+    paths = getattr(layout, 'paths', None)
+    if paths is not None:
+        arrays = arrays._replace(paths=paths.to_path_arrays())
+    return arrays
+
+
+def layers_to_arrays(page_info):
+    """
+    converts the {pno: {layer_name: layout}} output of parse_layered_pdf_file
+    to {pno: {layer_name: LayerArrays}}
+    """
+    arrays_info = {}
+    for pno, layer_info in page_info.items():
+        arrays_info[pno] = {
+            layer_name: layout_to_arrays(layout)
+            for layer_name, layout in layer_info.items()
+        }
+    return arrays_info
@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import zlib
+import pickle
+import types
+import functools
+import shutil
+import tempfile
+import hashlib
+import logging
+
+from pathlib import Path
+from collections.abc import Mapping
+
+import pdfminer
+
+from .. import __version__
+from .utils import detach_layout
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024 * 1024
+# temp dirs of stores this old are taken to be from crashed or killed processes
+STALE_TEMP_SECONDS = 24 * 60 * 60
+TEMP_PREFIX = '.tmp-'
+
+# N.B.
+# cache layout:
+#   <cache_dir>/hashes/<path digest>        - 'size mtime_ns content_hash' of a previously hashed file
+#   <cache_dir>/entries/<key>/index.json    - page numbers and layer names, only written once all pages are stored
+#   <cache_dir>/entries/<key>/<pno>/<i>     - zlib compressed pickle of the i'th layer of the page
+#   <cache_dir>/entries/.tmp-*/             - entry being stored, renamed to <key> once complete
+# the mtime of index.json is bumped on every hit and used for LRU eviction
+
+
+def _get_class_name(cls):
+    return f'{cls.__module__}.{cls.__qualname__}'
+
+
+def _is_named_function(value):
+    # found again by name in another run, unlike lambdas, nested functions and closures
+    return isinstance(value, (types.FunctionType, types.BuiltinFunctionType)) and \
+           '<' not in value.__qualname__ and \
+           getattr(value, '__closure__', None) is None
+
+
+def get_option_fingerprint(value):
+    """
+    json friendly version of a parse option which only depends on what the option does,
+    None if that can't be worked out( lambdas, closures, other arbitrary callables )
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, type) or _is_named_function(value):
+        return _get_class_name(value)
+    if isinstance(value, functools.partial):
+        parts = [ value.func, list(value.args), value.keywords ]
+        fingerprint = get_option_fingerprint(parts)
+        return None if fingerprint is None else ['partial', fingerprint]
+    if hasattr(value, 'wkb_hex'):
+        # shapely geometries, their repr gets cut short
+        return value.wkb_hex
+    if isinstance(value, (list, tuple)):
+        fingerprints = [ get_option_fingerprint(v) for v in value ]
+        if any(f is None and v is not None for f, v in zip(fingerprints, value)):
+            return None
+        return fingerprints
+    if isinstance(value, dict):
+        fingerprint = get_option_fingerprint(sorted(value.items()))
+        return None if fingerprint is None else ['dict', fingerprint]
+    if hasattr(value, '__dict__') and not isinstance(value, types.FunctionType):
+        fingerprint = get_option_fingerprint(sorted(vars(value).items()))
+        return None if fingerprint is None else [ _get_class_name(type(value)), fingerprint ]
+    if callable(value):
+        return None
+    return repr(value)
+
+
+def get_file_hash(filename, chunk_size=1024*1024):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class CachedPageLayouts(Mapping):
+    """
+    maps layer names to layouts of a cached page, layers are only read from disk when asked for
+    """
+    def __init__(self, page_dir, layer_names):
+        self.page_dir = page_dir
+        self.layer_names = layer_names
+        self.layer_idxs = { name: i for i, name in enumerate(layer_names) }
+        self.loaded = {}
+
+
+    def __getitem__(self, layer_name):
+        if layer_name not in self.loaded:
+            i = self.layer_idxs[layer_name]
+            data = self.page_dir.joinpath(str(i)).read_bytes()
+            self.loaded[layer_name] = pickle.loads(zlib.decompress(data))
+        return self.loaded[layer_name]
+
+
+    def __iter__(self):
+        return iter(self.layer_names)
+
+
+    def __len__(self):
+        return len(self.layer_names)
+
+
+class ParseCache:
+    """
+    on disk cache of parsed pages, keyed by the file contents and the parse options,
+    size bounded with least recently used entries evicted first
+    """
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.entries_dir = self.cache_dir.joinpath('entries')
+        self.hashes_dir = self.cache_dir.joinpath('hashes')
+        self.entries_dir.mkdir(parents=True, exist_ok=True)
+        self.hashes_dir.mkdir(parents=True, exist_ok=True)
+
+
+    def get_content_hash(self, filename):
+        # avoid rereading unchanged files on every run
+        stat = os.stat(filename)
+        path_digest = hashlib.sha1(str(Path(filename).resolve()).encode('utf8')).hexdigest()
+        hash_file = self.hashes_dir.joinpath(path_digest)
+        if hash_file.exists():
+            size, mtime_ns, content_hash = hash_file.read_text().split(' ')
+            if int(size) == stat.st_size and int(mtime_ns) == stat.st_mtime_ns:
+                return content_hash
+        content_hash = get_file_hash(filename)
+        hash_file.write_text(f'{stat.st_size} {stat.st_mtime_ns} {content_hash}')
+        return content_hash
+
+
+    def get_key(self, filename, **options):
+        """
+        cache key of the parse, None if one of the options can't be told apart
+        from other values of it( see get_option_fingerprint ), the parse is not to be cached then
+        """
+        key_info = {
+            'file': self.get_content_hash(filename),
+            'version': __version__,
+            'pdfminer_version': pdfminer.__version__,
+        }
+        for name, value in options.items():
+            fingerprint = get_option_fingerprint(value)
+            if fingerprint is None and value is not None:
+                logger.warning(f'can\'t make a cache key from the {name} option {value!r}, not caching')
+                return None
+            key_info[name] = fingerprint
+        key_str = json.dumps(key_info, sort_keys=True, default=repr)
+        return hashlib.sha256(key_str.encode('utf8')).hexdigest()
+
+
+    def get_entry_dir(self, key):
+        return self.entries_dir.joinpath(key)
+
+
+    def iter_pages(self, key):
+        """
+        yields (pno, CachedPageLayouts) for a complete entry, None if there is no such entry
+        """
+        entry_dir = self.get_entry_dir(key)
+        index_file = entry_dir.joinpath('index.json')
+        if not index_file.exists():
+            return None
+        index_file.touch()
+        index = json.loads(index_file.read_text())
+        return (
+            (pno, CachedPageLayouts(entry_dir.joinpath(str(pno)), layer_names))
+            for pno, layer_names in index
+        )
+
+
+    def store_pages(self, key, pages):
+        """
+        writes out the (pno, layer info) pairs as they go by, the entry only becomes
+        visible once all the pages are stored.
+        pages are written to a temp dir which is moved into place at the end, so processes storing
+        the same key don't step on each other and interrupted stores leave no entry behind
+        """
+        entry_dir = self.get_entry_dir(key)
+        temp_dir = Path(tempfile.mkdtemp(prefix=TEMP_PREFIX, dir=self.entries_dir))
+        try:
+            index = []
+            for pno, layer_info in pages:
+                page_dir = temp_dir.joinpath(str(pno))
+                page_dir.mkdir()
+                memo = {}
+                layer_names = list(layer_info.keys())
+                for i, layer_name in enumerate(layer_names):
+                    layout = detach_layout(layer_info[layer_name], memo)
+                    data = zlib.compress(pickle.dumps(layout, protocol=pickle.HIGHEST_PROTOCOL))
+                    page_dir.joinpath(str(i)).write_bytes(data)
+                index.append((pno, layer_names))
+                yield pno, layer_info
+            temp_dir.joinpath('index.json').write_text(json.dumps(index))
+
+            if entry_dir.exists() and not entry_dir.joinpath('index.json').exists():
+                # left over by an older version
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            try:
+                os.replace(temp_dir, entry_dir)
+            except OSError:
+                # another process stored the same entry first
+                logger.debug(f'cache entry {key} already stored')
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        self.evict()
+
+
+    def evict(self, stale_seconds=STALE_TEMP_SECONDS):
+        """
+        removes the least recently used entries until the cache is under max_bytes,
+        and incomplete entries not written to for stale_seconds
+        """
+        entries = []
+        total_size = 0
+        now = time.time()
+        for entry_dir in self.entries_dir.iterdir():
+            index_file = entry_dir.joinpath('index.json')
+            try:
+                size = sum(f.stat().st_size for f in entry_dir.rglob('*') if f.is_file())
+                if index_file.exists():
+                    entries.append((index_file.stat().st_mtime, size, entry_dir))
+                elif now - entry_dir.stat().st_mtime > stale_seconds:
+                    logger.info(f'removing stale incomplete cache entry {entry_dir.name}')
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                    continue
+            except FileNotFoundError:
+                # moved or evicted by another process meanwhile
+                continue
+            # incomplete entries being written still take up space
+            total_size += size
+
+        for _, size, entry_dir in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            logger.info(f'evicting cache entry {entry_dir.name}')
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
@@ -0,0 +1,210 @@
+import logging
+
+from pdfminer.pdftypes import list_value
+from pdfminer.pdfinterp import LITERAL_FORM
+from pdfminer.layout import LTComponent
+from pdfminer.utils import MATRIX_IDENTITY, mult_matrix, bbox2str, matrix2str
+
+from ..clip import _get_transformed_bbox
+
+logger = logging.getLogger(__name__)
+
+# N.B.
+# map symbols are usually a handful of forms placed thousands of times, and pdfminer
+# parses and interprets the content stream of a form again at every Do
+#
+# with a FormCache, the first Do of a form records the device calls it makes in form space
+# ( ctm changes relative to the placement, paths, strings, marked content ),
+# every other Do replays the recording with just the placement transform applied.
+#   - the calls still go through the device, so OC state, clipping, layers, the path store and
+#     compact mode all behave as if the form was interpreted again
+#   - pdfminer starts every form with a fresh graphics/text state, so the recording doesn't
+#     depend on where the form is placed
+#   - nested forms and images are recorded as the Do itself, so that the skip decisions
+#     ( layers_only, clip, OC ) are made again for every placement
+#   - placements with nested cm operators can differ from a fresh interpretation in the last bits,
+#     the matrices are multiplied in a different order
+#   - forms without their own Resources( pre 1.2 files ) or without an object id are not cached
+#
+# with symbol_max_size set, forms which end up smaller than that on the page are not expanded at all,
+# an LTSymbolInstance with the xobject name, object id and placement matrix is added instead
+
+
+class LTSymbolInstance(LTComponent):
+    """
+    placement of a form which was not expanded, bbox is the form BBox on the page
+    """
+    def __init__(self, name, objid, form_bbox, matrix):
+        self.name = name
+        self.objid = objid
+        self.form_bbox = form_bbox
+        self.matrix = matrix
+        LTComponent.__init__(self, _get_transformed_bbox(form_bbox, matrix))
+
+    def __repr__(self):
+        return ('<%s(%s) %s objid=%r matrix=%s>' %
+                (self.__class__.__name__, self.name,
+                 bbox2str(self.bbox), self.objid, matrix2str(self.matrix)))
+
+
+class FormPlayer:
+    """
+    runs recorded form operations against the device of an interpreter, at the given placement
+    """
+    def __init__(self, interpreter, ctm):
+        self.interpreter = interpreter
+        self.device = interpreter.device
+        self.ctm = ctm
+        # for the nested Dos, created when needed
+        self.sub_interpreter = None
+
+
+    def get_sub_interpreter(self, ctm, resources, xobjmap):
+        if self.sub_interpreter is None:
+            self.sub_interpreter = self.interpreter.dup()
+        interpreter = self.sub_interpreter
+        interpreter.resources = resources
+        interpreter.xobjmap = xobjmap
+        interpreter.ctm = mult_matrix(ctm, self.ctm)
+        return interpreter
+
+
+    def run(self, op, args):
+        if op == 'set_ctm':
+            self.device.set_ctm(mult_matrix(args[0], self.ctm))
+        elif op == 'render_string':
+            (textstate, seq, ncs, graphicstate) = args
+            # the device moves the text position along
+            self.device.render_string(textstate.copy(), seq, ncs, graphicstate)
+        elif op == 'Do':
+            (xobjid_arg, ctm, resources, xobjmap) = args
+            self.get_sub_interpreter(ctm, resources, xobjmap).do_Do(xobjid_arg)
+        elif op == 'EI':
+            (obj, ctm, resources, xobjmap) = args
+            self.get_sub_interpreter(ctm, resources, xobjmap).do_EI(obj)
+        else:
+            getattr(self.device, op)(*args)
+
+
+class FormRecorder:
+    """
+    stands in for the device while a form is interpreted in form space,
+    records the calls and runs them at the placement being drawn
+    """
+    def __init__(self, interpreter, ctm):
+        self.player = FormPlayer(interpreter, ctm)
+        self.ops = []
+
+
+    def record(self, op, *args):
+        self.ops.append((op, args))
+        self.player.run(op, args)
+
+
+    def set_ctm(self, ctm):
+        self.record('set_ctm', ctm)
+
+
+    def begin_tag(self, tag, props=None):
+        self.record('begin_tag', tag, props)
+
+
+    def end_tag(self):
+        self.record('end_tag')
+
+
+    def do_tag(self, tag, props=None):
+        self.record('do_tag', tag, props)
+
+
+    def activate_OC(self, OC_name):
+        self.record('activate_OC', OC_name)
+
+
+    def deactivate_last_OC(self):
+        self.record('deactivate_last_OC')
+
+
+    def begin_textgroup(self):
+        self.record('begin_textgroup')
+
+
+    def end_textgroup(self):
+        self.record('end_textgroup')
+
+
+    def paint_path(self, gstate, stroke, fill, evenodd, path):
+        self.record('paint_path', gstate.copy(), stroke, fill, evenodd, path)
+
+
+    def render_string(self, textstate, seq, ncs, graphicstate):
+        graphicstate = graphicstate.copy()
+        self.ops.append(('render_string', (textstate.copy(), seq, ncs, graphicstate)))
+        # the interpreter's own textstate has to move along with the text
+        self.player.device.render_string(textstate, seq, ncs, graphicstate)
+
+
+    def record_xobject(self, interpreter, xobjid_arg):
+        self.record('Do', xobjid_arg, interpreter.ctm, interpreter.resources, interpreter.xobjmap)
+
+
+    def record_inline_image(self, interpreter, obj):
+        self.record('EI', obj, interpreter.ctm, interpreter.resources, interpreter.xobjmap)
+
+
+class FormCache:
+    """
+    per document cache of recorded form contents, keyed by the object id of the form,
+    see PDFPageOptionalInterpreter.render_form
+
+    :param symbol_max_size: forms whose placed bbox is at most this wide and high are
+        emitted as LTSymbolInstances instead of being expanded, not done if None
+    """
+    def __init__(self, symbol_max_size=None):
+        self.symbol_max_size = symbol_max_size
+        self.forms = {}
+        self.hits = 0
+        self.misses = 0
+
+
+    def can_cache(self, xobj):
+        return xobj.get('Subtype') is LITERAL_FORM and \
+               'BBox' in xobj and \
+               bool(xobj.get('Resources')) and \
+               xobj.objid is not None
+
+
+    def is_symbol(self, bbox, ctm):
+        if self.symbol_max_size is None:
+            return False
+        (x0, y0, x1, y1) = _get_transformed_bbox(bbox, ctm)
+        return x1 - x0 <= self.symbol_max_size and y1 - y0 <= self.symbol_max_size
+
+
+    def get(self, xobj):
+        ops = self.forms.get(xobj.objid)
+        if ops is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return ops
+
+
+    def add(self, xobj, ops):
+        logger.debug(f'recorded {len(ops)} operations for form {xobj.objid}')
+        self.forms[xobj.objid] = ops
+
+
+    def replay(self, interpreter, ops, ctm):
+        player = FormPlayer(interpreter, ctm)
+        for (op, args) in ops:
+            player.run(op, args)
+
+
+def get_form_placement(xobj, ctm):
+    """
+    ( bbox, matrix, ctm ) of a Do of the form at ctm
+    """
+    bbox = list_value(xobj['BBox'])
+    matrix = list_value(xobj.get('Matrix', MATRIX_IDENTITY))
+    return bbox, matrix, mult_matrix(matrix, ctm)
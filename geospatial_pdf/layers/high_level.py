@@ -1,6 +1,9 @@
 import logging
 
 from pprint import pformat
+from itertools import islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 from pdfminer.pdfinterp import PDFResourceManager
 from pdfminer.pdfdocument import PDFDocument
@@ -16,65 +19,331 @@ from . import (PDFPageOptionalAggregator,
 from .utils import (
     get_OCG_info_from_doc,
     get_active_combos,
-    get_page_OC_map,
-    get_order_map_from_list
+    get_page_OC_ref_map,
+    get_order_map_from_list,
+    filter_combos,
+    OCInfoCache,
+    detach_layout
 )
+from .forms import FormCache
+from .cache import ParseCache, DEFAULT_MAX_BYTES
 
 logger = logging.getLogger(__name__)
 
+# number of page ranges each worker gets in a parallel parse
+CHUNKS_PER_WORKER = 4
+
+
+def _open_document(f, filename, password=''):
+    parser = PDFParser(f)
+    document = PDFDocument(parser, password)
+    if not document.is_extractable:
+        raise PDFTextExtractionNotAllowed(
+            f"Text extraction is not allowed: {filename}"
+        )
+    return document
+
+
+def _get_combo_list(document, OC_cache, layers=None):
+    OCGs, order_list = get_OCG_info_from_doc(document, cache=OC_cache)
+    if OCGs is None:
+        raise Exception('file does not have OCGs')
+
+    if order_list is None:
+        raise Exception('file does not have an order map')
+
+    order_map = get_order_map_from_list(order_list, cache=OC_cache)
+    logger.info(f'order map:\n{pformat(order_map)}')
+    combo_list = get_active_combos(order_map)
+    combo_list = filter_combos(combo_list, layers)
+    logger.info(f'order list:\n{pformat(combo_list)}')
+    return combo_list
+
+
+def _open_layered_document(f, filename, layers=None):
+    document = _open_document(f, filename)
+    OC_cache = OCInfoCache()
+    combo_list = _get_combo_list(document, OC_cache, layers=layers)
+    return document, combo_list, OC_cache
+
+
+def _get_static_clip(clip):
+    # per page clips are only set once the page is known
+    return None if callable(clip) else clip
+
+
+def _set_form_cache(interpreter, cache_forms, symbol_max_size):
+    # one per document, the recorded forms hold on to its fonts and resources
+    if cache_forms or symbol_max_size is not None:
+        interpreter.set_form_cache(FormCache(symbol_max_size=symbol_max_size))
+
+
+def _process_layered_page(page, device, interpreter, combo_list, OC_cache,
+                          compact, layers_only, clip=None, clip_partial=True):
+    if callable(clip):
+        device.set_clip(clip(page), keep_partial=clip_partial)
+    OC_combos = OC_cache.get_OC_combos(page, combo_list)
+    logger.info(f'order list OCs:\n{pformat(OC_combos)}')
+    device.set_active_combo_lists(OC_combos, OC_masks=OC_cache.get_OCMD_masks(page, combo_list))
+    device.set_OC_ref_names(get_page_OC_ref_map(page, cache=OC_cache))
+    interpreter.process_page(page)
+    if compact:
+        layer_names = [ ', '.join(combo) for combo in combo_list ]
+        return device.get_layer_layouts(layer_names)
+
+    page_layouts = device.get_result()
+    full_page_layout = page_layouts[0]
+    page_layouts = page_layouts[1:]
+
+    layer_info = {}
+    for i, OC_combo in enumerate(OC_combos):
+        layer_names = ', '.join(combo_list[i])
+        logger.info(f'showing layout with only {OC_combo} {layer_names} switched on')
+        layout = page_layouts[i]
+        #print_layout(layout)
+        #show_objs(pno, filename, tempdir, layout, layout, 'red', show_original=False)
+        layer_info[layer_names] = layout
+    if not layers_only:
+        layer_info[''] = full_page_layout
+    return layer_info
+
+
+def _parse_layered_pages(filename, start, stop,
+                         AggregatorClass,
+                         InterpreterClass,
+                         laparams,
+                         compact,
+                         layers,
+                         layers_only,
+                         clip,
+                         clip_partial,
+                         path_store,
+                         path_tolerance,
+                         cache_forms,
+                         symbol_max_size):
+    """
+    process pool worker, parses the pages start to stop( exclusive ) and returns (pno, layer info) pairs
+    which are detached from the file so that they can be sent back to the parent
+    """
+    results = []
+    with open(filename, "rb") as f:
+        document, combo_list, OC_cache = _open_layered_document(f, filename, layers=layers)
+        rsrcmgr = PDFResourceManager(caching=True)
+        device = AggregatorClass(rsrcmgr, laparams=laparams,
+                                 compact=compact, layers_only=layers_only,
+                                 clip=_get_static_clip(clip), clip_partial=clip_partial,
+                                 path_store=path_store, path_tolerance=path_tolerance)
+        interpreter = InterpreterClass(rsrcmgr, device)
+        _set_form_cache(interpreter, cache_forms, symbol_max_size)
+        # the page tree is only walked as far as the last page of the range
+        pages = islice(PDFPage.create_pages(document), start, stop)
+        for pno, page in enumerate(pages, start):
+            # keep the LTPage ids the same as a sequential run
+            device.pageno = pno + 1
+            layer_info = _process_layered_page(page, device, interpreter,
+                                               combo_list, OC_cache,
+                                               compact, layers_only,
+                                               clip, clip_partial)
+            memo = {}
+            if compact:
+                # every object is held in the full page layout
+                detach_layout(layer_info.full_page_layout, memo)
+            else:
+                for layout in layer_info.values():
+                    detach_layout(layout, memo)
+            results.append((pno, layer_info))
+    return results
+
+
+def _iter_layered_pages_parallel(filename, num_pages, workers,
+                                 AggregatorClass,
+                                 InterpreterClass,
+                                 laparams,
+                                 compact,
+                                 layers,
+                                 layers_only,
+                                 clip,
+                                 clip_partial,
+                                 path_store,
+                                 path_tolerance,
+                                 cache_forms,
+                                 symbol_max_size):
+    # one task per contiguous range of pages, so that every task opens the document only once.
+    # a few ranges per worker keeps the workers busy till the end, and with only a few ranges
+    # in flight at a time, results can be handed out in page order as they come in
+    chunk_size = -(-num_pages // (workers * CHUNKS_PER_WORKER))
+    max_pending = 2 * workers
+    next_starts = iter(range(0, num_pages, chunk_size))
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=min(workers, num_pages)) as executor:
+
+        def submit_next():
+            start = next(next_starts, None)
+            if start is None:
+                return
+            stop = min(start + chunk_size, num_pages)
+            pending.append(executor.submit(_parse_layered_pages, filename, start, stop,
+                                           AggregatorClass, InterpreterClass,
+                                           laparams, compact, layers,
+                                           layers_only, clip, clip_partial,
+                                           path_store, path_tolerance,
+                                           cache_forms, symbol_max_size))
+
+        for _ in range(max_pending):
+            submit_next()
+
+        while pending:
+            future = pending.popleft()
+            submit_next()
+            yield from future.result()
+
+
+def _iter_layered_pdf_pages_uncached(filename,
+                                    AggregatorClass,
+                                    InterpreterClass,
+                                    laparams,
+                                    compact,
+                                    workers,
+                                    layers,
+                                    layers_only,
+                                    clip,
+                                    clip_partial,
+                                    path_store,
+                                    path_tolerance,
+                                    cache_forms,
+                                    symbol_max_size):
+    with open(filename, "rb") as f:
+        document, combo_list, OC_cache = _open_layered_document(f, filename, layers=layers)
+
+        if workers is None or workers <= 1:
+            rsrcmgr = PDFResourceManager(caching=True)
+            device = AggregatorClass(rsrcmgr, laparams=laparams,
+                                     compact=compact, layers_only=layers_only,
+                                     clip=_get_static_clip(clip), clip_partial=clip_partial,
+                                     path_store=path_store, path_tolerance=path_tolerance)
+            interpreter = InterpreterClass(rsrcmgr, device)
+            _set_form_cache(interpreter, cache_forms, symbol_max_size)
+
+            for pno, page in enumerate(PDFPage.create_pages(document)):
+                layer_info = _process_layered_page(page, device, interpreter,
+                                                   combo_list, OC_cache,
+                                                   compact, layers_only,
+                                                   clip, clip_partial)
+                yield pno, layer_info
+                del layer_info
+            return
+
+        num_pages = sum(1 for _ in PDFPage.create_pages(document))
+        if num_pages == 0:
+            return
+
+    yield from _iter_layered_pages_parallel(filename, num_pages, workers,
+                                            AggregatorClass, InterpreterClass,
+                                            laparams, compact, layers,
+                                            layers_only, clip, clip_partial,
+                                            path_store, path_tolerance,
+                                            cache_forms, symbol_max_size)
+
+
 # TODO: take order list as a function argument?
-def parse_layered_pdf_file(filename,
+def iter_layered_pdf_pages(filename,
                            AggregatorClass=PDFPageOptionalAggregator,
                            InterpreterClass=PDFPageOptionalInterpreter,
-                           laparams=None):
-    with open(filename, "rb") as f:
-        parser = PDFParser(f)
-        document = PDFDocument(parser)
-        if not document.is_extractable:
-            raise PDFTextExtractionNotAllowed(
-                f"Text extraction is not allowed: {filename}"
-            )
-        OCGs, order_list = get_OCG_info_from_doc(document)
-        if OCGs is None:
-            raise Exception('file does not have OCGs')
-    
-        if order_list is None:
-            raise Exception('file does not have an order map')
-    
-        order_map = get_order_map_from_list(order_list)
-        logger.info(f'order map:\n{pformat(order_map)}')
-        combo_list = get_active_combos(order_map)
-        logger.info(f'order list:\n{pformat(combo_list)}')
+                           laparams=None,
+                           compact=False,
+                           workers=None,
+                           layers=None,
+                           layers_only=False,
+                           clip=None,
+                           clip_partial=True,
+                           path_store=False,
+                           path_tolerance=None,
+                           cache_forms=False,
+                           symbol_max_size=None,
+                           cache_dir=None,
+                           cache_max_bytes=DEFAULT_MAX_BYTES):
+    """
+    yields (pno, {layer_name: layout}) as soon as each page is done
+    workers: number of processes to split the pages across, pages are parsed in this process if not set
+    layers: layer names or glob patterns to restrict the parsing to, see filter_combos
+    layers_only: don't build layout objects for content outside the layers,
+                 the full page layout( '' ) is not produced in this mode
+    clip: ( x0, y0, x1, y1 ) bbox or polygon in page space, objects outside of it are dropped
+          while the page is being interpreted, see clip.py.
+          can also be a picklable function of the PDFPage returning one of those( or None )
+    clip_partial: keep objects which are only partly inside the clip region
+    path_store: keep painted paths in flat arrays instead of layout objects, every layout
+                gets a .paths with the PagePaths of its layer, see paths.py
+    path_tolerance: simplify the stored paths with Douglas-Peucker at this tolerance
+    cache_forms: interpret every form XObject once per document and replay it at the other placements,
+                 see forms.py
+    symbol_max_size: forms which are at most this big on the page are added as LTSymbolInstances
+                     ( xobject name, object id and placement matrix ) instead of being expanded
+    cache_dir: directory to keep parsed pages in, keyed by the file contents and the options above,
+               layers of cached pages are loaded from disk when they are looked up
+    """
+    pages_args = dict(AggregatorClass=AggregatorClass,
+                      InterpreterClass=InterpreterClass,
+                      laparams=laparams,
+                      compact=compact,
+                      layers=layers,
+                      layers_only=layers_only,
+                      clip=clip,
+                      clip_partial=clip_partial,
+                      path_store=path_store,
+                      path_tolerance=path_tolerance,
+                      cache_forms=cache_forms,
+                      symbol_max_size=symbol_max_size)
+    if cache_dir is None:
+        yield from _iter_layered_pdf_pages_uncached(filename, workers=workers, **pages_args)
+        return
 
-        rsrcmgr = PDFResourceManager(caching=True)
-        device = AggregatorClass(rsrcmgr, laparams=laparams)
-        interpreter = InterpreterClass(rsrcmgr, device)
-    
-        page_info = {}
-        pno = 0
-        for page in PDFPage.create_pages(document):
-            layer_name_to_OCs = get_page_OC_map(page)
-            OC_combos = [
-                [ layer_name_to_OCs[x] for x in l ]
-                for l in combo_list
-            ]
-            logger.info(f'order list OCs:\n{pformat(OC_combos)}')
-            device.set_active_combo_lists(OC_combos)
-            interpreter.process_page(page)
-            page_layouts = device.get_result()
-            full_page_layout = page_layouts[0]
-            page_layouts = page_layouts[1:]
-    
-            page_info[pno] = {}
-            for i, OC_combo in enumerate(OC_combos):
-                layer_names = ', '.join(combo_list[i])
-                logger.info(f'showing layout with only {OC_combo} {layer_names} switched on')
-                layout = page_layouts[i]
-                #print_layout(layout)
-                #show_objs(pno, filename, tempdir, layout, layout, 'red', show_original=False)
-                page_info[pno][layer_names] = layout
-            page_info[pno][''] = full_page_layout
-        pno += 1
-    return page_info
+    cache = ParseCache(cache_dir, max_bytes=cache_max_bytes)
+    key = cache.get_key(filename, **pages_args)
+    if key is None:
+        yield from _iter_layered_pdf_pages_uncached(filename, workers=workers, **pages_args)
+        return
+
+    cached_pages = cache.iter_pages(key)
+    if cached_pages is not None:
+        logger.info(f'using cached pages for {filename}')
+        yield from cached_pages
+        return
 
+    pages = _iter_layered_pdf_pages_uncached(filename, workers=workers, **pages_args)
+    yield from cache.store_pages(key, pages)
+
+
+def parse_layered_pdf_file(filename,
+                           AggregatorClass=PDFPageOptionalAggregator,
+                           InterpreterClass=PDFPageOptionalInterpreter,
+                           laparams=None,
+                           compact=False,
+                           workers=None,
+                           layers=None,
+                           layers_only=False,
+                           clip=None,
+                           clip_partial=True,
+                           path_store=False,
+                           path_tolerance=None,
+                           cache_forms=False,
+                           symbol_max_size=None,
+                           cache_dir=None,
+                           cache_max_bytes=DEFAULT_MAX_BYTES):
+    return dict(iter_layered_pdf_pages(filename,
+                                       AggregatorClass=AggregatorClass,
+                                       InterpreterClass=InterpreterClass,
+                                       laparams=laparams,
+                                       compact=compact,
+                                       workers=workers,
+                                       layers=layers,
+                                       layers_only=layers_only,
+                                       clip=clip,
+                                       clip_partial=clip_partial,
+                                       path_store=path_store,
+                                       path_tolerance=path_tolerance,
+                                       cache_forms=cache_forms,
+                                       symbol_max_size=symbol_max_size,
+                                       cache_dir=cache_dir,
+                                       cache_max_bytes=cache_max_bytes))
 
@@ -0,0 +1,227 @@
+import logging
+
+import numpy as np
+import shapely
+
+from shapely.geometry.base import BaseGeometry
+from pdfminer.layout import LTContainer, LTAnno, LTCurve, LTRect
+
+from .arrays import PATH_KIND_RECT
+from .paths import LTPathRef, _get_ragged_idxs
+from .forms import LTSymbolInstance
+
+logger = logging.getLogger(__name__)
+
+# N.B.
+# spatial index over the objects of each layer of a parsed page, needs shapely 2
+#
+# every layer gets its own STRtree, built the first time the layer is queried
+# geometry used for the objects:
+#   - the rotated outline for objects which have one( the .polygon of generictext objects )
+#   - the polyline for curves and lines
+#   - the placed form bbox for LTSymbolInstances( symbol placements which were not expanded )
+#   - the bbox for everything else
+#
+# layouts parsed in path store mode have their paths in .paths instead of in the layout objects,
+# every part( subpath ) of those is indexed the same way( bbox for rects, polyline for the rest ),
+# and hits are mapped back to their path, returned as LTPathRefs after the layout objects
+
+
+def iter_layout_objs(layout, include_containers=False):
+    """
+    objects in the layout, depth first in drawing order, containers are descended into
+    and only yielded themselves if include_containers is set
+    """
+    stack = list(reversed(getattr(layout, '_objs', [])))
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, LTAnno):
+            continue
+        if isinstance(obj, LTContainer):
+            if include_containers:
+                yield obj
+            stack.extend(reversed(obj._objs))
+            continue
+        yield obj
+
+
+def get_obj_geometries(objs):
+    """
+    shapely geometries for layout objects, built in bulk
+    """
+    geoms = np.empty(len(objs), dtype=object)
+    outlines = {}
+    curves = []
+    boxes = []
+    for i, obj in enumerate(objs):
+        if isinstance(obj, LTPathRef):
+            geoms[i] = shapely.geometrycollections(get_path_geometries(obj.paths.take([obj.path_idx])))
+        elif isinstance(obj, LTSymbolInstance):
+            boxes.append(i)
+        elif hasattr(obj, 'polygon') and len(obj.pts) >= 3:
+            outlines.setdefault(len(obj.pts), []).append(i)
+        elif isinstance(obj, LTCurve) and not isinstance(obj, LTRect) and len(obj.pts) >= 2:
+            curves.append(i)
+        else:
+            boxes.append(i)
+
+    for size, idxs in outlines.items():
+        coords = np.array([ objs[i].pts for i in idxs ], dtype=np.float64)
+        geoms[idxs] = shapely.polygons(coords)
+    for i in curves:
+        geoms[i] = shapely.linestrings(objs[i].pts)
+    if len(boxes):
+        bboxes = np.array([ objs[i].bbox for i in boxes ], dtype=np.float64)
+        geoms[boxes] = shapely.box(bboxes[:, 0], bboxes[:, 1], bboxes[:, 2], bboxes[:, 3])
+    return geoms
+
+
+def get_path_geometries(paths):
+    """
+    shapely geometries for the parts of a PagePaths, built in bulk
+    """
+    geoms = np.empty(paths.num_parts, dtype=object)
+    counts = np.diff(paths.part_offsets)
+    is_rect = paths.part_kinds == PATH_KIND_RECT
+    rects = np.flatnonzero(is_rect & (counts > 0))
+    if len(rects):
+        # simplified rects can be down to a few of their corners, so go by the vertices each one has
+        (vertex_idxs, rect_offsets) = _get_ragged_idxs(paths.part_offsets, rects)
+        pts = paths.vertices[vertex_idxs]
+        (x0, y0) = np.minimum.reduceat(pts, rect_offsets[:-1], axis=0).T
+        (x1, y1) = np.maximum.reduceat(pts, rect_offsets[:-1], axis=0).T
+        geoms[rects] = shapely.box(x0, y0, x1, y1)
+    lines = np.flatnonzero(~is_rect & (counts >= 2))
+    if len(lines):
+        (vertex_idxs, _) = _get_ragged_idxs(paths.part_offsets, lines)
+        geoms[lines] = shapely.linestrings(paths.vertices[vertex_idxs],
+                                           indices=np.repeat(np.arange(len(lines)), counts[lines]))
+    points = np.flatnonzero(~is_rect & (counts == 1))
+    if len(points):
+        geoms[points] = shapely.points(paths.vertices[paths.part_offsets[points]])
+    return geoms
+
+
+def _to_geometry(bbox_or_geometry):
+    if isinstance(bbox_or_geometry, BaseGeometry):
+        return bbox_or_geometry
+    if len(bbox_or_geometry) == 2:
+        return shapely.points(*bbox_or_geometry)
+    (x0, y0, x1, y1) = bbox_or_geometry
+    return shapely.box(x0, y0, x1, y1)
+
+
+class LayerSpatialIndex:
+    """
+    window and nearest object queries over the layers of a page,
+    given the {layer_name: layout} of a page as returned by the layered parsers
+    """
+    def __init__(self, layer_info, include_containers=False):
+        self.layer_info = layer_info
+        self.include_containers = include_containers
+        self.trees = {}
+
+
+    def get_tree(self, layer_name):
+        """
+        ( STRtree, objs ) of the layer, the tree has the objects followed by the path parts of the layer
+        """
+        if layer_name not in self.trees:
+            layout = self.layer_info[layer_name]
+            objs = list(iter_layout_objs(layout, self.include_containers))
+            geoms = get_obj_geometries(objs)
+            paths = getattr(layout, 'paths', None)
+            part_paths = None
+            if paths is not None and paths.num_parts:
+                part_paths = paths.get_part_path_idxs()
+                geoms = np.concatenate([geoms, get_path_geometries(paths)])
+                logger.debug(f'indexed {len(paths)} paths of layer {layer_name!r}')
+            self.trees[layer_name] = (shapely.STRtree(geoms), objs, geoms, paths, part_paths)
+            logger.debug(f'indexed {len(objs)} objects of layer {layer_name!r}')
+        (tree, objs, _, _, _) = self.trees[layer_name]
+        return tree, objs
+
+
+    def get_hit(self, layer_name, i):
+        """
+        layout object or LTPathRef of item i of the layer tree
+        """
+        (_, objs, _, paths, part_paths) = self.trees[layer_name]
+        if i < len(objs):
+            return objs[i]
+        return LTPathRef(paths, int(part_paths[i - len(objs)]))
+
+
+    def get_hits(self, layer_name, idxs):
+        """
+        objects for the tree items, in drawing order, then one LTPathRef per path hit by any of its parts
+        """
+        (_, objs, _, paths, part_paths) = self.trees[layer_name]
+        idxs = np.sort(idxs)
+        num_objs = np.searchsorted(idxs, len(objs))
+        hits = [ objs[i] for i in idxs[:num_objs] ]
+        if num_objs < len(idxs):
+            path_idxs = np.unique(part_paths[idxs[num_objs:] - len(objs)])
+            hits.extend(LTPathRef(paths, i) for i in path_idxs.tolist())
+        return hits
+
+
+    def query(self, layer_name, bbox_or_geometry, predicate='intersects'):
+        """
+        objects of the layer matching the predicate against the window, in drawing order,
+        the window is a ( x0, y0, x1, y1 ) bbox, an ( x, y ) point or a shapely geometry.
+        for layouts parsed in path store mode, LTPathRefs of the matching paths come after the objects
+        """
+        (tree, objs) = self.get_tree(layer_name)
+        idxs = tree.query(_to_geometry(bbox_or_geometry), predicate=predicate)
+        return self.get_hits(layer_name, idxs)
+
+
+    def query_paths(self, layer_name, bbox_or_geometry, predicate='intersects'):
+        """
+        indices into layout.paths of the paths with a part matching the predicate against the window
+        """
+        (tree, objs) = self.get_tree(layer_name)
+        (_, _, _, paths, part_paths) = self.trees[layer_name]
+        if paths is None:
+            raise Exception(f'layer {layer_name!r} was not parsed in path store mode')
+        if part_paths is None:
+            return np.empty(0, dtype=np.int64)
+        idxs = tree.query(_to_geometry(bbox_or_geometry), predicate=predicate)
+        return np.unique(part_paths[idxs[idxs >= len(objs)] - len(objs)])
+
+
+    def nearest(self, layer_name, bbox_or_geometry, max_distance=None):
+        """
+        ( object, distance ) of the object( or LTPathRef ) of the layer nearest to the geometry,
+        ( None, None ) if there is none
+        """
+        (tree, objs) = self.get_tree(layer_name)
+        idxs, distances = tree.query_nearest(_to_geometry(bbox_or_geometry),
+                                             max_distance=max_distance,
+                                             return_distance=True)
+        if len(idxs) == 0:
+            return None, None
+        return self.get_hit(layer_name, idxs[0]), float(distances[0])
+
+
+    def nearest_many(self, layer_name, objs_or_geometries, max_distance=None):
+        """
+        nearest object of the layer for each of many objects( from any layer ) or geometries, in one go.
+        returns a list of ( object, distance ), ( None, None ) where nothing is within max_distance
+        """
+        (tree, objs) = self.get_tree(layer_name)
+        geoms = [ g if isinstance(g, BaseGeometry) else None for g in objs_or_geometries ]
+        missing = [ i for i, g in enumerate(geoms) if g is None ]
+        if len(missing):
+            built = get_obj_geometries([ objs_or_geometries[i] for i in missing ])
+            for i, g in zip(missing, built):
+                geoms[i] = g
+        (input_idxs, tree_idxs), distances = tree.query_nearest(geoms,
+                                                                max_distance=max_distance,
+                                                                return_distance=True,
+                                                                all_matches=False)
+        result = [ (None, None) ] * len(geoms)
+        for i, j, d in zip(input_idxs.tolist(), tree_idxs.tolist(), distances.tolist()):
+            result[i] = (self.get_hit(layer_name, j), d)
+        return result
@@ -0,0 +1,422 @@
+import re
+import logging
+
+from array import array
+
+import numpy as np
+
+from pdfminer.layout import LTComponent
+from pdfminer.utils import apply_matrix_pt, get_bound, bbox2str
+
+from .arrays import (PathArrays, _color_to_row,
+                     PATH_KIND_CURVE, PATH_KIND_LINE, PATH_KIND_RECT)
+
+logger = logging.getLogger(__name__)
+
+# N.B.
+# path store mode, see PDFPageOptionalAggregator
+#
+# painted paths are not turned into LTCurve/LTLine/LTRect objects, every paint_path call
+# is recorded once into flat buffers instead:
+#   vertices[part_offsets[j]:part_offsets[j+1]]     - vertices of part( subpath ) j
+#   part_offsets[path_offsets[i]:path_offsets[i+1]] - parts of path i
+#   style( stroke, fill, colors, line width ) and the bitmask of the layers a path belongs to are per path
+#
+# vertices are the points pdfminer makes its objects from( segment end points, bezier control points are dropped ),
+# rects keep them as drawn where LTRect only has the corners of its bbox.
+# they are kept untransformed along with the ctm while the page is interpreted and transformed in bulk at the end.
+# part kinds follow what pdfminer would have made of the subpath
+#
+# the structure of forms( LTFigures ) is not kept, paths inside forms are recorded in page space like the rest
+
+_SHAPE_CURVE = 0
+_SHAPE_LINE = 1
+_SHAPE_RECT = 2
+
+
+def _get_shape_code(shape):
+    if shape in ('ml', 'mlh'):
+        return _SHAPE_LINE
+    if shape in ('mlllh', 'mllll'):
+        return _SHAPE_RECT
+    return _SHAPE_CURVE
+
+
+def _get_ragged_idxs(offsets, rows):
+    """
+    flat indices of the elements of the given rows of a ragged array, and the offsets of the rows in them
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    counts = offsets[rows + 1] - offsets[rows]
+    new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(counts, out=new_offsets[1:])
+    idxs = np.repeat(offsets[rows] - new_offsets[:-1], counts) + np.arange(new_offsets[-1], dtype=np.int64)
+    return idxs, new_offsets
+
+
+def _point_segment_distances(p, a, b):
+    ab = b - a
+    ap = p - a
+    denom = np.einsum('ij,ij->i', ab, ab)
+    t = np.einsum('ij,ij->i', ap, ab) / np.where(denom == 0, 1, denom)
+    t = np.clip(t, 0, 1)
+    closest = a + ab * t[:, None]
+    return np.hypot(*(p - closest).T)
+
+
+def simplify_polylines(vertices, offsets, tolerance):
+    """
+    Douglas-Peucker simplification of many polylines at once, given as a flat (N, 2) vertex buffer
+    and offsets. returns a bool array of the vertices to keep.
+    all polylines are worked on together, one round per level of the recursion.
+    rings( first point repeated at the end ) are split at their farthest point to start with,
+    so that they don't collapse
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    keep = np.zeros(len(vertices), dtype=bool)
+    if len(vertices) == 0:
+        return keep
+
+    parts = np.flatnonzero(offsets[1:] > offsets[:-1])
+    starts = offsets[parts]
+    ends = offsets[parts + 1] - 1
+    keep[starts] = True
+    keep[ends] = True
+
+    rings = (ends - starts > 2) & np.all(vertices[starts] == vertices[ends], axis=1)
+    if rings.any():
+        (ring_idxs, ring_offsets) = _get_ragged_idxs(offsets, parts[rings])
+        ring_starts = np.repeat(starts[rings], np.diff(ring_offsets))
+        d = np.hypot(*(vertices[ring_idxs] - vertices[ring_starts]).T)
+        far = ring_idxs[_segment_argmax(d, ring_offsets)]
+        keep[far] = True
+        starts = np.r_[starts[~rings], starts[rings], far]
+        ends = np.r_[ends[~rings], far, ends[rings]]
+
+    while True:
+        active = ends - starts > 1
+        starts = starts[active]
+        ends = ends[active]
+        if len(starts) == 0:
+            break
+        counts = ends - starts - 1
+        range_offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=range_offsets[1:])
+        seg = np.repeat(np.arange(len(starts)), counts)
+        idxs = starts[seg] + 1 + np.arange(range_offsets[-1], dtype=np.int64) - range_offsets[:-1][seg]
+        d = _point_segment_distances(vertices[idxs], vertices[starts[seg]], vertices[ends[seg]])
+        pos = _segment_argmax(d, range_offsets)
+        split = d[pos] > tolerance
+        mids = idxs[pos[split]]
+        keep[mids] = True
+        starts = np.r_[starts[split], mids]
+        ends = np.r_[mids, ends[split]]
+    return keep
+
+
+def _segment_argmax(values, offsets):
+    """
+    position of the( first ) largest value of each non empty segment of values
+    """
+    seg = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    maxes = np.maximum.reduceat(values, offsets[:-1])
+    idxs = np.flatnonzero(values == maxes[seg])
+    firsts = np.r_[True, seg[idxs][1:] != seg[idxs][:-1]]
+    return idxs[firsts]
+
+
+class PagePaths:
+    """
+    the paths painted on a page( or one of its layers ), see the N.B. above
+    """
+    def __init__(self, vertices, part_offsets, path_offsets,
+                 part_kinds, part_closed,
+                 stroke, fill, evenodd, linewidths,
+                 stroking_colors, stroking_color_sizes,
+                 non_stroking_colors, non_stroking_color_sizes,
+                 masks, num_layers):
+        self.vertices = vertices
+        self.part_offsets = part_offsets
+        self.path_offsets = path_offsets
+        self.part_kinds = part_kinds
+        self.part_closed = part_closed
+        self.stroke = stroke
+        self.fill = fill
+        self.evenodd = evenodd
+        self.linewidths = linewidths
+        self.stroking_colors = stroking_colors
+        self.stroking_color_sizes = stroking_color_sizes
+        self.non_stroking_colors = non_stroking_colors
+        self.non_stroking_color_sizes = non_stroking_color_sizes
+        # (num paths, num words) 64 bit words, bit i of a path is set if it is part of layer i
+        self.masks = masks
+        self.num_layers = num_layers
+
+
+    def __len__(self):
+        return len(self.path_offsets) - 1
+
+
+    def __repr__(self):
+        return f'<PagePaths: {len(self)} paths, {len(self.part_kinds)} parts, {len(self.vertices)} vertices>'
+
+
+    @property
+    def num_parts(self):
+        return len(self.part_offsets) - 1
+
+
+    def get_part_path_idxs(self):
+        return np.repeat(np.arange(len(self)), np.diff(self.path_offsets))
+
+
+    def get_path_vertices(self, i):
+        """
+        vertices of all the parts of path i
+        """
+        return self.vertices[self.part_offsets[self.path_offsets[i]]:self.part_offsets[self.path_offsets[i + 1]]]
+
+
+    def get_path_parts(self, i):
+        """
+        [ vertices, .. ] of the parts of path i
+        """
+        offsets = self.part_offsets[self.path_offsets[i]:self.path_offsets[i + 1] + 1]
+        return [ self.vertices[start:end] for start, end in zip(offsets[:-1], offsets[1:]) ]
+
+
+    def get_bboxes(self):
+        """
+        (num paths, 4) bboxes
+        """
+        bboxes = np.full((len(self), 4), np.nan, dtype=np.float64)
+        vertex_offsets = self.part_offsets[self.path_offsets]
+        nonempty = np.flatnonzero(vertex_offsets[1:] > vertex_offsets[:-1])
+        if len(nonempty):
+            starts = vertex_offsets[:-1][nonempty]
+            bboxes[nonempty, :2] = np.minimum.reduceat(self.vertices, starts, axis=0)
+            bboxes[nonempty, 2:] = np.maximum.reduceat(self.vertices, starts, axis=0)
+        return bboxes
+
+
+    def take(self, path_idxs):
+        """
+        PagePaths with only the given paths
+        """
+        path_idxs = np.asarray(path_idxs, dtype=np.int64)
+        (part_idxs, path_offsets) = _get_ragged_idxs(self.path_offsets, path_idxs)
+        (vertex_idxs, part_offsets) = _get_ragged_idxs(self.part_offsets, part_idxs)
+        return PagePaths(self.vertices[vertex_idxs], part_offsets, path_offsets,
+                         self.part_kinds[part_idxs], self.part_closed[part_idxs],
+                         self.stroke[path_idxs], self.fill[path_idxs],
+                         self.evenodd[path_idxs], self.linewidths[path_idxs],
+                         self.stroking_colors[path_idxs], self.stroking_color_sizes[path_idxs],
+                         self.non_stroking_colors[path_idxs], self.non_stroking_color_sizes[path_idxs],
+                         self.masks[path_idxs], self.num_layers)
+
+
+    def has_layer(self, i):
+        """
+        bool array of the paths which are part of layer i
+        """
+        return ((self.masks[:, i >> 6] >> np.uint64(i & 63)) & np.uint64(1)).astype(bool)
+
+
+    def get_layer(self, i):
+        return self.take(np.flatnonzero(self.has_layer(i)))
+
+
+    def simplify(self, tolerance):
+        """
+        PagePaths with the parts simplified with Douglas-Peucker at the given tolerance( in layout units ).
+        parts keep at least their end points
+        """
+        keep = simplify_polylines(self.vertices, self.part_offsets, tolerance)
+        part_offsets = np.r_[0, np.cumsum(keep, dtype=np.int64)][self.part_offsets]
+        logger.debug(f'simplified {len(self.vertices)} vertices to {part_offsets[-1]}')
+        return PagePaths(self.vertices[keep], part_offsets, self.path_offsets,
+                         self.part_kinds, self.part_closed,
+                         self.stroke, self.fill, self.evenodd, self.linewidths,
+                         self.stroking_colors, self.stroking_color_sizes,
+                         self.non_stroking_colors, self.non_stroking_color_sizes,
+                         self.masks, self.num_layers)
+
+
+    def to_path_arrays(self):
+        """
+        one row per part, in the form used by layers.arrays
+        """
+        part_paths = self.get_part_path_idxs()
+        return PathArrays(
+            vertices=self.vertices,
+            offsets=self.part_offsets,
+            kinds=self.part_kinds,
+            stroke=self.stroke[part_paths],
+            fill=self.fill[part_paths],
+            evenodd=self.evenodd[part_paths],
+            linewidths=self.linewidths[part_paths],
+            stroking_colors=self.stroking_colors[part_paths],
+            stroking_color_sizes=self.stroking_color_sizes[part_paths],
+            non_stroking_colors=self.non_stroking_colors[part_paths],
+            non_stroking_color_sizes=self.non_stroking_color_sizes[part_paths],
+        )
+
+
+class LTPathRef(LTComponent):
+    """
+    path i of a PagePaths, for returning paths alongside layout objects( see layers.index )
+    """
+    def __init__(self, paths, path_idx):
+        self.paths = paths
+        self.path_idx = path_idx
+        vertices = paths.get_path_vertices(path_idx)
+        LTComponent.__init__(self, (*vertices.min(axis=0).tolist(), *vertices.max(axis=0).tolist()))
+
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}({self.path_idx}) {bbox2str(self.bbox)}>'
+
+
+    @property
+    def parts(self):
+        return self.paths.get_path_parts(self.path_idx)
+
+
+class PathStore:
+    """
+    records painted paths while a page is interpreted, finish() gives the PagePaths
+    """
+    def __init__(self, num_layers):
+        self.num_layers = num_layers
+        self.num_words = max(1, (num_layers + 63) // 64)
+        self.raw_vertices = array('d')
+        self.part_offsets = array('q', [0])
+        self.path_offsets = array('q', [0])
+        self.part_shapes = array('B')
+        self.part_closed = array('B')
+        self.ctm_idxs = array('q')
+        self.ctms = {}
+        self.stroke = array('B')
+        self.fill = array('B')
+        self.evenodd = array('B')
+        self.linewidths = array('d')
+        self.scolors = []
+        self.scolor_sizes = array('b')
+        self.ncolors = []
+        self.ncolor_sizes = array('b')
+        self.masks = array('Q')
+
+
+    def __len__(self):
+        return len(self.path_offsets) - 1
+
+
+    @staticmethod
+    def get_parts(path):
+        """
+        ( segments, shape ) of the subpaths the same way pdfminer splits them
+        """
+        shape = ''.join(x[0] for x in path)
+        if shape.count('m') > 1:
+            return [ (path[m.start(0):m.end(0)], m.group(0)) for m in re.finditer(r'm[^m]+', shape) ]
+        return [ (path, shape) ]
+
+
+    @staticmethod
+    def get_raw_pts(segments):
+        return [ p[-2:] if p[0] != 'h' else segments[0][-2:] for p in segments ]
+
+
+    def get_bbox(self, parts, ctm):
+        """
+        page space bbox of the parts, None if they have no points
+        """
+        pts = [ apply_matrix_pt(ctm, pt) for (segments, _) in parts for pt in self.get_raw_pts(segments) ]
+        if len(pts) == 0:
+            return None
+        return get_bound(pts)
+
+
+    def add(self, parts, ctm, gstate, stroke, fill, evenodd, mask):
+        """
+        parts as from get_parts, mask is the int bitmask of the layers the path belongs to
+        """
+        num_parts = 0
+        for (segments, shape) in parts:
+            if len(segments) == 0:
+                continue
+            for pt in self.get_raw_pts(segments):
+                self.raw_vertices.extend(pt)
+            self.part_offsets.append(len(self.raw_vertices) // 2)
+            self.part_shapes.append(_get_shape_code(shape))
+            self.part_closed.append(shape.endswith('h'))
+            num_parts += 1
+        if num_parts == 0:
+            return
+        self.path_offsets.append(self.path_offsets[-1] + num_parts)
+        self.ctm_idxs.append(self.ctms.setdefault(tuple(ctm), len(self.ctms)))
+        self.stroke.append(bool(stroke))
+        self.fill.append(bool(fill))
+        self.evenodd.append(bool(evenodd))
+        self.linewidths.append(gstate.linewidth)
+        row, size = _color_to_row(gstate.scolor)
+        self.scolors.append(row)
+        self.scolor_sizes.append(size)
+        row, size = _color_to_row(gstate.ncolor)
+        self.ncolors.append(row)
+        self.ncolor_sizes.append(size)
+        for _ in range(self.num_words):
+            self.masks.append(mask & 0xFFFFFFFFFFFFFFFF)
+            mask >>= 64
+
+
+    def finish(self):
+        raw = np.frombuffer(self.raw_vertices, dtype=np.float64).reshape(-1, 2)
+        part_offsets = np.frombuffer(self.part_offsets, dtype=np.int64).copy()
+        path_offsets = np.frombuffer(self.path_offsets, dtype=np.int64).copy()
+        num_paths = len(path_offsets) - 1
+        num_parts = len(part_offsets) - 1
+
+        # transform everything in one go, same arithmetic as pdfminer's apply_matrix_pt
+        ctms = np.array(list(self.ctms.keys()), dtype=np.float64).reshape(-1, 6)
+        part_paths = np.repeat(np.arange(num_paths), np.diff(path_offsets))
+        vertex_parts = np.repeat(np.arange(num_parts), np.diff(part_offsets))
+        ctm_idxs = np.frombuffer(self.ctm_idxs, dtype=np.int64)
+        m = ctms[ctm_idxs[part_paths[vertex_parts]]]
+        (x, y) = (raw[:, 0], raw[:, 1])
+        vertices = np.column_stack([m[:, 0] * x + m[:, 2] * y + m[:, 4],
+                                    m[:, 1] * x + m[:, 3] * y + m[:, 5]])
+
+        shapes = np.frombuffer(self.part_shapes, dtype=np.uint8)
+        kinds = np.full(num_parts, PATH_KIND_CURVE, dtype=np.uint8)
+        kinds[shapes == _SHAPE_LINE] = PATH_KIND_LINE
+        candidates = np.flatnonzero(shapes == _SHAPE_RECT)
+        if len(candidates):
+            pts = vertices[part_offsets[candidates][:, None] + np.arange(5)]
+            (x0, y0) = (pts[:, 0, 0], pts[:, 0, 1])
+            (x1, y1) = (pts[:, 1, 0], pts[:, 1, 1])
+            (x2, y2) = (pts[:, 2, 0], pts[:, 2, 1])
+            (x3, y3) = (pts[:, 3, 0], pts[:, 3, 1])
+            closed = np.all(pts[:, 0] == pts[:, 4], axis=1)
+            square = ((x0 == x1) & (y1 == y2) & (x2 == x3) & (y3 == y0)) | \
+                     ((y0 == y1) & (x1 == x2) & (y2 == y3) & (x3 == x0))
+            kinds[candidates[closed & square]] = PATH_KIND_RECT
+
+        return PagePaths(
+            vertices=vertices,
+            part_offsets=part_offsets,
+            path_offsets=path_offsets,
+            part_kinds=kinds,
+            part_closed=np.frombuffer(self.part_closed, dtype=np.uint8).astype(bool),
+            stroke=np.frombuffer(self.stroke, dtype=np.uint8).astype(bool),
+            fill=np.frombuffer(self.fill, dtype=np.uint8).astype(bool),
+            evenodd=np.frombuffer(self.evenodd, dtype=np.uint8).astype(bool),
+            linewidths=np.frombuffer(self.linewidths, dtype=np.float64).copy(),
+            stroking_colors=np.array(self.scolors, dtype=np.float64).reshape(-1, 4),
+            stroking_color_sizes=np.frombuffer(self.scolor_sizes, dtype=np.int8).copy(),
+            non_stroking_colors=np.array(self.ncolors, dtype=np.float64).reshape(-1, 4),
+            non_stroking_color_sizes=np.frombuffer(self.ncolor_sizes, dtype=np.int8).copy(),
+            masks=np.frombuffer(self.masks, dtype=np.uint64).reshape(-1, self.num_words).copy(),
+            num_layers=self.num_layers,
+        )
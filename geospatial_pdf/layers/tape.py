@@ -0,0 +1,175 @@
+import logging
+
+from array import array
+
+from pdfminer.psparser import PSKeyword, PSEOF, keyword_name, literal_name
+from pdfminer.pdftypes import list_value, dict_value, stream_value, resolve1
+from pdfminer.pdfinterp import PDFContentParser, LITERAL_FORM
+
+logger = logging.getLogger(__name__)
+
+# N.B.
+# tokenizing content streams is the bulk of what pdfminer spends on a page, and it is done again
+# every time the page is parsed with different options( layers, laparams, compact.. )
+#
+# an OperatorTape is a content stream tokenized once:
+#   - opcodes, an index into the operator names of the store for every operator
+#   - operands, one flat list of all the operands, ends[i] is where the operands of operator i end
+# the tapes of a document are kept in an OperatorTapeStore, keyed by the object ids of the streams,
+# so pages sharing contents and forms drawn many times are only tokenized once.
+# replaying a tape feeds the interpreter the same operators with the same operands as execute would,
+# marked content and Do operators included, so every aggregator configuration works on it unchanged.
+#   - record_page also records the tapes of all the forms the page can draw, nested ones included
+#   - the document has to stay open, fonts, images and other resources still come from it
+#   - streams without an object id( and anything not recorded yet ) are tokenized as usual
+# GeospatialPDF( record_tapes=True ) in session.py keeps a store for an open file across parses
+
+
+class OperatorTape:
+
+    def __init__(self):
+        self.opcodes = array('H')
+        self.ends = array('l')
+        self.operands = []
+
+
+    def __len__(self):
+        return len(self.opcodes)
+
+
+    def __repr__(self):
+        return f'<OperatorTape: {len(self.opcodes)} operators, {len(self.operands)} operands>'
+
+
+class OperatorTapeStore:
+    """
+    per document store of tokenized content streams
+    """
+    def __init__(self):
+        self.tapes = {}
+        self.opnames = []
+        self.opcodes = {}
+        # per interpreter class, ( function, number of args ) for every opcode
+        self.dispatch_tables = {}
+
+
+    def __len__(self):
+        return len(self.tapes)
+
+
+    def get_key(self, streams):
+        key = []
+        for stream in list_value(streams):
+            objid = stream_value(stream).objid
+            if objid is None:
+                return None
+            key.append(objid)
+        return tuple(key)
+
+
+    def get_opcode(self, name):
+        if name not in self.opcodes:
+            self.opcodes[name] = len(self.opnames)
+            self.opnames.append(name)
+        return self.opcodes[name]
+
+
+    def tokenize(self, streams):
+        tape = OperatorTape()
+        try:
+            parser = PDFContentParser(list_value(streams))
+        except PSEOF:
+            # empty page
+            return tape
+        while True:
+            try:
+                (_, obj) = parser.nextobject()
+            except PSEOF:
+                break
+            if isinstance(obj, PSKeyword):
+                tape.opcodes.append(self.get_opcode(keyword_name(obj)))
+                tape.ends.append(len(tape.operands))
+            else:
+                tape.operands.append(obj)
+        return tape
+
+
+    def get_tape(self, streams, record=True):
+        """
+        the tape of the streams, tokenized now if it was not recorded yet and record is set,
+        None if the streams can't be kept in the store
+        """
+        key = self.get_key(streams)
+        if key is None:
+            return None
+        if key not in self.tapes:
+            if not record:
+                return None
+            self.tapes[key] = self.tokenize(streams)
+        return self.tapes[key]
+
+
+    def record_forms(self, tape, resources, seen):
+        Do_code = self.opcodes.get('Do', None)
+        if Do_code is None:
+            return
+        xobjmap = dict_value(resources.get('XObject', {})) if resources else {}
+        start = 0
+        for code, end in zip(tape.opcodes, tape.ends):
+            if code == Do_code and end > start:
+                xobjid = literal_name(tape.operands[end - 1])
+                xobj = stream_value(xobjmap[xobjid]) if xobjid in xobjmap else None
+                if xobj is not None and xobj.get('Subtype') is LITERAL_FORM and \
+                   xobj.objid is not None and xobj.objid not in seen:
+                    seen.add(xobj.objid)
+                    xobjres = xobj.get('Resources')
+                    form_resources = dict_value(xobjres) if xobjres else resources
+                    self.record_forms(self.get_tape([xobj]), form_resources, seen)
+            start = end
+
+
+    def record_page(self, page):
+        """
+        tokenizes the contents of the page and of all the forms it draws
+        """
+        tape = self.get_tape(page.contents)
+        if tape is None:
+            return
+        self.record_forms(tape, resolve1(page.resources), set())
+
+
+    def get_dispatch_table(self, interpreter):
+        cls = type(interpreter)
+        table = self.dispatch_tables.setdefault(cls, [])
+        # operators seen since the table was made
+        for name in self.opnames[len(table):]:
+            method = 'do_%s' % name.replace('*', '_a').replace('"', '_w').replace("'", '_q')
+            func = getattr(cls, method, None)
+            if func is None:
+                table.append(None)
+                continue
+            table.append((func, func.__code__.co_argcount - 1))
+        return table
+
+
+    def replay(self, interpreter, tape):
+        """
+        what PDFPageInterpreter.execute does with the tokens, from the tape
+        """
+        table = self.get_dispatch_table(interpreter)
+        operands = tape.operands
+        start = 0
+        for code, end in zip(tape.opcodes, tape.ends):
+            if end > start:
+                interpreter.argstack.extend(operands[start:end])
+                start = end
+            entry = table[code]
+            if entry is None:
+                continue
+            (func, nargs) = entry
+            if nargs:
+                args = interpreter.pop(nargs)
+                if len(args) == nargs:
+                    func(interpreter, *args)
+            else:
+                func(interpreter)
@@ -1,7 +1,10 @@
 import logging
 
-from pdfminer.psparser import LIT
-from pdfminer.pdftypes import resolve_all
+from fnmatch import fnmatchcase
+
+from pdfminer.psparser import LIT, PSLiteral, literal_name
+from pdfminer.pdftypes import resolve1, resolve_all, PDFObjRef, PDFStream
+from pdfminer.layout import LTImage
 from pdfminer.utils import decode_text
 
 logger = logging.getLogger(__name__)
@@ -9,6 +12,15 @@ logger = logging.getLogger(__name__)
 LITERAL_OCG = LIT('OCG')
 LITERAL_OCMD = LIT('OCMD')
 
+# N.B.
+# OCMDs are resolved against the OCGs which are on in each combo,
+#   - every OCG of the document gets a bit, a combo is the set of bits of the OCGs along its order map path
+#   - the /VE expression( or the /OCGs + /P policy if there is no /VE ) of an OCMD is compiled once per
+#     document into a predicate over such a bitset
+#   - per page, the predicates are evaluated for every combo, which gives the combo bitmask the
+#     aggregator uses for the OCMD, the same as for an OCG, see get_OCMD_masks
+# OCGs which are not in the OCProperties of the document are taken to be off
+
 # utf-16le is not a valid pdf text encoding, but it was used by ESRI folks
 def decode_text_special(s):
     if s.startswith(b"\xff\xfe"):
@@ -16,7 +28,216 @@ def decode_text_special(s):
     return decode_text(s)
 
 
-def get_OCG_info_from_doc(doc):
+def _get_obj_key(obj, keep_alive):
+    if isinstance(obj, PDFObjRef):
+        return ('objid', obj.objid)
+    # ids are only stable as long as the object lives
+    keep_alive.append(obj)
+    return ('id', id(obj))
+
+
+class OCInfoCache:
+    """
+    per document cache of decoded OCG/OCMD names, resolved page Properties maps and OC combos,
+    keyed by object id, or by the identity of the( document cached ) object for direct objects.
+    pages which share their resources by reference only pay for resolving them once
+    """
+    def __init__(self):
+        self.names = {}
+        self.page_maps = {}
+        self.OC_combos = {}
+        self.page_OCMDs = {}
+        self.OCMD_masks = {}
+        # OCG bit assignments, and the bits of all the OCGs sharing a name
+        self.OCG_bits = {}
+        self.OCG_name_bits = {}
+        self.OCMD_predicates = {}
+        self.keep_alive = []
+        self.hits = 0
+        self.misses = 0
+
+
+    def get_name(self, OC):
+        """
+        decoded name of an OCG/OCMD, given either the dictionary or a reference to it
+        """
+        OC_value = resolve1(OC)
+        key = _get_obj_key(OC_value, self.keep_alive)
+        if key not in self.names:
+            name = OC_value.get('Name', None)
+            if name is None:
+                # Name is optional for OCMDs
+                self.names[key] = f'unnamed {key[0]} {key[1]}'
+            else:
+                self.names[key] = decode_text_special(name)
+        return self.names[key]
+
+
+    def get_OCG_bit(self, OCG):
+        """
+        bit of the OCG in the active OCG bitsets, given either the dictionary or a reference to it
+        """
+        key = _get_obj_key(resolve1(OCG), self.keep_alive)
+        if key not in self.OCG_bits:
+            bit = 1 << len(self.OCG_bits)
+            self.OCG_bits[key] = bit
+            name = self.get_name(OCG)
+            self.OCG_name_bits[name] = self.OCG_name_bits.get(name, 0) | bit
+        return self.OCG_bits[key]
+
+
+    def get_combo_bits(self, combo):
+        """
+        bitset of the OCGs which are on in the combo
+        """
+        bits = 0
+        for name in combo:
+            bits |= self.OCG_name_bits.get(name, 0)
+        return bits
+
+
+    def compile_VE(self, VE):
+        value = resolve1(VE)
+        if not isinstance(value, list):
+            bit = self.get_OCG_bit(VE)
+            return lambda bits: (bits & bit) != 0
+
+        if len(value) == 0 or not isinstance(value[0], PSLiteral):
+            raise Exception(f'invalid visibility expression: {value}')
+        op = literal_name(value[0])
+        args = [ self.compile_VE(x) for x in value[1:] ]
+        if op == 'Not':
+            if len(args) != 1:
+                raise Exception(f'Not takes a single operand, got: {value}')
+            f = args[0]
+            return lambda bits: not f(bits)
+        if op == 'And':
+            return lambda bits: all(f(bits) for f in args)
+        if op == 'Or':
+            return lambda bits: any(f(bits) for f in args)
+        raise Exception(f'unknown visibility expression operator: {op}')
+
+
+    def compile_OCMD(self, OCMD):
+        """
+        predicate over active OCG bitsets, telling whether content in the OCMD is visible
+        """
+        if 'VE' in OCMD:
+            return self.compile_VE(OCMD['VE'])
+
+        OCGs = resolve1(OCMD.get('OCGs', None))
+        if OCGs is None:
+            OCGs = []
+        elif not isinstance(OCGs, list):
+            OCGs = [ OCMD['OCGs'] ]
+        mask = 0
+        for OCG in OCGs:
+            if resolve1(OCG) is None:
+                continue
+            mask |= self.get_OCG_bit(OCG)
+        # no OCGs, the OCMD has no effect
+        if mask == 0:
+            return lambda bits: True
+
+        policy = literal_name(resolve1(OCMD.get('P', LIT('AnyOn'))))
+        if policy == 'AllOn':
+            return lambda bits: (bits & mask) == mask
+        if policy == 'AnyOff':
+            return lambda bits: (bits & mask) != mask
+        if policy == 'AllOff':
+            return lambda bits: (bits & mask) == 0
+        if policy != 'AnyOn':
+            logger.warning(f'unknown OCMD visibility policy {policy}, using AnyOn')
+        return lambda bits: (bits & mask) != 0
+
+
+    def get_OCMD_predicate(self, OCMD):
+        key = _get_obj_key(resolve1(OCMD), self.keep_alive)
+        if key not in self.OCMD_predicates:
+            self.OCMD_predicates[key] = self.compile_OCMD(resolve1(OCMD))
+        return self.OCMD_predicates[key]
+
+
+    def get_properties_key(self, page):
+        properties = page.resources.get('Properties', None)
+        if properties is None:
+            return None
+        return _get_obj_key(properties, self.keep_alive)
+
+
+    def get_page_maps(self, page):
+        """
+        returns the ( layer name to OC name, OC reference to OC name ) maps for the page
+        """
+        key = self.get_properties_key(page)
+        if key in self.page_maps:
+            self.hits += 1
+            return self.page_maps[key]
+
+        self.misses += 1
+        properties = resolve1(page.resources.get('Properties', {}))
+        layer_name_to_OCs = {}
+        OC_ref_names = {}
+        OCMDs = {}
+        for prop_name, prop_ref in properties.items():
+            prop_value = resolve1(prop_ref)
+            if isinstance(prop_ref, PDFObjRef):
+                OC_ref_names[('objid', prop_ref.objid)] = prop_name
+            OC_ref_names[('id', id(prop_value))] = prop_name
+            self.keep_alive.append(prop_value)
+            if not isinstance(prop_value, dict):
+                continue
+            prop_type = prop_value.get('Type', None)
+            if prop_type is LITERAL_OCMD:
+                OCMDs[prop_name] = prop_ref
+                continue
+            if prop_type is not LITERAL_OCG:
+                continue
+            layer_name = self.get_name(prop_value)
+            layer_name_to_OCs[layer_name] = prop_name
+        self.page_maps[key] = (layer_name_to_OCs, OC_ref_names)
+        self.page_OCMDs[key] = OCMDs
+        return self.page_maps[key]
+
+
+    def get_OC_combos(self, page, combo_list):
+        """
+        combo_list converted to lists of OC names as used in the page content
+        """
+        key = (self.get_properties_key(page), id(combo_list))
+        if key not in self.OC_combos:
+            self.keep_alive.append(combo_list)
+            layer_name_to_OCs, _ = self.get_page_maps(page)
+            self.OC_combos[key] = [
+                [ layer_name_to_OCs[x] for x in l ]
+                for l in combo_list
+            ]
+        return self.OC_combos[key]
+
+
+    def get_OCMD_masks(self, page, combo_list):
+        """
+        map of the OC names of the OCMDs in the page Properties
+        to the bitmask of the combos of combo_list in which they are visible
+        """
+        key = (self.get_properties_key(page), id(combo_list))
+        if key not in self.OCMD_masks:
+            self.keep_alive.append(combo_list)
+            self.get_page_maps(page)
+            combo_bits = [ self.get_combo_bits(combo) for combo in combo_list ]
+            masks = {}
+            for prop_name, OCMD in self.page_OCMDs[key[0]].items():
+                predicate = self.get_OCMD_predicate(OCMD)
+                mask = 0
+                for i, bits in enumerate(combo_bits):
+                    if predicate(bits):
+                        mask |= (1 << i)
+                masks[prop_name] = mask
+            self.OCMD_masks[key] = masks
+        return self.OCMD_masks[key]
+
+
+def get_OCG_info_from_doc(doc, cache=None):
     OCPs = doc.catalog.get('OCProperties', None)
     if OCPs is None:
         return None, None
@@ -27,13 +248,15 @@ def get_OCG_info_from_doc(doc):
     if OCGs is None:
         return None, None
 
+    if cache is None:
+        cache = OCInfoCache()
     OCG_names = []
     for OCG in OCGs:
         #typ = OCG['Type']
         #if typ != KEYWORD_OCG:
         #    raise Exception(f'Unexpected type in OCG listing: {typ}')
-        OCG_name_raw = OCG['Name']
-        name = decode_text_special(OCG_name_raw)
+        name = cache.get_name(OCG)
+        cache.get_OCG_bit(OCG)
         OCG_names.append(name)
 
     default = OCPs.get('D', None)
@@ -45,18 +268,20 @@ def get_OCG_info_from_doc(doc):
     return OCG_names, order_list
 
 
-def get_order_map_from_list(order_list):
+def get_order_map_from_list(order_list, cache=None):
+    if cache is None:
+        cache = OCInfoCache()
     order_map = {}
     prev_key = None
     for item in order_list:
         if type(item) == list:
             if prev_key is None:
                 raise Exception('non list element expected before list element')
-            sub_map = get_order_map_from_list(item)
+            sub_map = get_order_map_from_list(item, cache=cache)
             order_map[prev_key] = sub_map
             prev_key = None
         else:
-            name = decode_text_special(item['Name'])
+            name = cache.get_name(item)
             order_map[name] = {}
             prev_key = name
     return order_map
@@ -74,18 +299,113 @@ def get_active_combos(order_map):
     full_list = []
     _get_active_combos_int(order_map, full_list, [])
     return full_list
+
+
+def _combo_matches(combo, pattern):
+    for i, name in enumerate(combo):
+        if fnmatchcase(name, pattern):
+            return True
+        if fnmatchcase('/'.join(combo[:i+1]), pattern):
+            return True
+    return False
+
+
+def filter_combos(combo_list, layers):
+    """
+    keep only the combos matching one of the names or glob patterns in layers,
+    patterns are matched against the names along the order map path of the combo
+    and against the '/' separated path itself, so 'Roads', 'Trans*/Roads' and 'Names' all work
+    """
+    if layers is None:
+        return combo_list
+    if isinstance(layers, str):
+        layers = [layers]
+
+    selected = []
+    for combo in combo_list:
+        if any(_combo_matches(combo, pattern) for pattern in layers):
+            selected.append(combo)
+    if len(selected) == 0:
+        logger.warning(f'none of the layers matched {layers}')
+    return selected
  
 
-def get_page_OC_map(page):
-    properties = resolve_all(page.resources['Properties'])
-    known_OCs = {}
-    layer_name_to_OCs = {}
-    for prop_name, prop_value in properties.items():
-        prop_type = prop_value['Type']
-        if prop_type not in [ LITERAL_OCG, LITERAL_OCMD ]:
-            continue
-        layer_name = decode_text_special(prop_value['Name'])
-        known_OCs[prop_name] = layer_name
-        layer_name_to_OCs[layer_name] = prop_name
+def get_page_OC_map(page, cache=None):
+    if cache is None:
+        cache = OCInfoCache()
+    layer_name_to_OCs, _ = cache.get_page_maps(page)
     return layer_name_to_OCs
- 
+
+
+def get_page_OC_ref_map(page, cache=None):
+    """
+    map of OCG/OCMD object ids and ids of the resolved OCG/OCMD dictionaries
+    to the OC name used for them in the page's Properties
+    """
+    if cache is None:
+        cache = OCInfoCache()
+    _, OC_ref_names = cache.get_page_maps(page)
+    return OC_ref_names
+
+
+def get_ref_OC_name(OC_ref_names, OC_ref):
+    if isinstance(OC_ref, PDFObjRef):
+        OC_name = OC_ref_names.get(('objid', OC_ref.objid), None)
+        if OC_name is not None:
+            return OC_name
+        OC_ref = resolve1(OC_ref)
+    return OC_ref_names.get(('id', id(OC_ref)), None)
+
+
+def _detach_object(obj, memo):
+    if isinstance(obj, PDFObjRef):
+        key = (obj.objid, 'ref')
+        if key not in memo:
+            # placeholder to break reference cycles
+            memo[key] = None
+            memo[key] = _detach_object(obj.resolve(), memo)
+        return memo[key]
+
+    if id(obj) in memo:
+        return memo[id(obj)]
+
+    if isinstance(obj, list):
+        detached = []
+        memo[id(obj)] = detached
+        detached.extend(_detach_object(x, memo) for x in obj)
+    elif isinstance(obj, dict):
+        detached = {}
+        memo[id(obj)] = detached
+        for k, v in obj.items():
+            detached[k] = _detach_object(v, memo)
+    elif isinstance(obj, PDFStream):
+        attrs = _detach_object(obj.attrs, memo)
+        if obj.rawdata is None:
+            detached = PDFStream(attrs, b'')
+            detached.data = obj.data
+            detached.rawdata = None
+        else:
+            rawdata = obj.rawdata
+            if obj.decipher:
+                rawdata = obj.decipher(obj.objid, obj.genno, rawdata, obj.attrs)
+            detached = PDFStream(attrs, rawdata)
+        detached.set_objid(obj.objid, obj.genno)
+        memo[id(obj)] = detached
+    else:
+        detached = obj
+    return detached
+
+
+def detach_layout(layout, memo=None):
+    """
+    replaces the document bound objects held by the layout( image streams, object references )
+    with standalone copies, so that the layout can be pickled after the file is closed
+    """
+    if memo is None:
+        memo = {}
+    if isinstance(layout, LTImage):
+        layout.stream = _detach_object(layout.stream, memo)
+        layout.colorspace = _detach_object(layout.colorspace, memo)
+    for obj in getattr(layout, '_objs', []):
+        detach_layout(obj, memo)
+    return layout
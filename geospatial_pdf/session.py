@@ -0,0 +1,295 @@
+import io
+import os
+import logging
+
+from pdfminer.psparser import LIT
+from pdfminer.pdftypes import PDFObjRef, dict_value, list_value, int_value
+from pdfminer.pdfinterp import PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+
+from .layers import PDFPageOptionalAggregator, PDFPageOptionalInterpreter
+from .layers.utils import OCInfoCache, filter_combos
+from .layers.forms import FormCache
+from .layers.tape import OperatorTapeStore
+from .layers.high_level import (_open_document,
+                                _get_combo_list,
+                                _get_static_clip,
+                                _process_layered_page)
+from .generictext import PDFPageGenericTextAggregator, PDFPageGenericTextInterpreter
+from .geospatial import (PDFPageOptionalGenericTextAggregator,
+                         PDFOptionalGenericTextInterpreter)
+from .geospatial.utils import get_page_viewports, get_page_neatline, NeatlineClip
+
+logger = logging.getLogger(__name__)
+
+LITERAL_PAGE = LIT('Page')
+LITERAL_PAGES = LIT('Pages')
+
+# N.B.
+# the high level parse functions open the file, build the xref, work out the OCG order map
+# and make a new resource manager( font cache ) on every call.
+# a GeospatialPDF does all of that once, and any number of parses of any pages can then be run on it
+#   - pages are looked up by walking down the page tree using the /Count of every node,
+#     files with a broken page tree fall back to enumerating all the pages once
+#   - the OCG information is only worked out on the first layered parse,
+#     generic text parsing works on files without layers too
+#   - form caches( see layers/forms.py ) are kept across parses, one per interpreter class
+#   - with record_tapes, content streams are only tokenized once for all the parses( see layers/tape.py ),
+#     for parsing a file with many aggregator configurations
+#   - everything is parsed in this process, use the high level functions for parsing with workers
+
+
+def _find_page(document, pno):
+    """
+    PDFPage pno of the document, found through the page tree counts, None if the tree doesn't add up
+    """
+    if 'Pages' not in document.catalog:
+        return None
+    kid_ref = document.catalog['Pages']
+    tree = dict_value(kid_ref).copy()
+    # same inheritance as PDFPage.create_pages
+    for (k, v) in document.catalog.items():
+        if k in PDFPage.INHERITABLE_ATTRS and k not in tree:
+            tree[k] = v
+    while tree.get('Type') is LITERAL_PAGES:
+        for kid_ref in list_value(tree.get('Kids', [])):
+            kid = dict_value(kid_ref)
+            if kid.get('Type') is LITERAL_PAGE:
+                count = 1
+            elif 'Count' in kid:
+                count = int_value(kid['Count'])
+            else:
+                return None
+            if pno < count:
+                break
+            pno -= count
+        else:
+            return None
+        if not isinstance(kid_ref, PDFObjRef):
+            return None
+        parent = tree
+        tree = kid.copy()
+        for (k, v) in parent.items():
+            if k in PDFPage.INHERITABLE_ATTRS and k not in tree:
+                tree[k] = v
+    if tree.get('Type') is not LITERAL_PAGE or pno != 0:
+        return None
+    return PDFPage(document, kid_ref.objid, tree)
+
+
+class GeospatialPDF:
+    """
+    an open pdf to run layered, generic text and geospatial parses on, any number of times
+
+    :param source: path of the file, the file contents as bytes, or a buffer/binary file object
+        to read from( an mmap works without copying the file into memory )
+    :param password: to decrypt the file with
+    :param record_tapes: keep the tokenized content streams around for the next parses
+    """
+    def __init__(self, source, password='', record_tapes=False):
+        self.file = None
+        if isinstance(source, (str, os.PathLike)):
+            self.name = os.fspath(source)
+            self.file = open(source, "rb")
+            fp = self.file
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            self.name = '<bytes>'
+            fp = io.BytesIO(source)
+        else:
+            self.name = getattr(source, 'name', '<buffer>')
+            fp = source
+
+        self.document = _open_document(fp, self.name, password=password)
+        self.rsrcmgr = PDFResourceManager(caching=True)
+        self.OC_cache = OCInfoCache()
+        self.tape_store = OperatorTapeStore() if record_tapes else None
+        self.pages = {}
+        self._num_pages = None
+        self._all_combos = None
+        self.combo_lists = {}
+        self.form_caches = {}
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+    def __len__(self):
+        return self.num_pages
+
+
+    @property
+    def num_pages(self):
+        if self._num_pages is None:
+            pages = self.document.catalog.get('Pages', None)
+            count = dict_value(pages).get('Count', None) if pages is not None else None
+            if count is None:
+                self.load_all_pages()
+            else:
+                self._num_pages = int_value(count)
+        return self._num_pages
+
+
+    def load_all_pages(self):
+        pno = -1
+        for pno, page in enumerate(PDFPage.create_pages(self.document)):
+            self.pages.setdefault(pno, page)
+        self._num_pages = pno + 1
+
+
+    def get_page(self, pno):
+        """
+        PDFPage at index pno, without going through the pages before it
+        """
+        if pno < 0 or pno >= self.num_pages:
+            raise IndexError(f'page {pno} out of range, the file has {self.num_pages} pages')
+        if pno not in self.pages:
+            page = _find_page(self.document, pno)
+            if page is None:
+                logger.warning('page tree counts are off, enumerating all the pages')
+                self.load_all_pages()
+                if pno not in self.pages:
+                    raise IndexError(f'page {pno} out of range, the file has {self.num_pages} pages')
+            else:
+                self.pages[pno] = page
+        return self.pages[pno]
+
+
+    def iter_pages(self, pnos=None):
+        """
+        yields ( pno, PDFPage ) for the given page numbers, all the pages if not given
+        """
+        if pnos is None:
+            pnos = range(self.num_pages)
+        for pno in pnos:
+            yield pno, self.get_page(pno)
+
+
+    def get_combo_list(self, layers=None):
+        """
+        the OCG combos of the file, restricted to layers, see filter_combos
+        """
+        if self._all_combos is None:
+            self._all_combos = _get_combo_list(self.document, self.OC_cache)
+        # the OC cache keys combos by identity, so hand out the same list for the same selection
+        key = layers if layers is None or isinstance(layers, str) else tuple(layers)
+        if key not in self.combo_lists:
+            self.combo_lists[key] = filter_combos(self._all_combos, layers)
+        return self.combo_lists[key]
+
+
+    def setup_interpreter(self, interpreter, cache_forms=False, symbol_max_size=None):
+        if self.tape_store is not None:
+            interpreter.set_tape_store(self.tape_store)
+        if cache_forms or symbol_max_size is not None:
+            # recordings depend on what the interpreter class sends to the device
+            key = (type(interpreter), symbol_max_size)
+            if key not in self.form_caches:
+                self.form_caches[key] = FormCache(symbol_max_size=symbol_max_size)
+            interpreter.set_form_cache(self.form_caches[key])
+
+
+    def iter_layered_pages(self,
+                           pnos=None,
+                           AggregatorClass=PDFPageOptionalAggregator,
+                           InterpreterClass=PDFPageOptionalInterpreter,
+                           laparams=None,
+                           compact=False,
+                           layers=None,
+                           layers_only=False,
+                           clip=None,
+                           clip_partial=True,
+                           path_store=False,
+                           path_tolerance=None,
+                           cache_forms=False,
+                           symbol_max_size=None):
+        """
+        yields (pno, {layer_name: layout}) for the given page numbers, all the pages if not given.
+        the rest of the arguments are as in iter_layered_pdf_pages
+        """
+        combo_list = self.get_combo_list(layers)
+        device = AggregatorClass(self.rsrcmgr, laparams=laparams,
+                                 compact=compact, layers_only=layers_only,
+                                 clip=_get_static_clip(clip), clip_partial=clip_partial,
+                                 path_store=path_store, path_tolerance=path_tolerance)
+        interpreter = InterpreterClass(self.rsrcmgr, device)
+        self.setup_interpreter(interpreter, cache_forms=cache_forms, symbol_max_size=symbol_max_size)
+        for pno, page in self.iter_pages(pnos):
+            # keep the LTPage ids the same as a run over the whole file
+            device.pageno = pno + 1
+            layer_info = _process_layered_page(page, device, interpreter,
+                                               combo_list, self.OC_cache,
+                                               compact, layers_only,
+                                               clip, clip_partial)
+            yield pno, layer_info
+            del layer_info
+
+
+    def parse_layered(self, pnos=None, **kwargs):
+        """
+        {pno: {layer_name: layout}}, see iter_layered_pages
+        """
+        return dict(self.iter_layered_pages(pnos, **kwargs))
+
+
+    def iter_geospatial_pages(self, pnos=None, crop_to_neatline=False, **kwargs):
+        """
+        iter_layered_pages with the geospatial aggregator,
+        crop_to_neatline is as in iter_geospatial_pdf_pages
+        """
+        if crop_to_neatline:
+            kwargs['clip'] = NeatlineClip(kwargs.get('clip', None))
+        return self.iter_layered_pages(pnos,
+                                       AggregatorClass=PDFPageOptionalGenericTextAggregator,
+                                       InterpreterClass=PDFOptionalGenericTextInterpreter,
+                                       **kwargs)
+
+
+    def parse_geospatial(self, pnos=None, **kwargs):
+        """
+        {pno: {layer_name: layout}}, see iter_geospatial_pages
+        """
+        return dict(self.iter_geospatial_pages(pnos, **kwargs))
+
+
+    def iter_generic_text_pages(self, pnos=None, clip=None, clip_partial=True):
+        """
+        yields (pno, layout) of the generic text parse of the given pages, see parse_generic_text_pdf_file
+        """
+        device = PDFPageGenericTextAggregator(self.rsrcmgr, clip=clip, clip_partial=clip_partial)
+        interpreter = PDFPageGenericTextInterpreter(self.rsrcmgr, device)
+        for pno, page in self.iter_pages(pnos):
+            device.pageno = pno + 1
+            interpreter.process_page(page)
+            yield pno, device.get_result()
+
+
+    def parse_generic_text(self, pnos=None, **kwargs):
+        """
+        {pno: layout}, see iter_generic_text_pages
+        """
+        return dict(self.iter_generic_text_pages(pnos, **kwargs))
+
+
+    def get_viewports(self, pno):
+        """
+        [Viewport, ..] of the page, empty if it is not georeferenced
+        """
+        return get_page_viewports(self.get_page(pno))
+
+
+    def get_neatline(self, pno):
+        """
+        neatline of the page in layout space, None if it is not georeferenced
+        """
+        return get_page_neatline(self.get_viewports(pno))